@@ -0,0 +1,87 @@
+# ================= SHARED ASSETS =================
+# ฟอนต์และรูปภาพโหลดครั้งเดียวต่อ process แล้วใช้ร่วมกันทุก session ทุกหน้าและทุกเอกสาร
+# (Streamlit รัน main.py ใหม่ทุก rerun แต่ module นี้และ cache ของมันอยู่ตลอดอายุ process)
+# path แบบสัมพัทธ์อ้างจากโฟลเดอร์ของแอป จึงไม่ขึ้นกับ working directory
+import io
+import os
+from functools import lru_cache
+
+from PIL import Image
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+ASSET_DIR = os.path.dirname(os.path.abspath(__file__))
+FALLBACK_FONT = 'Helvetica-Bold'
+PRINT_DPI = 200   # ความละเอียดของรูปที่ฝังใน PDF เมื่อพิมพ์ที่ขนาดจริง
+COMPACT_DPI = 100  # ความละเอียดของรูปในโหมด PDF ขนาดเล็ก (ส่งให้คนขับทางมือถือ/เก็บถาวร)
+JPEG_QUALITY = 85
+
+
+def asset_path(path):
+    return path if os.path.isabs(path) else os.path.join(ASSET_DIR, path)
+
+
+@lru_cache(maxsize=None)
+def font(name, path):
+    """Register the TTF at path as name once per process; FALLBACK_FONT if it cannot be loaded."""
+    try:
+        pdfmetrics.getFont(name)
+        return name
+    except KeyError:
+        pass
+    try:
+        if os.path.exists(asset_path(path)):
+            pdfmetrics.registerFont(TTFont(name, asset_path(path)))
+            return name
+    except Exception:
+        pass
+    return FALLBACK_FONT
+
+
+def _scaled(path, width, height, dpi):
+    with Image.open(path) as im:
+        im.load()
+        target = (max(1, round(width / 72 * dpi)), max(1, round((height or width) / 72 * dpi)))
+        if im.width > target[0] or im.height > target[1]:
+            return im.resize((min(im.width, target[0]), min(im.height, target[1])), Image.LANCZOS)
+        return im.copy()
+
+
+@lru_cache(maxsize=16)
+def image(path, width, height=None, dpi=PRINT_DPI):
+    """Decoded ImageReader of path, downscaled to width x height points at dpi; None if missing.
+
+    The pixels are decoded up front so concurrent renders only read them.
+    """
+    path = asset_path(path)
+    if not os.path.exists(path): return None
+    reader = ImageReader(_scaled(path, width, height, dpi))
+    reader.getRGBData()
+    reader.getTransparent()
+    return reader
+
+
+@lru_cache(maxsize=16)
+def jpeg(path, width, height=None, dpi=COMPACT_DPI, quality=JPEG_QUALITY):
+    """JPEG bytes of path downscaled like image() and flattened onto white; None if missing."""
+    path = asset_path(path)
+    if not os.path.exists(path): return None
+    im = _scaled(path, width, height, dpi)
+    if im.mode in ("RGBA", "LA", "P"):
+        im = im.convert("RGBA")
+        flat = Image.new("RGB", im.size, "white")
+        flat.paste(im, mask=im.getchannel("A"))
+        im = flat
+    buf = io.BytesIO()
+    im.convert("RGB").save(buf, "JPEG", quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def compact_image(path, width, height=None):
+    """ImageReader over jpeg(): reportlab embeds the JPEG as is (DCTDecode), with no alpha mask.
+
+    A new reader per call, because the reader reads from a shared file position.
+    """
+    data = jpeg(path, width, height)
+    return ImageReader(io.BytesIO(data)) if data else None
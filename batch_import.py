@@ -0,0 +1,267 @@
+# ================= BATCH IMPORT =================
+# สร้างบิลจากไฟล์ manifest (CSV หรือ JSONL) โดยไม่ต้องกรอกผ่านหน้าแอป เช่นใบโหลดสินค้าประจำวันจากคลัง
+#   python batch_import.py manifest.csv --prefix JPP --pdf JPP-manifest.zip
+# CSV: หนึ่งแถวต่อรายการสินค้า คอลัมน์คือ date, ชื่อฟิลด์ใน TRANSPORT_FIELDS, product/unit/qty/tank/seal
+#   และ ref (ไม่บังคับ) แถวติดกันที่ ref เหมือนกันรวมเป็นบิลเดียว (ข้อมูลขนส่งใช้จากแถวแรก); ไม่มี ref = แถวละบิล
+# JSONL: บรรทัดละบิล {"date": "dd/mm/YYYY", "<ฟิลด์>": ..., "items": [{"product": ..., "qty": ...}, ...]}
+# อ่าน ออกเลข บันทึก และสร้าง PDF ทีละชุด (--chunk บิล) หน่วยความจำจึงคงที่ไม่ว่าไฟล์จะใหญ่เท่าไร
+# บิลที่ไม่ผ่านการตรวจถูกข้ามและเขียนลงไฟล์ --rejects พร้อมเหตุผล บิลอื่นบันทึกต่อตามปกติ
+# รันไฟล์เดิมซ้ำจะได้บิลชุดใหม่อีกชุด ใช้ --dry-run ตรวจไฟล์ก่อนได้
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+import time
+import tomllib
+from datetime import date, datetime
+
+import bulk_export
+import invoice_pdf
+import storage
+from sheet_store import ITEM_FIELDS, TRANSPORT_FIELDS
+
+CHUNK_SIZE = 200
+REF = "ref"
+DATE_FORMATS = ("%d/%m/%Y", "%Y-%m-%d")
+# ปีที่รับได้: ปี พ.ศ. (เช่น 2569) จะได้เลขบิลอย่าง JPP-2569-10-0001 จึงปฏิเสธ
+YEARS = range(2000, 2100)
+BE_OFFSET = 543
+CSV_COLUMNS = {REF, "date", *TRANSPORT_FIELDS, *ITEM_FIELDS}
+
+
+# ================= READING =================
+def read_csv(fh):
+    """(line, record) per invoice of a CSV manifest, grouping consecutive rows with the same ref.
+
+    The header is checked up front: unknown columns raise ValueError.
+    """
+    reader = csv.DictReader(fh)
+    unknown = [c for c in reader.fieldnames or [] if c not in CSV_COLUMNS]
+    if unknown: raise ValueError(f"unknown columns: {', '.join(unknown)}")
+    return _csv_records(reader)
+
+
+def _csv_records(reader):
+    record, line, ref = None, 0, None
+    for row in reader:
+        row_ref = (row.get(REF) or "").strip()
+        item = {k: row.get(k) for k in ITEM_FIELDS}
+        if record is not None and row_ref and row_ref == ref:
+            record["items"].append(item)
+            continue
+        if record is not None: yield line, record
+        record = {k: v for k, v in row.items() if k not in ITEM_FIELDS}
+        record["items"] = [item]
+        line, ref = reader.line_num, row_ref
+    if record is not None: yield line, record
+
+
+def read_jsonl(fh):
+    """Yield (line, record) per non-empty line of a JSONL manifest (a ValueError for lines that are not objects)."""
+    for line, text in enumerate(fh, start=1):
+        if not text.strip(): continue
+        try:
+            record = json.loads(text)
+            if not isinstance(record, dict): raise ValueError("not a JSON object")
+        except ValueError as e:
+            record = ValueError(f"invalid JSON: {e}")
+        yield line, record
+
+
+def parse_date(text, default):
+    text = str(text or "").strip()
+    if not text: return default
+    for fmt in DATE_FORMATS:
+        try: day = datetime.strptime(text, fmt).date()
+        except ValueError: continue
+        if day.year in YEARS: return day
+        if day.year - BE_OFFSET in YEARS:
+            raise ValueError(f"bad date {text!r}: {day.year} is a Buddhist-era year, use {day.year - BE_OFFSET}")
+        raise ValueError(f"bad date {text!r}: year out of range")
+    raise ValueError(f"bad date {text!r} (dd/mm/YYYY)")
+
+
+def validate(record, default_date):
+    """(date, data, items) of one manifest invoice; raises ValueError with the reason to reject it."""
+    if isinstance(record, Exception): raise record
+    # csv.DictReader เก็บช่องที่เกินจำนวนคอลัมน์ของหัวตารางไว้ใต้ key None
+    if None in record: raise ValueError(f"{len(record[None])} more cells than the header")
+    unknown = [k for k in record if k not in CSV_COLUMNS and k != "items"]
+    if unknown: raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    day = parse_date(record.get("date"), default_date)
+    data = {f: str(record.get(f) or "").strip() for f in TRANSPORT_FIELDS}
+    data["date"] = day.strftime("%d/%m/%Y")
+    raw_items = record.get("items")
+    if raw_items is None: raw_items = [{k: record[k] for k in ITEM_FIELDS if k in record}]
+    if not isinstance(raw_items, list): raise ValueError("items must be a list")
+    items = []
+    for n, it in enumerate(raw_items, start=1):
+        if not isinstance(it, dict): raise ValueError(f"item {n}: not an object")
+        extra = [k for k in it if k not in ITEM_FIELDS]
+        if extra: raise ValueError(f"item {n}: unknown fields: {', '.join(extra)}")
+        item = {k: str(it.get(k) if it.get(k) is not None else "").strip() for k in ITEM_FIELDS}
+        if not any(item.values()): continue
+        if not item["product"]: raise ValueError(f"item {n}: product is required")
+        try: qty = float(item["qty"].replace(",", ""))
+        except ValueError: qty = math.nan
+        if not math.isfinite(qty): raise ValueError(f"item {n}: bad qty {item['qty']!r}")
+        if qty <= 0: raise ValueError(f"item {n}: qty must be positive")
+        items.append(item)
+    if not items: raise ValueError("no items")
+    return day, data, items
+
+
+# ================= IMPORT =================
+def import_invoices(records, store, prefix, default_date=None, chunk_size=CHUNK_SIZE, reject=None, stats=None, dry_run=False):
+    """Validate, number and save manifest invoices chunk by chunk; yield (inv_no, items, data) once saved.
+
+    Numbers are PREFIX-YYYY-MM-NNNN from the month of each invoice's date,
+    allocated per chunk in one transaction. reject(line, reason) is called
+    for every invoice that fails validation. stats counts read/saved/rejected.
+    """
+    default_date = default_date or date.today()
+    stats = stats if stats is not None else {}
+    for key in ("read", "saved", "rejected"): stats.setdefault(key, 0)
+    chunk = []
+    for line, record in records:
+        stats["read"] += 1
+        try:
+            chunk.append(validate(record, default_date))
+        except ValueError as e:
+            stats["rejected"] += 1
+            if reject: reject(line, str(e))
+        if len(chunk) >= chunk_size:
+            yield from _save_chunk(chunk, store, prefix, stats, dry_run)
+            chunk = []
+    if chunk: yield from _save_chunk(chunk, store, prefix, stats, dry_run)
+
+
+def _save_chunk(chunk, store, prefix, stats, dry_run):
+    if dry_run:
+        stats["saved"] += len(chunk)
+        return
+    prefixes = [f"{prefix}-{day.year}-{day.month:02d}" for day, _, _ in chunk]
+    numbers = {p: iter(store.next_numbers(p, prefixes.count(p))) for p in dict.fromkeys(prefixes)}
+    jobs = []
+    for p, (_, data, items) in zip(prefixes, chunk):
+        inv_no = next(numbers[p])
+        jobs.append((inv_no, items, data))
+    store.save_invoices([(no, [no, data["date"]] + [data[f] for f in TRANSPORT_FIELDS], items) for no, items, data in jobs])
+    stats["saved"] += len(jobs)
+    yield from jobs
+
+
+class Progress:
+    """One status line: rewritten in place on a terminal, one line per update otherwise (logs, pipes)."""
+
+    def __init__(self, out):
+        self.out = out
+        self.tty = out.isatty()
+        self.open = False
+
+    def update(self, text):
+        if self.tty: self.out.write(f"\r{text}\x1b[K")   # \x1b[K ลบตัวอักษรเก่าที่ยาวกว่าบรรทัดใหม่
+        else: self.out.write(text + "\n")
+        self.open = self.tty
+        self.out.flush()
+
+    def end(self):
+        """Finish the status line so the next message starts on a line of its own."""
+        if self.open: self.out.write("\n")
+        self.open = False
+
+
+def open_store(secrets_path):
+    secrets = {}
+    if os.path.exists(secrets_path):
+        with open(secrets_path, "rb") as fh:
+            secrets = tomllib.load(fh)
+    # ไม่เริ่ม thread คิวเขียนเบื้องหลัง: เขียนลงชีทเองตอนท้ายด้วย flush_pending() (หรือปล่อยให้แอปเขียนเมื่อใช้ --no-wait)
+    return storage.open_store(secrets, background=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create invoices from a CSV or JSONL manifest without the UI")
+    parser.add_argument("manifest", help="CSV (one row per item) or JSONL (one invoice per line); - reads CSV from stdin")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="manifest format (default: from the file extension)")
+    parser.add_argument("--prefix", default="JPP", help="invoice number prefix (numbers are PREFIX-YYYY-MM-NNNN)")
+    parser.add_argument("--date", help="date for rows without one (dd/mm/YYYY, default today)")
+    parser.add_argument("--pdf", help="also render every imported invoice into this ZIP of PDFs")
+    parser.add_argument("--layout", choices=sorted(invoice_pdf.LAYOUTS), default="single")
+    parser.add_argument("--copy-labels", help='labels of the copies separated by "|" (one page per label)')
+    parser.add_argument("--compact", action="store_true", help="smaller PDFs (JPEG logo at lower resolution)")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="invoices numbered and saved per batch")
+    parser.add_argument("--rejects", help="write rejected invoices (line, reason) to this JSONL file")
+    parser.add_argument("--dry-run", action="store_true", help="only validate the manifest")
+    parser.add_argument("--no-wait", action="store_true", help="leave the Google Sheets writes to the app's background queue")
+    parser.add_argument("--secrets", default=".streamlit/secrets.toml", help="store settings as in the app (JP_STORAGE etc. also apply)")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("jsonl" if args.manifest.endswith((".jsonl", ".ndjson")) else "csv")
+    try: default_date = parse_date(args.date, date.today())
+    except ValueError as e: parser.error(str(e))
+    store = None
+    if not args.dry_run:
+        store = open_store(args.secrets)
+        store.refresh()   # ให้การออกเลขเห็นบิลล่าสุดของเครื่องอื่นก่อน
+
+    stats = {"pdf": 0}
+    saved = "valid" if args.dry_run else "saved"
+    started = time.perf_counter()
+
+    progress = Progress(sys.stderr)
+
+    def report(pdf=None):
+        if pdf is not None: stats["pdf"] = pdf
+        rate = stats.get("saved", 0) / max(time.perf_counter() - started, 1e-9)
+        pdfs = f" · {stats['pdf']} PDFs" if args.pdf else ""
+        progress.update(f"{stats.get('read', 0)} read · {stats.get('saved', 0)} {saved} · {stats.get('rejected', 0)} rejected{pdfs}"
+                        f" · {rate:.1f} invoices/sec")
+
+    pdf_stats = None
+    rejects = open(args.rejects, "w", encoding="utf-8") if args.rejects else None
+
+    def reject(line, reason):
+        if rejects: rejects.write(json.dumps({"line": line, "reason": reason}, ensure_ascii=False) + "\n")
+        else:
+            progress.end()
+            print(f"line {line}: {reason}", file=sys.stderr)
+
+    fh = sys.stdin if args.manifest == "-" else open(args.manifest, encoding="utf-8-sig", newline="")
+    try:
+        try:
+            records = read_jsonl(fh) if fmt == "jsonl" else read_csv(fh)
+        except ValueError as e:
+            print(f"{args.manifest}: {e}", file=sys.stderr)
+            return 2
+        jobs = import_invoices(records, store, args.prefix, default_date, args.chunk, reject, stats, args.dry_run)
+        if args.pdf and not args.dry_run:
+            pdf_stats = bulk_export.export(jobs, args.pdf, "zip", invoice_pdf.layout(args.layout, args.copy_labels, args.compact),
+                                           args.workers, progress=report)
+        else:
+            for n, _ in enumerate(jobs, start=1):
+                if n % args.chunk == 0: report()
+    finally:
+        if fh is not sys.stdin: fh.close()
+        if rejects: rejects.close()
+    report()
+    progress.end()
+    elapsed = time.perf_counter() - started
+    print(f"{stats['saved']} invoices {saved}, {stats['rejected']} rejected"
+          f" in {elapsed:.1f}s ({stats['saved'] / max(elapsed, 1e-9):.1f} invoices/sec)", file=sys.stderr)
+    if pdf_stats:
+        print(f"{pdf_stats['count']} PDFs -> {args.pdf}, {pdf_stats['bytes'] / 1024:,.0f} KB "
+              f"({pdf_stats['bytes_per_invoice'] / 1024:.1f} KB/invoice)", file=sys.stderr)
+    if store is not None and not args.no_wait and store.pending_count():
+        store.flush_pending(lambda n: progress.update(f"writing to Google Sheets: {n} pending"))
+        progress.end()
+    failed = store.failed_count() if store is not None else 0
+    if failed: print(f"{failed} saves failed to reach Google Sheets (retry from the app)", file=sys.stderr)
+    return 1 if stats["rejected"] or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+# ================= BENCHMARKS =================
+# วัดความเร็วของงานหลัก (สร้าง PDF, ออกเลขที่บิล, sync/โหลดข้อมูล, ค้นหา/เลือกบิล)
+# กับชีทจำลองในหน่วยความจำ (fake_sheets) ขนาด 1k/10k/100k บิล โดยไม่ต้องต่อ Google Sheets
+# รันจากโฟลเดอร์ของแอป (ต้องใช้ฟอนต์และโลโก้):
+#   python benchmark.py --sizes 1000 10000 --save-baseline     บันทึกค่าอ้างอิง
+#   python benchmark.py --sizes 1000 10000 --check             เทียบกับค่าอ้างอิง (exit 1 ถ้าช้าลงเกินเกณฑ์)
+# ค่าอ้างอิงขึ้นกับเครื่อง ควรบันทึกใหม่บนเครื่อง CI ที่ใช้เทียบจริง
+import argparse
+import gc
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+import numpy as np
+
+import fake_sheets
+import invoice_pdf
+import invoice_search
+import master_data
+import partitions
+import reports
+import storage
+from sheet_store import INV_KEY, INV_HEADER, ITEM_FIELDS
+
+BASELINE_PATH = "benchmark_baseline.json"
+SIZES = (1000, 10000, 100000)
+TOLERANCE = 1.5          # ช้าลง/ใช้หน่วยความจำมากขึ้นเกินกี่เท่าของค่าอ้างอิงจึงนับว่าถอยหลัง
+MIN_REGRESSION_MS = 2.0  # งานที่เร็วมากผันผวนตามเครื่อง ไม่นับถ้าต่างกันไม่ถึงค่านี้
+BYTES_TOLERANCE = 1.05   # ขนาด PDF ต่อบิล/ต่อหน้าไม่ขึ้นกับเครื่อง จึงใช้เกณฑ์เข้มกว่า
+
+
+def measure(fn, repeat, setup=None):
+    """Latency percentiles (ms) over repeat runs, plus the peak traced allocation of one extra run."""
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        gc.collect()
+        started = time.perf_counter()
+        fn(arg) if setup else fn()
+        times.append((time.perf_counter() - started) * 1000)
+    arg = setup() if setup else None
+    tracemalloc.start()
+    try:
+        fn(arg) if setup else fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    p50, p95, p99 = np.percentile(times, [50, 95, 99])
+    return {"n": repeat, "p50_ms": round(p50, 3), "p95_ms": round(p95, 3), "p99_ms": round(p99, 3),
+            "mean_ms": round(float(np.mean(times)), 3), "peak_kb": round(peak / 1024, 1)}
+
+
+# ================= SIZE-DEPENDENT OPERATIONS =================
+def bench_size(n, workdir, repeat):
+    rnd = random.Random(n)
+    ss = fake_sheets.populate(n, end=date.today())
+    ws_inv = ss.worksheet(storage.INV_SHEET)
+    keys = [r[0] for r in ws_inv.rows[1:]]
+    hot = set(partitions.hot_months())
+    hot_keys = [k for k in keys if partitions.month_of(k) in hot]
+    old_month = partitions.month_of(keys[0])
+    prefix = fake_sheets.month_prefix(keys[-1])
+    results = {}
+
+    # ---------- Google Sheets backend (mirror) ----------
+    fresh = iter(range(10 ** 6))
+
+    def fresh_mirror():
+        return storage.SheetsStore(ss, os.path.join(workdir, f"mirror_{n}_{next(fresh)}.sqlite"))
+    results["mirror_full_sync"] = measure(lambda s: s.refresh(), max(1, repeat // 10), setup=fresh_mirror)
+    sheets = fresh_mirror()
+    sheets.refresh()
+
+    ws_item = ss.worksheet(storage.ITEM_SHEET)
+
+    def append_one():
+        # บิลใหม่จากเครื่องอื่น: ต่อท้ายทั้งหัวบิลและรายการสินค้า
+        inv_no = f"{prefix}-9{len(ws_inv.rows):05d}"
+        ws_inv.rows.append(fake_sheets.invoice_row(inv_no, "01/01/2030", rnd))
+        ws_item.rows.append(fake_sheets.item_row(inv_no, rnd))
+    results["mirror_incremental_sync"] = measure(lambda _: sheets.refresh(), repeat, setup=append_one)
+    results["load_frames"] = measure(sheets.load_frames, max(1, repeat // 5))
+    # หน้าแอปโหลดเฉพาะเดือนล่าสุด เดือนเก่าโหลดเมื่อเลือกดู
+    results["load_hot_months"] = measure(lambda: sheets.load_frames(partitions.hot_months()), max(1, repeat // 5))
+    results["older_months"] = measure(sheets.older_months, repeat)
+    if old_month not in hot:
+        results["load_month"] = measure(lambda _: sheets.load_month(old_month), max(1, repeat // 5), setup=sheets._months.clear)
+    inv_df, item_df = sheets.load_frames()
+
+    results["next_number"] = measure(lambda: sheets.next_number(prefix), repeat)
+
+    # ---------- bill picker ----------
+    results["search_index_build"] = measure(lambda: invoice_search.InvoiceSearchIndex(inv_df), max(1, repeat // 5))
+    index = invoice_search.InvoiceSearchIndex(inv_df)
+    queries = [rnd.choice(keys)[-6:] for _ in range(8)] + ["ปิโตร", "สยาม", "T00", ""]
+    results["search_query"] = measure(lambda q: index.search(q), repeat, setup=lambda: rnd.choice(queries))
+
+    # ---------- selected invoice lookup ----------
+    # boolean mask ทั้งเฟรม (แบบเดิม) เทียบกับการค้นผ่าน index ของ store (และ frames_lookup ด้านล่าง)
+    def frame_lookup(no):
+        row = inv_df[inv_df[INV_KEY] == no].iloc[0].to_dict()
+        return row, item_df[item_df[INV_KEY] == no].to_dict('records')
+    results["frame_lookup"] = measure(frame_lookup, repeat, setup=lambda: rnd.choice(keys))
+    results["store_lookup"] = measure(sheets.get_invoice, repeat, setup=lambda: rnd.choice(keys))
+
+    # ---------- local SQLite backend ----------
+    db_path = os.path.join(workdir, f"store_{n}.sqlite")
+    local = storage.SqliteStore(db_path)
+    results["sqlite_import"] = measure(lambda: storage.import_from_sheets(ss, local), max(1, repeat // 10))
+    results["sqlite_load_frames"] = measure(local.load_frames, max(1, repeat // 5))
+    results["sqlite_lookup"] = measure(local.get_invoice, repeat, setup=lambda: rnd.choice(keys))
+    results["sqlite_next_number"] = measure(lambda: local.next_number(prefix), repeat)
+    sample = inv_df.iloc[0].tolist()
+    results["sqlite_save"] = measure(lambda no: local.save_invoice(no, [no] + sample[1:len(INV_HEADER)], [dict.fromkeys(ITEM_FIELDS, "1")] * 3),
+                                     repeat, setup=lambda: rnd.choice(keys))
+
+    # ---------- shared frames after a save (แก้เฉพาะบิลที่เปลี่ยน แทน load_frames ทั้งหมด) ----------
+    frames = storage.FrameCache(local)
+    frames.get(local.refresh())
+
+    def save_one():
+        no = rnd.choice(hot_keys)
+        local.save_invoice(no, [no] + sample[1:len(INV_HEADER)], [dict.fromkeys(ITEM_FIELDS, "2")] * 3)
+    results["frames_patch"] = measure(lambda _: frames.get(local.refresh()), repeat, setup=save_one)
+    frames.lookup(hot_keys[0])
+    results["frames_lookup"] = measure(frames.lookup, repeat, setup=lambda: rnd.choice(hot_keys))
+
+    # ---------- master data autofill (สร้างครั้งแรก, ตาม patch ทีละบิล, ค้นด้วยคำขึ้นต้น) ----------
+    results["master_build"] = measure(lambda: master_data.MasterIndex().sync(frames), max(1, repeat // 5))
+    master = master_data.MasterIndex().sync(frames)
+    results["master_patch"] = measure(lambda _: master.sync(frames), repeat, setup=lambda: (save_one(), frames.get(local.refresh())))
+    lookups = [(g, q) for g in master_data.GROUPS for q in ("", "ปิโตร", "1", "ชื่อ 5")]
+    results["master_lookup"] = measure(lambda gq: master.lookup(*gq), repeat, setup=lambda: rnd.choice(lookups))
+
+    # ---------- volume reports (pivot ทั้งเฟรมทุกครั้ง เทียบกับยอดรวมที่ตาม patch ทีละบิล) ----------
+    def full_pivot():
+        lines = reports.item_lines(frames.inv_df, frames.item_df)
+        return lines.groupby(["product", "unit"])["qty"].sum()
+    results["rollup_full"] = measure(full_pivot, max(1, repeat // 5))
+    rollups = reports.VolumeRollups().sync(frames)
+    results["rollup_patch"] = measure(lambda _: rollups.sync(frames), repeat, setup=lambda: (save_one(), frames.get(local.refresh())))
+    results["rollup_view"] = measure(lambda by: rollups.rollup(by), repeat, setup=lambda: rnd.choice(list(reports.DIMENSIONS)))
+    return results
+
+
+# ================= PDF =================
+def bench_pdf(repeat, batch=20):
+    ss = fake_sheets.populate(batch)
+    inv_rows, item_rows = ss.worksheet(storage.INV_SHEET).rows, ss.worksheet(storage.ITEM_SHEET).rows
+    jobs = []
+    for row in inv_rows[1:]:
+        data = dict(zip(inv_rows[0], row))
+        items = [dict(zip(item_rows[0], r)) for r in item_rows[1:] if r[0] == row[0]]
+        jobs.append((row[0], items, data))
+    results = {}
+    for name, compact in [(n, c) for n in invoice_pdf.LAYOUTS for c in (False, True)]:
+        layout = invoice_pdf.layout(name, compact=compact)
+        pages = len(layout["page_labels"])
+        key = name + ("_compact" if compact else "")
+        no, items, data = jobs[0]
+        stats = measure(lambda: invoice_pdf.generate_pdf_file(no, items, data, **layout), repeat)
+        size = len(invoice_pdf.generate_pdf_file(no, items, data, **layout).getvalue())
+        stats.update(bytes_per_invoice=size, bytes_per_page=round(size / pages))
+        results[f"pdf_{key}"] = stats
+        stats = measure(lambda: invoice_pdf.generate_pdf_batch(jobs, **layout), max(1, repeat // 5))
+        size = len(invoice_pdf.generate_pdf_batch(jobs, **layout).getvalue())
+        stats.update(bytes_per_invoice=round(size / len(jobs)), bytes_per_page=round(size / len(jobs) / pages))
+        results[f"pdf_batch{batch}_{key}"] = stats
+    return results
+
+
+# ================= REPORT / BASELINE =================
+def print_table(report):
+    print(f"{'group':>8} {'operation':<26} {'n':>4} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'peak KB':>10} {'bytes/inv':>10} {'bytes/page':>10}")
+    for group, ops in report.items():
+        for op, s in ops.items():
+            print(f"{group:>8} {op:<26} {s['n']:>4} {s['p50_ms']:>10.2f} {s['p95_ms']:>10.2f} {s['p99_ms']:>10.2f} "
+                  f"{s['peak_kb']:>10.0f} {s.get('bytes_per_invoice', ''):>10} {s.get('bytes_per_page', ''):>10}")
+
+
+def compare(report, baseline, tolerance=TOLERANCE):
+    """Lines describing every metric that regressed beyond tolerance against the baseline."""
+    problems = []
+    for group, ops in report.items():
+        for op, s in ops.items():
+            base = baseline.get(group, {}).get(op)
+            if not base: continue
+            if s["p50_ms"] > base["p50_ms"] * tolerance and s["p50_ms"] - base["p50_ms"] > MIN_REGRESSION_MS:
+                problems.append(f"{group}/{op}: p50 {s['p50_ms']:.2f} ms vs baseline {base['p50_ms']:.2f} ms")
+            if s["peak_kb"] > base["peak_kb"] * tolerance and s["peak_kb"] - base["peak_kb"] > 64:
+                problems.append(f"{group}/{op}: peak {s['peak_kb']:.0f} KB vs baseline {base['peak_kb']:.0f} KB")
+            for unit in ("bytes_per_invoice", "bytes_per_page"):
+                if unit in base and s.get(unit, 0) > base[unit] * BYTES_TOLERANCE:
+                    problems.append(f"{group}/{op}: {s[unit]} {unit.replace('_per_', '/')} vs baseline {base[unit]}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark PDF rendering, numbering and lookups against in-memory sheets")
+    parser.add_argument("--sizes", type=int, nargs="*", default=list(SIZES), help="number of invoices per run (none: PDF only)")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per fast operation (slow ones run fewer times)")
+    parser.add_argument("--no-pdf", action="store_true")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="merge the results into the baseline file")
+    parser.add_argument("--check", action="store_true", help="exit 1 if any metric regressed against the baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    report = {}
+    workdir = tempfile.mkdtemp(prefix="jp-bench-")
+    try:
+        if not args.no_pdf:
+            report["pdf"] = bench_pdf(args.repeat)
+        for n in args.sizes:
+            print(f"… {n} invoices", file=sys.stderr)
+            report[str(n)] = bench_size(n, workdir, args.repeat)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print_table(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=1)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as fh:
+            json.dump({**baseline, **report}, fh, indent=1, sort_keys=True)
+        print(f"baseline saved to {args.baseline}", file=sys.stderr)
+    if args.check:
+        problems = compare(report, baseline, args.tolerance)
+        for line in problems: print("REGRESSION", line, file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
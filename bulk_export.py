@@ -0,0 +1,175 @@
+# ================= BULK PDF EXPORT =================
+# พิมพ์บิลหลายใบพร้อมกัน (เช่นทุกใบของเดือน JPP-YYYY-MM) ด้วย process pool
+# ใช้ได้ทั้งจากหน้าแอปและจาก command line:
+#   python bulk_export.py --prefix JPP-2026-09 --format zip --out JPP-2026-09.zip
+import argparse
+import io
+import multiprocessing
+import os
+import sys
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import pandas as pd
+
+import invoice_pdf
+import partitions
+import sheet_mirror
+import sheet_store
+import storage
+from sheet_store import INV_KEY
+
+try:
+    from pypdf import PdfWriter
+except ImportError:
+    PdfWriter = None
+
+# จำนวนบิลต่องานของ worker หนึ่งตัว (ในโหมดรวมไฟล์ บิลในงานเดียวกันใช้ฟอนต์/โลโก้ชุดเดียวกัน)
+CHUNK_SIZE = 20
+
+
+def select_invoices(inv_df, prefix=None, date_from=None, date_to=None):
+    """Header rows whose number starts with prefix and whose 'date' (dd/mm/YYYY) is within the range."""
+    sel = inv_df
+    if sel.empty: return sel
+    if prefix:
+        sel = sel[sel[INV_KEY].astype(str).str.startswith(prefix)]
+    if date_from or date_to:
+        dates = pd.to_datetime(sel['date'].astype(str), format="%d/%m/%Y", errors="coerce")
+        mask = dates.notna()
+        if date_from: mask &= dates >= pd.Timestamp(date_from)
+        if date_to: mask &= dates <= pd.Timestamp(date_to)
+        sel = sel[mask]
+    return sel
+
+
+def iter_jobs(selected, item_df):
+    """Yield (inv_no, items, data) for every selected header, one invoice at a time."""
+    groups = item_df.groupby(item_df[INV_KEY].astype(str), sort=False).indices if not item_df.empty else {}
+    for row in selected.to_dict('records'):
+        no = str(row[INV_KEY])
+        idx = groups.get(no, [])
+        items = item_df.iloc[idx].to_dict('records') if len(idx) else []
+        yield no, items, row
+
+
+def _chunks(jobs, size):
+    chunk = []
+    for job in jobs:
+        chunk.append(job)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk: yield chunk
+
+
+def _render_chunk(fmt, layout, chunk):
+    if fmt == "zip":
+        return [(no, invoice_pdf.generate_pdf_file(no, items, data, **layout).getvalue()) for no, items, data in chunk]
+    return len(chunk), invoice_pdf.generate_pdf_batch(chunk, **layout).getvalue()
+
+
+def _ordered_results(pool, fn, chunks, window):
+    # ส่งงานเข้า pool ทีละไม่เกิน window งาน ผลลัพธ์ที่ค้างในหน่วยความจำจึงมีจำกัด
+    pending = deque()
+    for chunk in chunks:
+        pending.append(pool.submit(fn, chunk))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def export(jobs, out_path, fmt="zip", layout="single", workers=None, chunk_size=CHUNK_SIZE, progress=None):
+    """Render jobs in parallel into a ZIP of PDFs or one merged PDF.
+
+    layout is a LAYOUTS name or a layout dict (see invoice_pdf.layout).
+
+    Returns a dict with the invoice count, elapsed seconds, invoices/sec and
+    the PDF bytes (in total and per invoice; uncompressed sizes for a ZIP).
+    """
+    if fmt == "pdf" and PdfWriter is None:
+        raise RuntimeError("การรวมเป็น PDF ไฟล์เดียวต้องติดตั้ง pypdf")
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    done = size = 0
+    render = partial(_render_chunk, fmt, invoice_pdf.layout(layout) if isinstance(layout, str) else layout)
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        results = _ordered_results(pool, render, _chunks(jobs, chunk_size), workers * 2)
+        if fmt == "zip":
+            with zipfile.ZipFile(out_path, "w", zipfile.ZIP_DEFLATED) as zf:
+                for rendered in results:
+                    for no, pdf in rendered:
+                        zf.writestr(f"Invoice_{no}.pdf", pdf)
+                        size += len(pdf)
+                    done += len(rendered)
+                    if progress: progress(done)
+        else:
+            writer = PdfWriter()
+            for n, pdf in results:
+                writer.append(io.BytesIO(pdf))
+                done += n
+                if progress: progress(done)
+            with open(out_path, "wb") as fh:
+                writer.write(fh)
+            size = os.path.getsize(out_path)
+    elapsed = time.perf_counter() - started
+    return {"count": done, "seconds": elapsed, "rate": done / elapsed if elapsed else 0.0,
+            "bytes": size, "bytes_per_invoice": size / done if done else 0.0}
+
+
+def load_frames(backend="sheets", mirror_path=sheet_mirror.MIRROR_PATH, sync=False,
+                secrets_path=".streamlit/secrets.toml", db_path=storage.SQLITE_PATH, month=None,
+                date_from=None, date_to=None):
+    # month: เฉพาะบิลของเดือนนั้น รวมเดือนที่ย้ายไปชีทรายเดือนแล้ว (ต้องใช้ --sync สำหรับ Google Sheets)
+    # date_from/date_to: SQLite ค้นช่วงวันที่ผ่าน index ไม่ต้องโหลดทั้งไฟล์
+    if backend == "sqlite":
+        store = storage.SqliteStore(db_path)
+    else:
+        spreadsheet = sheet_store.open_spreadsheet(sheet_store.load_service_account(secrets_path)) if sync else None
+        store = storage.SheetsStore(spreadsheet, mirror_path, background=False)   # อ่านอย่างเดียว ไม่ต้องมี thread คิวเขียน
+        store.refresh()
+    return store.load_range(date_from, date_to, month)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export many invoices as one merged PDF or a ZIP of PDFs")
+    parser.add_argument("--prefix", help="invoice number prefix, e.g. JPP-2026-09")
+    parser.add_argument("--from", dest="date_from", help="first date (dd/mm/YYYY)")
+    parser.add_argument("--to", dest="date_to", help="last date (dd/mm/YYYY)")
+    parser.add_argument("--format", choices=["zip", "pdf"], default="zip")
+    parser.add_argument("--layout", choices=sorted(invoice_pdf.LAYOUTS), default="single")
+    parser.add_argument("--copy-labels", help='labels of the copies separated by "|" (one page per label)')
+    parser.add_argument("--compact", action="store_true", help="smaller PDFs (JPEG logo at lower resolution)")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--out")
+    parser.add_argument("--backend", choices=["sheets", "sqlite"], default="sheets")
+    parser.add_argument("--db", default=storage.SQLITE_PATH, help="SQLite store to read from (--backend sqlite)")
+    parser.add_argument("--mirror", default=sheet_mirror.MIRROR_PATH, help="local sheet mirror to read from")
+    parser.add_argument("--sync", action="store_true", help="sync the mirror from Google Sheets first")
+    parser.add_argument("--secrets", default=".streamlit/secrets.toml")
+    args = parser.parse_args(argv)
+
+    parse = lambda d: pd.to_datetime(d, format="%d/%m/%Y") if d else None
+    date_from, date_to = parse(args.date_from), parse(args.date_to)
+    inv_df, item_df = load_frames(args.backend, args.mirror, args.sync, args.secrets, args.db,
+                                  partitions.prefix_month(args.prefix), date_from, date_to)
+    selected = select_invoices(inv_df, args.prefix, date_from, date_to)
+    total = len(selected)
+    if not total:
+        print("no invoices match", file=sys.stderr)
+        return 1
+    out = args.out or f"{args.prefix or 'invoices'}.{args.format}"
+    report = lambda n: print(f"\r{n}/{total}", end="", file=sys.stderr)
+    stats = export(iter_jobs(selected, item_df), out, args.format,
+                   invoice_pdf.layout(args.layout, args.copy_labels, args.compact), args.workers, progress=report)
+    print(f"\n{stats['count']} invoices -> {out} in {stats['seconds']:.1f}s ({stats['rate']:.1f} invoices/sec), "
+          f"{stats['bytes'] / 1024:,.0f} KB ({stats['bytes_per_invoice'] / 1024:.1f} KB/invoice)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+# ================= IN-MEMORY SHEETS =================
+# ตัวแทน gspread Spreadsheet/Worksheet ในหน่วยความจำ สำหรับ benchmark และรันแอปแบบ offline
+# รองรับเฉพาะคำสั่งที่แอปใช้ และนับจำนวนครั้งที่เรียกแต่ละคำสั่ง
+# ตั้ง spreadsheet.api = SimulatedApi(...) เพื่อจำลองความหน่วงและโควตาของ Sheets API (ใช้ใน loadtest.py)
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+
+import requests
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import a1_to_rowcol
+
+import perf
+from sheet_store import INV_SHEET, ITEM_SHEET, INV_HEADER, ITEM_HEADER
+
+
+# คำขอ HTTP ที่ gspread ส่งจริงสำหรับแต่ละคำสั่ง (ชื่อเดียวกับที่ perf นับจาก client จริง)
+API_CALLS = {
+    "col_values": "GET values", "get": "GET values", "get_all_values": "GET values",
+    "append_row": "POST values:append", "append_rows": "POST values:append",
+    "update": "PUT values", "batch_update": "POST batchUpdate",
+    "get_lastUpdateTime": "GET drive/files",
+}
+DRIVE_FILES = "https://www.googleapis.com/drive/v3/files/fake"
+
+
+class SimulatedApi:
+    """Latency and per-minute quota of the Sheets API in front of a FakeSpreadsheet.
+
+    Every call sleeps latency_ms (+- jitter_ms) and is refused with a 429
+    APIError once reads/writes in the last minute reach the quota, like
+    Google does. Drive calls are not counted against the Sheets quota. With limiter (a sheets_client.QuotaLimiter) calls go through
+    the same coalescing, throttling and retries as the app's real client.
+    """
+
+    def __init__(self, latency_ms=150, jitter_ms=50, reads_per_minute=60, writes_per_minute=60, limiter=None, seed=0):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.quota = {"read": reads_per_minute, "write": writes_per_minute}
+        self.limiter = limiter
+        self.served = Counter()
+        self.refused = Counter()
+        self.log = []   # (เวลา, ชนิด) ของคำขอที่ตอบสำเร็จ สำหรับคำนวณคำขอต่อนาที
+        self._window = {"read": deque(), "write": deque()}
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._request = limiter.wrap(self._serve) if limiter else self._serve
+
+    def call(self, name, endpoint):
+        method = API_CALLS[name].split()[0]
+        self._request(method, endpoint)
+
+    def _serve(self, method, endpoint, params=None, **kwargs):
+        kind = "drive" if "/drive/" in str(endpoint) else "read" if method == "GET" else "write"
+        with self._lock:
+            delay = max(0.0, self.latency + self._rnd.uniform(-self.jitter, self.jitter))
+        time.sleep(delay)
+        now = time.monotonic()
+        with self._lock:
+            window = self._window.setdefault(kind, deque())
+            while window and window[0] < now - 60: window.popleft()
+            if len(window) >= self.quota.get(kind, math.inf):
+                self.refused[kind] += 1
+                raise APIError(_response(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED",
+                                                         "message": f"Quota exceeded for {kind} requests per minute (simulated)"}}))
+            window.append(now)
+            self.served[kind] += 1
+            self.log.append((now, kind))
+        return _response(200, {})
+
+    def per_minute(self, since=None):
+        """Mean and peak (any 60 s window) requests per minute served since since (monotonic time)."""
+        with self._lock:
+            log = [(t, k) for t, k in self.log if since is None or t >= since]
+        out = {}
+        for kind in ("read", "write"):
+            times = [t for t, k in log if k == kind]
+            span = (times[-1] - (since if since is not None else times[0])) if times else 0
+            peak, start = 0, 0
+            for end, t in enumerate(times):
+                while times[start] < t - 60: start += 1
+                peak = max(peak, end - start + 1)
+            out[kind] = {"total": len(times), "per_min": round(len(times) / max(span / 60, 1), 1), "peak_per_min": peak}
+        return out
+
+
+def _response(status, body):
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(body).encode("utf-8")
+    response.headers["Content-Type"] = "application/json"
+    return response
+
+
+class FakeSpreadsheet:
+    def __init__(self):
+        self.sheets = {}
+        self.calls = Counter()
+        self.api = None   # SimulatedApi หรือ None (ตอบทันที ไม่จำกัดโควตา)
+        self.revision = 0   # จำนวนครั้งที่เขียนผ่าน API
+
+    def worksheet(self, title):
+        if title not in self.sheets: raise WorksheetNotFound(title)
+        return self.sheets[title]
+
+    def worksheets(self):
+        return list(self.sheets.values())
+
+    def add_worksheet(self, title, rows=1000, cols=26, header=None):
+        ws = FakeWorksheet(self, title, len(self.sheets) + 1, header)
+        self.sheets[title] = ws
+        return ws
+
+    def _call(self, name, endpoint=""):
+        if self.api: self.api.call(name, endpoint or name)
+        self.calls[name] += 1
+        if not API_CALLS[name].startswith("GET"): self.revision += 1
+        perf.count_api(API_CALLS[name])
+
+    def get_lastUpdateTime(self):
+        # แทน modifiedTime ของไฟล์ใน Drive: เปลี่ยนทุกครั้งที่เขียนผ่าน API และเมื่อจำนวนแถวเปลี่ยน
+        # (เทสต์ต่อท้าย rows ตรง ๆ ได้ แต่การแก้ค่าในแถวเดิมต้องใช้ update() จึงจะเห็น)
+        self._call("get_lastUpdateTime", DRIVE_FILES)
+        return f"{self.revision}:" + ",".join(str(len(ws.rows)) for ws in self.sheets.values())
+
+    def batch_update(self, body):
+        self._call("batch_update", "batchUpdate")
+        for req in body["requests"]:
+            rng = req["deleteDimension"]["range"]
+            ws = next(w for w in self.sheets.values() if w.id == rng["sheetId"])
+            del ws.rows[rng["startIndex"]:rng["endIndex"]]
+
+
+class FakeWorksheet:
+    """rows holds every row including the header, as lists of strings (like get_all_values)."""
+
+    def __init__(self, spreadsheet, title, sheet_id, header):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = sheet_id
+        self.rows = [list(header)] if header else []
+
+    def _call(self, name, *args):
+        self.spreadsheet._call(name, f"{self.title}/{name}{args}")
+
+    def col_values(self, col):
+        self._call("col_values", col)
+        return [r[col - 1] if len(r) >= col else "" for r in self.rows]
+
+    def get_all_values(self):
+        self._call("get_all_values")
+        width = max(map(len, self.rows))
+        return [r + [""] * (width - len(r)) for r in self.rows]
+
+    def get(self, range_name):
+        self._call("get", range_name)
+        first, last = range_name.split(":")
+        r1, c1 = a1_to_rowcol(first)
+        r2, c2 = a1_to_rowcol(last)
+        return [r[c1 - 1:c2] for r in self.rows[r1 - 1:r2]]
+
+    def _append_response(self, n):
+        return {"updates": {"updatedRange": f"'{self.title}'!A{len(self.rows) - n + 1}:Z{len(self.rows)}"}}
+
+    def append_row(self, values):
+        self._call("append_row")
+        self.rows.append([str(v) for v in values])
+        return self._append_response(1)
+
+    def append_rows(self, values, value_input_option=None):
+        self._call("append_rows")
+        values = [[str(v) for v in r] for r in values]
+        if value_input_option == "USER_ENTERED": values = [[_user_entered(v) for v in r] for r in values]
+        self.rows.extend(values)
+        return self._append_response(len(values))
+
+    def update(self, range_name=None, values=None):
+        self._call("update")
+        row, col = a1_to_rowcol(range_name)
+        self.rows.extend([] for _ in range(row - 1 + len(values) - len(self.rows)))
+        for i, r in enumerate(values):
+            self.rows[row - 1 + i][col - 1:col - 1 + len(r)] = [str(v) for v in r]
+
+
+def _user_entered(text):
+    # Sheets แปลงข้อความที่ดูเหมือนตัวเลขเป็นตัวเลข: เลขศูนย์นำหน้าและจุลภาคหายไป
+    number = text.replace(",", "")
+    if not re.fullmatch(r"-?\d+(\.\d+)?", number): return text
+    return str(float(number)) if "." in number else str(int(number))
+
+
+# ================= SYNTHETIC DATA =================
+_NAMES = ["บริษัท ปิโตรไทย จำกัด", "หจก. ขนส่งเจริญ", "สหกรณ์การเกษตรบ้านนา", "บริษัท น้ำมันสยาม จำกัด", "ร้านโชคดีการยาง"]
+_PRODUCTS = [("ดีเซล B7", "ลิตร"), ("แก๊สโซฮอล์ 95", "ลิตร"), ("ดีเซล B20", "ลิตร"), ("น้ำมันเครื่อง", "แกลลอน")]
+
+
+def invoice_row(inv_no, date, rnd):
+    data = {f: f"{f.split('-')[-1]} {rnd.randrange(1000)}" for f in INV_HEADER[2:]}
+    data["ผู้รับสินค้า-ชื่อ"] = rnd.choice(_NAMES)
+    data["ข้อมูลพนักงานขับรถ-ทะเบียนรถ"] = f"{rnd.randrange(10, 99)}-{rnd.randrange(1000, 9999)}"
+    data["ผู้รับผลิตภัณฑ์-หมายเลขตั๋ว"] = f"T{rnd.randrange(10 ** 7):07d}"
+    return [inv_no, date] + [data[f] for f in INV_HEADER[2:]]
+
+
+def item_row(inv_no, rnd, tank=1):
+    product, unit = rnd.choice(_PRODUCTS)
+    return [inv_no, product, unit, f"{rnd.randrange(1, 20) * 500:,}", str(tank), f"S{rnd.randrange(10 ** 6):06d}"]
+
+
+def populate(n_invoices, items_per_invoice=3, prefix="JPP", seed=0, end=None):
+    """Spreadsheet with n_invoices spread over consecutive months (1,000 per month).
+
+    The first month is January 2020, or with end (a date) the months are
+    counted back so that the last invoices fall in the month of end.
+    """
+    rnd = random.Random(seed)
+    ss = FakeSpreadsheet()
+    inv = ss.add_worksheet(INV_SHEET, header=INV_HEADER)
+    items = ss.add_worksheet(ITEM_SHEET, header=ITEM_HEADER)
+    first = 2020 * 12 if end is None else end.year * 12 + end.month - 1 - (n_invoices - 1) // 1000
+    for i in range(n_invoices):
+        year, month = divmod(first + i // 1000, 12)
+        month += 1
+        inv_no = f"{prefix}-{year}-{month:02d}-{i % 1000 + 1:04d}"
+        inv.rows.append(invoice_row(inv_no, f"{i % 28 + 1:02d}/{month:02d}/{year}", rnd))
+        items.rows.extend(item_row(inv_no, rnd, t + 1) for t in range(items_per_invoice))
+    return ss
+
+
+def month_prefix(inv_no):
+    # JPP-2026-09-0001 -> JPP-2026-09
+    return re.sub(r"-\d+$", "", inv_no)
@@ -0,0 +1,278 @@
+# ================= INVOICE PDF RENDERER =================
+# โครงฟอร์มที่ไม่เปลี่ยน (หัวข้อ, ป้ายชื่อช่อง, เส้น, กรอบ, โลโก้) ถูกวาดครั้งเดียวต่อเอกสาร
+# เป็น form XObject แล้วประทับลงทุกหน้า ส่วนแต่ละหน้าวาดเฉพาะค่าของบิลนั้น
+# โหมด compact (layout(..., compact=True)) ฝังโลโก้เป็น JPEG ความละเอียดต่ำลง สำหรับไฟล์ที่ส่งทางมือถือ/เก็บถาวร
+import io
+
+from reportlab import rl_config
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+from reportlab.lib.units import cm, inch
+from reportlab.pdfbase import pdfmetrics
+from reportlab.platypus import Table, TableStyle
+from reportlab.lib import colors
+
+import assets
+import perf
+
+# เพิ่มค่านี้ทุกครั้งที่แก้รูปแบบฟอร์ม (ใช้เป็นส่วนหนึ่งของ key ของ PDF ที่ cache ไว้)
+TEMPLATE_VERSION = 1
+
+FONT_NAME = assets.font('ThaiFontBold', 'THSARABUN BOLD.ttf')
+
+# stream ทุกอันบีบอัดด้วย Flate อยู่แล้ว การเข้ารหัส ASCII85 ซ้ำอีกชั้นทำให้ไฟล์ใหญ่ขึ้น ~25% โดยไม่มีประโยชน์
+# (ฟอนต์ TTF ถูก subset โดย reportlab เหลือเฉพาะตัวอักษรที่ใช้ในเอกสาร)
+rl_config.useA85 = 0
+
+LOGO_PATH = 'p1.png'
+W, H = A4
+
+# ตำแหน่งโลโก้ (x, y, ขนาด, ความทึบ) ของแต่ละแบบฟอร์ม
+LOGO_CORNER = (16*cm, H-8.0*cm, 3.5*cm, 1.0)
+LOGO_BACKGROUND = ((W-10*cm)/2, ((H-10*cm)/2)-(1.5*inch), 10*cm, 0.2)
+
+# รูปแบบใบกำกับของแต่ละแอป: ป้ายของแต่ละแผ่น, ตำแหน่งโลโก้ และตัวเลขลายน้ำ
+LAYOUTS = {
+    "single": dict(
+        page_labels=["แผ่นที่ 1 - ต้นฉบับ - ผู้รับน้ำมัน (ปลายทาง)"],
+        logo=LOGO_CORNER, watermark=False,
+    ),
+    "four": dict(
+        page_labels=[
+            "แผ่นที่ 1 - ต้นฉบับ - ผู้รับน้ำมัน (ปลายทาง)", 
+            "แผ่นที่ 2 - สำเนา - พนักงานขับรถ / ผู้ขนส่ง", 
+            "แผ่นที่ 3 - สำเนา - ฝ่ายบัญชี / ส่วนกลางผู้ส่ง", 
+            "แผ่นที่ 4 - สำเนา - คลังน้ำมัน (ต้นทาง)",
+        ],
+        logo=LOGO_BACKGROUND, watermark=True,
+    ),
+}
+
+
+
+def layout(name, copy_labels=None, compact=False):
+    """LAYOUTS[name], optionally with other copy labels: one page per label, so the label count is the copy count.
+
+    copy_labels may be a list or one string with labels separated by "|".
+    compact renders smaller files (see generate_pdf_file).
+    """
+    spec = dict(LAYOUTS[name])
+    if isinstance(copy_labels, str): copy_labels = [s.strip() for s in copy_labels.split("|") if s.strip()]
+    if copy_labels: spec["page_labels"] = list(copy_labels)
+    if compact: spec["compact"] = True
+    return spec
+
+
+HEADER_X_RIGHT = 13*cm + (1 * inch)
+X_COL2 = 11*cm + (1.5 * inch)
+SIG_Y = 26.6*cm
+
+# หัวข้อและข้อความคงที่: (ขนาดฟอนต์, x, ระยะจากขอบบน, ข้อความ)
+STATIC_TEXT = [
+    (14, 1.5*cm, 1.5*cm, "1.ผู้จำหน่าย"),
+    (14, 1.2*cm, 4.7*cm, "  2.คลังรับน้ำมัน (ต้นทาง)"),
+    (14, 1.5*cm, 7.0*cm, "3.ตั๋วขนย้ายน้ำมัน"),
+    (14, 1.5*cm, 9.8*cm, "4.ผู้รับน้ำมัน (ปลายทาง)"),
+    (14, 1.2*cm, 12.4*cm, "  5.ข้อมูลการขนส่ง"),
+    (14, 1.2*cm, 18.0*cm, "  6.รายละเอียดน้ำมันเชื้อเพลิง"),
+    (14, 1.2*cm, 23.0*cm, "  7.การยืนยันและรับสินค้า"),
+    (11, 1.5*cm, 23.8*cm, "ข้าพเจ้าได้รับสินค้าตามรายการข้างต้นในสภาพเรียบร้อย ถูกต้องตามจำนวนและหมายเลขซีลที่ระบุไว้"),
+]
+
+# ข้อความกึ่งกลางในช่องลงนาม: (ขนาดฟอนต์, x, ระยะจากขอบบน, ข้อความ)
+STATIC_CENTRED = [
+    (12, 4.5*cm, SIG_Y, ".................................."),
+    (12, 10.5*cm, SIG_Y, ".................................."),
+    (12, 16.5*cm, SIG_Y, ".................................."),
+    (11, 4.5*cm, SIG_Y+1.2*cm, "ผู้ออกใบกำกับขนส่งน้ำมัน"),
+    (11, 4.5*cm, SIG_Y+1.7*cm, "วันที่ : .................................."),
+    (11, 10.5*cm, SIG_Y+1.2*cm, "ผู้ดำเนินการขนส่งน้ำมัน"),
+    (11, 10.5*cm, SIG_Y+1.7*cm, "วันที่ : .................................."),
+    (11, 16.5*cm, SIG_Y+1.2*cm, "ผู้รับสินค้า"),
+    (11, 16.5*cm, SIG_Y+1.7*cm, "วันที่ : .................................."),
+]
+
+# เส้นคั่นแนวนอน (ระยะจากขอบบน)
+RULES = [4.0*cm, 11.9*cm, 17.5*cm, 22.5*cm]
+
+# ช่องข้อมูล: (ขนาดฟอนต์, x, ระยะจากขอบบน, ป้ายคงที่, ฟิลด์)
+# ป้ายอยู่ในโครงฟอร์ม ค่าจะถูกวาดต่อท้ายป้ายในแต่ละหน้า
+FIELDS = [
+    (11, 1.5*cm, 2.1*cm, "", 'ผู้จำหน่าย-ชื่อ'),
+    (11, 1.5*cm, 2.6*cm, "", 'ผู้จำหน่าย-ที่อยู่'),
+    (11, 1.5*cm, 3.1*cm, "โทร.", 'ผู้จำหน่าย-เบอร์โทร'),
+    (11, 1.5*cm, 3.6*cm, "เลขประจำตัวผู้เสียภาษี ", 'ผู้จำหน่าย-เลขผู้เสียภาษี'),
+    (12, HEADER_X_RIGHT, 3.1*cm, "เลขที่ : ", 'invoice_no'),
+    (12, HEADER_X_RIGHT, 3.6*cm, "วันที่ : ", 'date'),
+    (11, 1.5*cm, 5.3*cm, "ชื่อคลัง : ", 'คลังรับผลิตภัณฑ์-ชื่อ'),
+    (11, 1.5*cm, 5.8*cm, "ที่อยู่ : ", 'คลังรับผลิตภัณฑ์-ที่อยู่'),
+    (11, 1.5*cm, 6.3*cm, "เลขประจำตัวผู้เสียภาษี : ", 'คลังรับผลิตภัณฑ์-เลขผู้เสียภาษี'),
+    (11, 1.5*cm, 7.6*cm, "ชื่อเจ้าของตั๋ว : ", 'ผู้รับผลิตภัณฑ์-ชื่อ'),
+    (11, 1.5*cm, 8.1*cm, "ที่อยู่ : ", 'ผู้รับผลิตภัณฑ์-ที่อยู่'),
+    (11, 1.5*cm, 8.6*cm, "เลขประจำตัวผู้เสียภาษี : ", 'ผู้รับผลิตภัณฑ์-เลขผู้เสียภาษี'),
+    (11, 1.5*cm, 9.1*cm, "ตั๋วขนย้ายเลขที่ : ", 'ผู้รับผลิตภัณฑ์-หมายเลขตั๋ว'),
+    (11, 1.5*cm, 10.4*cm, "ชื่อผู้รับน้ำมัน : ", 'ผู้รับสินค้า-ชื่อ'),
+    (11, 1.5*cm, 10.9*cm, "ที่อยู่ : ", 'ผู้รับสินค้า-ที่อยู่'),
+    (11, 1.5*cm, 11.4*cm, "เลขประจำตัวผู้เสียภาษี : ", 'ผู้รับสินค้า-เลขผู้เสียภาษี'),
+    (11, 1.5*cm, 13.0*cm, "ผู้ดำเนินการขนส่ง : ", 'ผู้ดำเนินการขนส่ง-ชื่อ'),
+    (11, 1.5*cm, 13.5*cm, "เลขประจำตัวผู้เสียภาษี : ", 'ผู้ดำเนินการขนส่ง-เลขผู้เสียภาษี'),
+    (11, 1.5*cm, 14.0*cm, "ที่อยู่ : ", 'ผู้ดำเนินการขนส่ง-ที่อยู่'),
+    (11, 1.5*cm, 14.5*cm, "เบอร์โทร : ", 'ผู้ดำเนินการขนส่ง-เบอร์โทร'),
+    (11, 1.5*cm, 15.0*cm, "ประเภทผู้รับจ้าง : ", 'ผู้ดำเนินการขนส่ง-ประเภทผู้รับจ้าง'),
+    (11, 1.5*cm, 15.5*cm, "ใบอนุญาต : ", 'ผู้ดำเนินการขนส่ง-ใบอนุญาต'),
+    (11, X_COL2, 13.0*cm, "พนักงานขับรถ : ", 'ข้อมูลพนักงานขับรถ-ชื่อ'),
+    (11, X_COL2, 13.5*cm, "เลขใบขับขี่ : ", 'ข้อมูลพนักงานขับรถ-เลขใบขับขี่'),
+    (11, X_COL2, 14.0*cm, "เบอร์โทร : ", 'ข้อมูลพนักงานขับรถ-เบอร์โทร'),
+    (11, X_COL2, 14.5*cm, "ทะเบียนรถ : ", 'ข้อมูลพนักงานขับรถ-ทะเบียนรถ'),
+    (11, X_COL2, 15.0*cm, "วิธีขนส่ง : ", 'ข้อมูลพนักงานขับรถ-วิธีขนส่ง'),
+    (11, X_COL2, 15.5*cm, "วันออกเดินทาง : ", 'ข้อมูลพนักงานขับรถ-วันออกเดินทาง'),
+    (11, X_COL2, 16.0*cm, "เวลาออกเดินทาง : ", 'ข้อมูลพนักงานขับรถ-เวลาออกเดินทาง'),
+    (11, X_COL2, 16.5*cm, "วันที่ถึงปลายทาง : ", 'ข้อมูลพนักงานขับรถ-วันที่ถึงปลายทาง'),
+    (11, X_COL2, 17.0*cm, "เวลาที่ถึงปลายทาง : ", 'ข้อมูลพนักงานขับรถ-เวลาที่ถึงปลายทาง'),
+]
+
+# ค่าที่จัดชิดขวา: (ขนาดฟอนต์, x, ระยะจากขอบบน, ฟิลด์, ค่าเริ่มต้น)
+RIGHT_FIELDS = [
+    (18, 19.5*cm, 1.7*cm, 'ผู้จำหน่าย-ชื่อเอกสาร', 'ใบกำกับขนส่งน้ำมัน'),
+    (12, 19.5*cm, 2.2*cm, 'ผู้จำหน่าย-อธิบายเพิ่ม', ''),
+]
+
+# ชื่อผู้ลงนาม "( ... )" กึ่งกลางใต้เส้นลงนาม: (x, ฟิลด์)
+SIGNERS = [
+    (4.5*cm, 'การยืนยันและรับสินค้า-ผู้ออกเอกสาร'),
+    (10.5*cm, 'การยืนยันและรับสินค้า-พนักงานขับรถ'),
+    (16.5*cm, 'การยืนยันและรับสินค้า-ผู้รับสินค้า'),
+]
+
+# ฟิลด์ทั้งหมดที่ถูกพิมพ์ลงใบกำกับ (เลขที่บิลมาจากพารามิเตอร์ inv_no)
+DATA_KEYS = sorted(({f[4] for f in FIELDS} | {f[3] for f in RIGHT_FIELDS} | {f[1] for f in SIGNERS}) - {'invoice_no'})
+
+# ระยะที่ค่าเริ่มต้นหลังป้ายแต่ละช่อง คำนวณครั้งเดียวต่อ process
+FIELD_OFFSETS = [pdfmetrics.stringWidth(label, FONT_NAME, size) for size, _, _, label, _ in FIELDS]
+
+
+def _draw_skeleton(c, logo, compact=False):
+    if logo:
+        try:
+            x, y, size, alpha = logo
+            img = assets.compact_image(LOGO_PATH, size) if compact else assets.image(LOGO_PATH, size)
+            if img:
+                c.saveState()
+                c.setFillAlpha(alpha)
+                c.drawImage(img, x, y, width=size, height=size, mask='auto')
+                c.restoreState()
+        except: pass
+
+    for size, x, y, text in STATIC_TEXT:
+        c.setFont(FONT_NAME, size)
+        c.drawString(x, H-y, text)
+    for size, x, y, label, _ in FIELDS:
+        if label:
+            c.setFont(FONT_NAME, size)
+            c.drawString(x, H-y, label)
+    for size, x, y, text in STATIC_CENTRED:
+        c.setFont(FONT_NAME, size)
+        c.drawCentredString(x, H-y, text)
+    for y in RULES:
+        c.line(1*cm, H-y, 20*cm, H-y)
+    c.rect(1*cm, 1*cm, 19*cm, H-2*cm)
+
+
+def _items_table(items):
+    header = [["ลำดับ", "ช่องถัง", "ซีล", "รายการน้ำมัน", "หน่วย", "จำนวน"]]
+    data_rows = []
+    total_qty = 0.0
+    for i, it in enumerate(items):
+        try:
+            qv = float(str(it.get('qty', '0')).replace(',', ''))
+            total_qty += qv
+            f_qty = "{:,.0f}".format(qv)
+        except: f_qty = it.get('qty', '')
+        data_rows.append([i+1, it.get('tank',''), it.get('seal',''), it.get('product',''), it.get('unit',''), f_qty])
+
+    while len(data_rows) < 4: data_rows.append(["","","","","",""])
+    data_rows.append(["", "", "", "รวมทั้งสิ้น", "", "{:,.0f}".format(total_qty)])
+
+    t = Table(header + data_rows, colWidths=[1.2*cm, 2.5*cm, 3.5*cm, 6.8*cm, 2*cm, 3*cm])
+    t.setStyle(TableStyle([('FONT', (0,0), (-1,-1), FONT_NAME, 10),('GRID', (0,0), (-1,-1), 0.5, colors.black),('ALIGN', (0,0), (-1,-1), 'CENTER'), ('ALIGN', (3, -1), (3, -1), 'RIGHT'), ('SPAN', (3, -1), (4, -1))]))
+    return t
+
+
+def _new_canvas(buf, logo, compact=False):
+    c = canvas.Canvas(buf, pagesize=A4, pageCompression=1)
+    c.beginForm("skeleton")
+    _draw_skeleton(c, logo, compact)
+    c.endForm()
+    return c
+
+
+def _draw_body(c, inv_no, items, data):
+    def get_val(key, default=""):
+        if key == 'invoice_no': return str(inv_no)
+        return str(data.get(key, default))
+
+    for (size, x, y, _, key), offset in zip(FIELDS, FIELD_OFFSETS):
+        c.setFont(FONT_NAME, size)
+        c.drawString(x + offset, H-y, get_val(key))
+    for size, x, y, key, default in RIGHT_FIELDS:
+        c.setFont(FONT_NAME, size)
+        c.drawRightString(x, H-y, get_val(key, default))
+    c.setFont(FONT_NAME, 12)
+    for x, key in SIGNERS:
+        c.drawCentredString(x, H-SIG_Y-0.6*cm, f"( {get_val(key)} )")
+
+    t = _items_table(items)
+    t.wrapOn(c, 1*cm, H-22.0*cm); t.drawOn(c, 1*cm, H-22.0*cm)
+
+
+def _draw_invoice(c, inv_no, items, data, page_labels, watermark):
+    # ค่าในช่องและตารางสินค้าเหมือนกันทุกสำเนา: วาดครั้งเดียวเป็น form แล้วประทับลงทุกแผ่น
+    # แต่ละแผ่นวาดเพิ่มเฉพาะส่วนที่ต่างกัน คือป้ายชื่อแผ่นและตัวเลขลายน้ำ (สำเนาเดียวไม่ต้องใช้ form)
+    body = f"body{c.getPageNumber()}" if len(page_labels) > 1 else None
+    if body:
+        c.beginForm(body)
+        _draw_body(c, inv_no, items, data)
+        c.endForm()
+
+    for idx, label in enumerate(page_labels):
+        if watermark:
+            c.saveState()
+            c.setFont(FONT_NAME, 200)
+            c.setFillAlpha(0.05)
+            c.drawRightString(19*cm, H-10*cm, f"{idx + 1}")
+            c.restoreState()
+
+        c.doForm("skeleton")
+        if body: c.doForm(body)
+        else: _draw_body(c, inv_no, items, data)
+
+        c.setFont(FONT_NAME, 10)
+        c.drawString(1.5*cm, H-0.8*cm, label)
+        c.showPage()
+
+
+@perf.timed("pdf.render")
+def generate_pdf_file(inv_no, items, data, page_labels, logo=LOGO_CORNER, watermark=False, compact=False):
+    """Render one invoice; data holds the transport_fields values plus 'date'.
+
+    compact embeds the logo as a JPEG at assets.COMPACT_DPI instead of a
+    lossless image at print resolution (roughly 30-60% fewer bytes).
+    """
+    buf = io.BytesIO()
+    c = _new_canvas(buf, logo, compact)
+    _draw_invoice(c, inv_no, items, data, page_labels, watermark)
+    c.save()
+    buf.seek(0)
+    return buf
+
+
+@perf.timed("pdf.render_batch")
+def generate_pdf_batch(invoices, page_labels, logo=LOGO_CORNER, watermark=False, compact=False):
+    """Render many (inv_no, items, data) invoices into one document sharing the skeleton, font and logo."""
+    buf = io.BytesIO()
+    c = _new_canvas(buf, logo, compact)
+    for inv_no, items, data in invoices:
+        _draw_invoice(c, inv_no, items, data, page_labels, watermark)
+    c.save()
+    buf.seek(0)
+    return buf
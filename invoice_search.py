@@ -0,0 +1,65 @@
+# ================= INVOICE SEARCH INDEX =================
+# ดัชนีค้นหาบิลที่สร้างครั้งเดียวต่อเวอร์ชันของข้อมูล ค้นด้วย operation แบบ vectorized
+# บนเลขที่บิล, ชื่อผู้รับสินค้า, ทะเบียนรถ, เลขตั๋ว และวันที่ แล้วแบ่งผลลัพธ์เป็นหน้า
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from sheet_store import INV_KEY
+
+SEARCH_FIELDS = [INV_KEY, "ผู้รับสินค้า-ชื่อ", "ข้อมูลพนักงานขับรถ-ทะเบียนรถ", "ผู้รับผลิตภัณฑ์-หมายเลขตั๋ว", "date"]
+PAGE_SIZE = 50
+
+# อักขระที่ไม่มีผลต่อการค้นหา: ช่องว่าง, ขีด, จุด และ zero-width ที่มักติดมาจากการคัดลอกข้อความไทย
+_IGNORED = re.compile("[\\s\\-./\u200b\u200c\u200d\ufeff]+")
+
+
+def normalize(text):
+    """Thai-aware search form: NFC, นิคหิต+สระอา -> สระอำ, casefold, ignore spaces/dashes/dots."""
+    text = unicodedata.normalize("NFC", str(text)).replace("ํา", "ำ").casefold()
+    return _IGNORED.sub("", text)
+
+
+def _normalize_series(values):
+    s = pd.Series(values, dtype="string[pyarrow]")
+    s = s.str.normalize("NFC").str.replace("ํา", "ำ", regex=False).str.casefold()
+    return s.str.replace(_IGNORED.pattern, "", regex=True)
+
+
+class InvoiceSearchIndex:
+    """Precomputed, newest-first search columns over the Invoices frame."""
+
+    def __init__(self, inv_df):
+        df = inv_df.iloc[::-1] if not inv_df.empty else inv_df
+        # ช่องว่างใน frames เป็น NaN (pandas 3 astype(str) ยังคงเป็น NaN) ต้องเป็น "" ก่อนต่อข้อความ
+        get = lambda f: df[f].astype(object).fillna("").astype(str).to_numpy() if f in df.columns else np.full(len(df), "", dtype=object)
+        self.keys = get(INV_KEY)
+        self.labels = (pd.Series(self.keys, dtype=object) + " | " + pd.Series(get("ผู้รับสินค้า-ชื่อ"), dtype=object)).to_numpy()
+        self.fields = [_normalize_series(get(f)) for f in SEARCH_FIELDS]
+        self.dates = pd.to_datetime(pd.Series(get("date")), format="%d/%m/%Y", errors="coerce").to_numpy()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def search(self, query="", date_from=None, date_to=None, page=0, page_size=PAGE_SIZE):
+        """Return (total matches, labels on the requested page).
+
+        Matches where any field starts with the query come before plain
+        substring matches; within each group the newest invoices come first.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if date_from is not None: mask &= self.dates >= np.datetime64(pd.Timestamp(date_from))
+        if date_to is not None: mask &= self.dates <= np.datetime64(pd.Timestamp(date_to))
+        order = np.flatnonzero(mask)
+        q = normalize(query) if query else ""
+        if q:
+            prefix = np.zeros(len(self), dtype=bool)
+            hit = np.zeros(len(self), dtype=bool)
+            for s in self.fields:
+                prefix |= s.str.startswith(q).fillna(False).to_numpy(dtype=bool)
+                hit |= s.str.contains(q, regex=False).fillna(False).to_numpy(dtype=bool)
+            order = np.concatenate([np.flatnonzero(mask & prefix), np.flatnonzero(mask & hit & ~prefix)])
+        start = page * page_size
+        return len(order), self.labels[order[start:start + page_size]].tolist()
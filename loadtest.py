@@ -0,0 +1,262 @@
+# ================= LOAD TEST =================
+# จำลองพนักงานหลายคนใช้แอปพร้อมกันบน process เดียว (เท่ากับ worker ของ Streamlit หนึ่งตัว)
+# แต่ละ session คือ AppTest ของ main.py ใน thread ของตัวเอง ทำงานวนตามลำดับจริงของพนักงานจัดส่ง:
+#   ค้นหา -> เลือกบิล -> พิมพ์ซ้ำ (ดาวน์โหลด PDF) -> โหลดมาแก้ไขหนึ่งช่อง -> บันทึก -> เริ่มบิลใหม่
+# ชีทเป็น fake_sheets ในหน่วยความจำ + SimulatedApi (ความหน่วง และโควตาต่อนาทีที่ตอบ 429 เหมือน Google)
+# โดยผ่าน sheets_client.QuotaLimiter แบบเดียวกับ client จริง
+#   python loadtest.py --sessions 1 4 8 --duration 60 --invoices 2000 --latency-ms 150
+# รายงานต่อจำนวน session: รอบงานต่อนาที, p50/p95/p99 ของแต่ละขั้น, คำขอ Sheets ต่อนาที (เฉลี่ย/สูงสุด)
+# และจำนวนครั้งที่ถูกปฏิเสธด้วย 429 ตัวเลขแต่ละระดับต่อจาก state ของระดับก่อน (cache อุ่นแล้ว)
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import defaultdict
+from datetime import date
+from unittest.mock import MagicMock
+
+import numpy as np
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest, app_test, local_script_runner
+
+import fake_sheets
+import perf
+import sheets_client
+import storage
+from sheet_store import INV_HEADER, INV_SHEET
+
+STEPS = ("open", "search", "select", "reprint", "edit", "save", "new")
+EDIT_FIELD = "ผู้รับสินค้า-เบอร์โทร"
+
+# ================= CONCURRENT APPTEST =================
+def share_runtime():
+    """Let AppTest sessions run at the same time, as sessions of one server process do.
+
+    AppTest is made for one test at a time: every run installs its own mock
+    Runtime (and removes it at the end, under the other sessions' feet) and
+    compiles the script again. Here every session shares one runtime and one
+    ScriptCache, like the sessions of a real server.
+    """
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.dataframe_source_mgr = DataframeSourceManager()
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    app_test.Runtime = types.SimpleNamespace(_instance=None)   # ค่าที่ AppTest ตั้ง/ล้างทุกรอบไปลงที่นี่แทน
+    cache = ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: cache
+    MediaFileManager.add_deferred = _capture_deferred
+
+
+# ================= DOWNLOADS =================
+# ปุ่มดาวน์โหลดของแอปส่งฟังก์ชัน (สร้าง PDF เมื่อกด) AppTest ไม่มีเบราว์เซอร์มากด จึงเก็บฟังก์ชันไว้เรียกเอง
+_downloads = {}
+_downloads_lock = threading.Lock()
+_add_deferred = MediaFileManager.add_deferred
+
+
+def _capture_deferred(self, data_callable, mimetype, coordinates, file_name=None):
+    with _downloads_lock:
+        _downloads[file_name] = data_callable
+    return _add_deferred(self, data_callable, mimetype, coordinates, file_name)
+
+
+def download(file_name):
+    with _downloads_lock:
+        fn = _downloads.get(file_name)
+    if fn is None: raise LookupError(f"no download button for {file_name}")
+    return fn()
+
+
+# ================= SESSION =================
+class AppError(RuntimeError):
+    """The app raised an exception during a rerun."""
+
+
+class Dispatcher:
+    """One simulated user: an AppTest session replaying search -> reprint -> edit -> save."""
+
+    def __init__(self, script, queries, rnd, timeout):
+        self.script = script
+        self.queries = queries
+        self.rnd = rnd
+        self.timeout = timeout
+        self.at = None
+
+    def _run(self, target):
+        # target คือ AppTest หรือ widget ที่ตั้งค่าแล้ว (widget.run() รัน AppTest ของมัน)
+        at = target.run(timeout=self.timeout)
+        if at.exception: raise AppError(at.exception[0].message)
+        return at
+
+    def _button(self, label):
+        return next(b for b in self.at.button if b.label == label)
+
+    def open(self):
+        self.at = AppTest.from_file(self.script, default_timeout=self.timeout)
+        self._run(self.at)
+
+    def scenario(self, timed):
+        """Run one round; timed(step, fn) runs and times each step."""
+        if self.at is None: timed("open", self.open)
+        at = self.at
+        timed("search", lambda: self._run(at.text_input(key="search_q").input(self.rnd.choice(self.queries))))
+        picker = next(s for s in at.selectbox if s.label == "เลือกบิล")
+        if len(picker.options) < 2: return False
+        choice = self.rnd.choice(picker.options[1:])
+        inv_no = choice.split(" | ")[0]
+        timed("select", lambda: self._run(picker.select(choice)))
+        timed("reprint", lambda: download(f"Invoice_{inv_no}.pdf"))
+        timed("edit", lambda: (self._run(self._button("📝 โหลดมาแก้ไข").click()),
+                               self._run(at.text_input(key=f"in_{EDIT_FIELD}").input(f"08{self.rnd.randrange(10 ** 8):08d}"))))
+        timed("save", lambda: self._run(self._button("💾 บันทึกและอัปเดต PDF").click()))
+        timed("new", lambda: self._run(self._button("🆕 เริ่มบิลใหม่").click()))
+        return True
+
+
+def run_level(sessions, duration, script, queries, timeout, seed=0):
+    """Run sessions dispatchers for duration seconds; latencies per step and totals."""
+    latencies = defaultdict(list)
+    # errors: แอปเกิด exception / driver_errors: ตัวจำลองเอง (เช่น AppTest ไม่พบ widget เมื่อรันพร้อมกัน)
+    totals = {"rounds": 0, "errors": 0, "driver_errors": 0}
+    errors = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def timed(step, fn):
+        started = time.perf_counter()
+        fn()
+        with lock:
+            latencies[step].append((time.perf_counter() - started) * 1000)
+
+    def user(n):
+        d = Dispatcher(script, queries, random.Random(seed * 1000 + n), timeout)
+        while time.monotonic() < deadline:
+            try:
+                done = d.scenario(timed)
+            except Exception as e:
+                d.at = None   # เริ่ม session ใหม่ เหมือนผู้ใช้กดรีเฟรชหน้า
+                with lock:
+                    totals["errors" if isinstance(e, AppError) else "driver_errors"] += 1
+                    if len(errors) < 5: errors.append(f"{type(e).__name__}: {e}")
+                continue
+            if done:
+                with lock: totals["rounds"] += 1
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=user, args=(n,), daemon=True) for n in range(sessions)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.monotonic() - started
+    steps = {}
+    for step in STEPS:
+        values = latencies.get(step)
+        if not values: continue
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        steps[step] = {"n": len(values), "p50_ms": round(p50, 1), "p95_ms": round(p95, 1),
+                       "p99_ms": round(p99, 1), "max_ms": round(max(values), 1)}
+    n_steps = sum(s["n"] for s in steps.values())
+    return {"sessions": sessions, "seconds": round(elapsed, 1), "rounds": totals["rounds"],
+            "rounds_per_min": round(totals["rounds"] / elapsed * 60, 1), "steps_per_sec": round(n_steps / elapsed, 2),
+            "errors": totals["errors"], "driver_errors": totals["driver_errors"], "error_samples": errors, "steps": steps}
+
+
+# ================= SETUP =================
+def sample_queries(spreadsheet, rnd, count=40):
+    # คำค้นแบบที่พนักงานพิมพ์: ท้ายเลขที่บิล, ชื่อผู้รับสินค้าบางส่วน, ทะเบียนรถ
+    rows = spreadsheet.worksheet(INV_SHEET).rows[1:][-2000:]
+    name, plate = INV_HEADER.index("ผู้รับสินค้า-ชื่อ"), INV_HEADER.index("ข้อมูลพนักงานขับรถ-ทะเบียนรถ")
+    pick = [lambda r: r[0][-4:], lambda r: r[name].split()[-1][:4], lambda r: r[plate][:5]]
+    return [rnd.choice(pick)(rnd.choice(rows)) for _ in range(count)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay concurrent dispatcher sessions against the app with simulated Google Sheets")
+    parser.add_argument("--script", default="main.py", help="app to drive (main.py or main-4บิล.py)")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8], help="concurrent sessions per level")
+    parser.add_argument("--duration", type=float, default=60, help="seconds per level")
+    parser.add_argument("--invoices", type=int, default=2000, help="invoices in the simulated sheet")
+    parser.add_argument("--latency-ms", type=float, default=150, help="Sheets API latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--reads-per-min", type=int, default=60, help="simulated read quota (429 above it)")
+    parser.add_argument("--writes-per-min", type=int, default=60, help="simulated write quota (429 above it)")
+    parser.add_argument("--client-reads-per-min", type=int, help="limit of the app's client limiter (default: the quota)")
+    parser.add_argument("--client-writes-per-min", type=int)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds before a rerun counts as failed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="jp-load-")
+    rnd = random.Random(args.seed)
+    ss = fake_sheets.populate(args.invoices, end=date.today(), seed=args.seed)
+    limiter = sheets_client.QuotaLimiter(args.client_reads_per_min or args.reads_per_min,
+                                         args.client_writes_per_min or args.writes_per_min)
+    api = ss.api = fake_sheets.SimulatedApi(args.latency_ms, args.jitter_ms, args.reads_per_min, args.writes_per_min, limiter, args.seed)
+    store = storage.SheetsStore(ss, os.path.join(workdir, "mirror.sqlite"))
+    # แอปเปิด store ผ่าน storage.open_store(st.secrets) ใน st.cache_resource: ให้ได้ store จำลองแทน Google Sheets
+    storage.open_store = lambda secrets: store
+    share_runtime()
+    os.environ.setdefault("JP_EXPORT_DIR", workdir)
+    queries = sample_queries(ss, rnd)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), args.script)
+
+    report = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "levels": []}
+    try:
+        print(f"… warming up ({args.invoices} invoices)", file=sys.stderr)
+        Dispatcher(script, queries, rnd, args.timeout).open()   # sync ครั้งแรก + สร้าง cache ที่ใช้ร่วมกัน
+        for n in args.sessions:
+            print(f"… {n} sessions for {args.duration:.0f}s", file=sys.stderr)
+            since = time.monotonic()
+            level = run_level(n, args.duration, script, queries, args.timeout, args.seed)
+            level["sheets"] = api.per_minute(since)
+            level["sheets_refused"] = dict(api.refused)
+            level["pending_writes"] = store.pending_count()
+            report["levels"].append(level)
+            print_level(level)
+        report["limiter"] = limiter.metrics()
+        report["spans"] = perf.span_stats()[:12]
+        print_summary(report)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=1, ensure_ascii=False)
+    return 1 if any(level["errors"] for level in report["levels"]) else 0
+
+
+def print_level(level):
+    sheets = level["sheets"]
+    print(f"\n{level['sessions']} sessions · {level['seconds']}s · {level['rounds']} rounds ({level['rounds_per_min']}/min) · "
+          f"{level['steps_per_sec']} steps/s · errors {level['errors']} (driver {level['driver_errors']})")
+    print(f"  Sheets reads {sheets['read']['per_min']}/min (peak {sheets['read']['peak_per_min']}) · "
+          f"writes {sheets['write']['per_min']}/min (peak {sheets['write']['peak_per_min']}) · "
+          f"429 {level['sheets_refused'] or 0} · pending writes {level['pending_writes']}")
+    print(f"  {'step':<8} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for step, s in level["steps"].items():
+        print(f"  {step:<8} {s['n']:>5} {s['p50_ms']:>9.1f} {s['p95_ms']:>9.1f} {s['p99_ms']:>9.1f} {s['max_ms']:>9.1f}")
+    for e in level["error_samples"]: print(f"  ! {e}")
+
+
+def print_summary(report):
+    q = report["limiter"]
+    print(f"\nclient limiter: coalesced {q['coalesced']} · throttled {q['throttled']} ({q['waited_s']}s) · "
+          f"retries {q['retries']} · failed {q['failed']}")
+    print("slowest spans in the app (whole run):")
+    for s in report["spans"]:
+        print(f"  {s['span']:<24} n={s['n']:<5} p50 {s['p50_ms']:>8.1f} ms · p95 {s['p95_ms']:>8.1f} ms · total {s['total_s']}s")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
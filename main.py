@@ -1,75 +1,99 @@
 import streamlit as st
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import pandas as pd
 from datetime import datetime
-import io
 import os
-
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import cm, inch
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.platypus import Table, TableStyle
-from reportlab.lib import colors
+from pathlib import Path
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+import bulk_export
+import invoice_pdf
+import invoice_search
+import master_data
+import partitions
+import pdf_cache
+import perf
+import reports
+import sessions
+import sheet_store
+import sheets_client
+import storage
+import write_queue
+from sheet_store import INV_KEY
 
 # ================= 1. CONFIG & INITIALIZATION =================
 st.set_page_config(page_title="JP - Logistics System", layout="wide")
 
-FONT_NAME = 'Helvetica-Bold'
-try:
-    if os.path.exists('THSARABUN BOLD.ttf'):
-        pdfmetrics.registerFont(TTFont('ThaiFontBold', 'THSARABUN BOLD.ttf'))
-        FONT_NAME = 'ThaiFontBold'
-except:
-    pass
+# จับเวลาแต่ละช่วงงานและนับ API call ของรอบนี้ (ดูในแผง ⏱️ ที่ sidebar หรือไฟล์ JP_PERF_LOG)
+_ctx = get_script_run_ctx()
+SESSION_ID = _ctx.session_id if _ctx else ""
+perf.begin_rerun(SESSION_ID)
+sessions.touch(SESSION_ID)
 
-SHEET_ID = "1ZdTeTyDkrvR3ZbIisCJdzKRlU8jMvFvnSvtEmQR2Tzs"
-INV_SHEET = "Invoices"
-ITEM_SHEET = "InvoiceItems"
-INV_KEY = "invoice_no"
+INV_PREFIX = "JPP"
 
+# ที่เก็บข้อมูลเลือกด้วย env JP_STORAGE หรือ storage_backend ใน secrets ("sheets" หรือ "sqlite")
 @st.cache_resource
-def init_sheet():
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(st.secrets["gcp_service_account"], scope)
-    return gspread.authorize(creds).open_by_key(SHEET_ID)
+def get_store():
+    return storage.open_store(st.secrets)
 
 try:
-    client = init_sheet()
-    ws_inv = client.worksheet(INV_SHEET)
-    ws_item = client.worksheet(ITEM_SHEET)
-    
+    store = get_store()
+
+    # ทุก 5 วินาทีตรวจว่าข้อมูลเปลี่ยนหรือไม่; เมื่อ version เปลี่ยนจะอ่านใหม่เฉพาะบิลที่เปลี่ยน
+    # ไม่รอโควตา API เกิน UI_WAIT วินาที (ถ้าเต็มจะแสดงข้อมูลที่มีอยู่ไปก่อน)
     @st.cache_data(ttl=5)
-    def get_data_cached():
-        inv = ws_inv.get_all_records()
-        items = ws_item.get_all_records()
-        return pd.DataFrame(inv), pd.DataFrame(items)
+    def sync_versions():
+        return get_store().refresh(max_wait=sheets_client.UI_WAIT)
+
+    # DataFrame ชุดเดียวใช้ร่วมกันทุก session (อ่านอย่างเดียว) และแก้เฉพาะบิลที่เปลี่ยนแทนการโหลดใหม่ทั้งหมด
+    @st.cache_resource
+    def get_frames():
+        return storage.FrameCache(get_store())
+
+    def get_data_cached(versions):
+        return get_frames().get(versions)
     
-    inv_df, item_df = get_data_cached()
+    data_versions = sync_versions()
+    inv_df, item_df = get_data_cached(data_versions)
 except Exception as e:
     st.error(f"❌ Connection Error: {e}")
     st.stop()
 
-transport_fields = [
-    "ผู้รับสินค้า-ชื่อ", "ผู้รับสินค้า-ที่อยู่", "ผู้รับสินค้า-เลขผู้เสียภาษี", "ผู้รับสินค้า-เบอร์โทร",
-    "คลังรับผลิตภัณฑ์-ชื่อ", "คลังรับผลิตภัณฑ์-เลขผู้เสียภาษี", "คลังรับผลิตภัณฑ์-ที่อยู่",
-    "ผู้รับผลิตภัณฑ์-ชื่อ", "ผู้รับผลิตภัณฑ์-เลขผู้เสียภาษี", "ผู้รับผลิตภัณฑ์-ที่อยู่", "ผู้รับผลิตภัณฑ์-หมายเลขตั๋ว",
-    "ผู้ดำเนินการขนส่ง-ชื่อ", "ผู้ดำเนินการขนส่ง-เลขผู้เสียภาษี", "ผู้ดำเนินการขนส่ง-ที่อยู่", "ผู้ดำเนินการขนส่ง-เบอร์โทร",
-    "ผู้ดำเนินการขนส่ง-ประเภทผู้รับจ้าง", "ผู้ดำเนินการขนส่ง-ใบอนุญาต",
-    "ข้อมูลพนักงานขับรถ-ชื่อ", "ข้อมูลพนักงานขับรถ-เลขใบขับขี่", "ข้อมูลพนักงานขับรถ-เบอร์โทร", "ข้อมูลพนักงานขับรถ-ทะเบียนรถ",
-    "ข้อมูลพนักงานขับรถ-วิธีขนส่ง", "ข้อมูลพนักงานขับรถ-วันออกเดินทาง", "ข้อมูลพนักงานขับรถ-เวลาออกเดินทาง",
-    "ข้อมูลพนักงานขับรถ-วันที่ถึงปลายทาง", "ข้อมูลพนักงานขับรถ-เวลาที่ถึงปลายทาง",
-    "การยืนยันและรับสินค้า-ผู้ออกเอกสาร", "การยืนยันและรับสินค้า-พนักงานขับรถ", "การยืนยันและรับสินค้า-ผู้รับสินค้า",
-    "ผู้จำหน่าย-ชื่อ", "ผู้จำหน่าย-ที่อยู่", "ผู้จำหน่าย-เลขผู้เสียภาษี", "ผู้จำหน่าย-เบอร์โทร",
-    "ผู้จำหน่าย-ชื่อเอกสาร", "ผู้จำหน่าย-อธิบายเพิ่ม"
-]
+# ดัชนีค้นหาบิลสร้างใหม่เฉพาะเมื่อ DataFrame เปลี่ยน (stamp) และใช้ร่วมกันทุก session
+@st.cache_resource(max_entries=2)
+def get_search_index(stamp):
+    with perf.span("search.index"):
+        return invoice_search.InvoiceSearchIndex(get_frames().inv_df)
+
+# ข้อมูลหลัก (ผู้รับสินค้า, ผู้ขนส่ง, พนักงานขับรถ ฯลฯ) สำหรับกรอกทั้งกลุ่มจากการเลือกครั้งเดียว
+# ใช้ร่วมกันทุก session และตาม patch ของ frames ทีละบิล
+@st.cache_resource
+def get_master_index():
+    return master_data.MasterIndex()
+
+# ยอดรวมปริมาณขนส่งสำหรับรายงาน ใช้ร่วมกันทุก session และตาม patch ของ frames ทีละบิลเหมือนข้อมูลหลัก
+@st.cache_resource
+def get_rollups():
+    return reports.VolumeRollups()
+
+# เดือนเก่า (นอก partitions.hot_months) โหลดเมื่อเลือกดูเท่านั้น
+@st.cache_data(ttl=300)
+def get_older_months(versions):
+    return get_store().older_months()
+
+# ช่วงวันที่ของเดือนเก่าค้นในที่เก็บข้อมูล (SQLite ใช้ index ของวันที่) ไม่ต้องโหลดทั้งเดือน
+@st.cache_resource(max_entries=4)
+def get_month_index(month, versions, d_from=None, d_to=None):
+    with perf.span("search.index"):
+        return invoice_search.InvoiceSearchIndex(get_store().load_range(d_from, d_to, month)[0])
+
+transport_fields = sheet_store.TRANSPORT_FIELDS
 
 # ================= 2. SESSION STATE =================
 if "invoice_items" not in st.session_state: st.session_state.invoice_items = []
 if "editing_no" not in st.session_state: st.session_state.editing_no = None
-if "pdf_buffer" not in st.session_state: st.session_state.pdf_buffer = None
+# เก็บเฉพาะ (เลขที่บิล, hash) ของ PDF ล่าสุด ตัวไฟล์อยู่ใน PDF cache ร่วมของ process
+if "pdf_ref" not in st.session_state: st.session_state.pdf_ref = None
 if "form_date" not in st.session_state: st.session_state.form_date = datetime.now().strftime("%d/%m/%Y")
 
 for f in transport_fields:
@@ -78,197 +102,175 @@ for f in transport_fields:
 def reset_form_action():
     st.session_state.invoice_items = []
     st.session_state.editing_no = None
-    st.session_state.pdf_buffer = None
+    st.session_state.pdf_ref = None
     st.session_state.form_date = datetime.now().strftime("%d/%m/%Y")
     for f in transport_fields: st.session_state[f"in_{f}"] = ""
 
+def fill_group_action(group, key, choices):
+    picked = st.session_state.get(key)
+    if picked is not None:
+        for f, v in master_data.fill(group, choices[picked]).items(): st.session_state[f"in_{f}"] = v
+    st.session_state[key] = None
+
+# ใช้เป็น on_click: ค่าในฟอร์มถูกตั้งก่อนสคริปต์รอบใหม่สร้าง widget จึงไม่ชนกับ widget ที่สร้างไปแล้ว
+def load_invoice_action(inv_no, row_data, it_rows, editing):
+    st.session_state.editing_no = inv_no if editing else None
+    if editing: st.session_state.form_date = str(row_data.get('date', st.session_state.form_date))
+    for f in transport_fields: st.session_state[f"in_{f}"] = str(row_data.get(f, ""))
+    st.session_state.invoice_items = [{"product": i.get('product',''), "unit": i.get('unit',''), "qty": i.get('qty',''), "tank": str(i.get('tank','')), "seal": str(i.get('seal',''))} for i in it_rows]
+    st.session_state.pdf_ref = pdf_ref(inv_no, st.session_state.invoice_items, row_data) if editing else None
+
 # ================= 3. PDF GENERATOR =================
+PDF_LAYOUT_NAME = "single"
+# จำนวนสำเนาและป้ายของแต่ละแผ่นปรับได้ด้วย pdf_copy_labels ใน secrets (list) หรือ env JP_PDF_COPY_LABELS ("ป้าย 1|ป้าย 2")
+# pdf_compact / JP_PDF_COMPACT=1: ไฟล์เล็กลง (โลโก้เป็น JPEG ความละเอียดต่ำลง) สำหรับส่งทางมือถือ
+PDF_LAYOUT = invoice_pdf.layout(PDF_LAYOUT_NAME, storage.setting(st.secrets, "pdf_copy_labels", "JP_PDF_COPY_LABELS"),
+                                storage.flag(st.secrets, "pdf_compact", "JP_PDF_COMPACT"))
+
+def form_data():
+    data = {f: st.session_state.get(f"in_{f}", "") for f in transport_fields}
+    data['date'] = st.session_state.get('form_date', '')
+    return data
+
 def generate_pdf_file(inv_no, items, data_dict=None):
-    buf = io.BytesIO()
-    c = canvas.Canvas(buf, pagesize=A4)
-    w, h = A4
-    
-    page_labels = [
-        "แผ่นที่ 1 - ต้นฉบับ - ผู้รับน้ำมัน (ปลายทาง)"
-    ]
-
-    def get_val(key, default=""):
-        if data_dict: return str(data_dict.get(key, default))
-        return st.session_state.get(f"in_{key}", default)
-
-    for idx, label in enumerate(page_labels):
-        # --- ส่วนของโค้ดตัวเลขลายน้ำ idx+0 ถูกนำออกแล้ว ---
-
-        c.setFont(FONT_NAME, 10)
-        c.drawString(1.5*cm, h-0.8*cm, label)
-
-        # --- ส่วนที่ปรับปรุงตำแหน่งรูปภาพ ---
-        try:
-            if os.path.exists('p1.png'):
-                c.saveState()
-                c.setFillAlpha(1.0) 
-                img_w = 3.5*cm 
-                img_h = 3.5*cm 
-                c.drawImage('p1.png', 16*cm, h-8.0*cm, width=img_w, height=img_h, mask='auto')
-                c.restoreState()
-        except: pass
-
-        c.setFont(FONT_NAME, 14)
-        c.drawString(1.5*cm, h-1.5*cm, "1.ผู้จำหน่าย")
-        
-        c.setFont(FONT_NAME, 11)
-        c.drawString(1.5*cm, h-2.1*cm, f"{get_val('ผู้จำหน่าย-ชื่อ')}")
-        c.drawString(1.5*cm, h-2.6*cm, f"{get_val('ผู้จำหน่าย-ที่อยู่')}")
-        c.drawString(1.5*cm, h-3.1*cm, f"โทร.{get_val('ผู้จำหน่าย-เบอร์โทร')}")
-        c.drawString(1.5*cm, h-3.6*cm, f"เลขประจำตัวผู้เสียภาษี {get_val('ผู้จำหน่าย-เลขผู้เสียภาษี')}")
-
-        c.setFont(FONT_NAME, 18)
-        c.drawRightString(19.5*cm, h-1.7*cm, f"{get_val('ผู้จำหน่าย-ชื่อเอกสาร', 'ใบกำกับขนส่งน้ำมัน')}")
-        c.setFont(FONT_NAME, 12)
-        c.drawRightString(19.5*cm, h-2.2*cm, f"{get_val('ผู้จำหน่าย-อธิบายเพิ่ม')}")
-        
-        header_x_right = 13*cm + (1 * inch)
-        c.drawString(header_x_right, h-3.1*cm, f"เลขที่ : {inv_no}")
-        c.drawString(header_x_right, h-3.6*cm, f"วันที่ : {data_dict.get('date') if data_dict else st.session_state.get('form_date', '')}")
-
-        c.line(1*cm, h-4.0*cm, 20*cm, h-4.0*cm)
-
-        c.setFont(FONT_NAME, 14)
-        c.drawString(1.2*cm, h-4.7*cm, "  2.คลังรับน้ำมัน (ต้นทาง)")
-        c.setFont(FONT_NAME, 11)
-        c.drawString(1.5*cm, h-5.3*cm, f"ชื่อคลัง : {get_val('คลังรับผลิตภัณฑ์-ชื่อ')}")
-        c.drawString(1.5*cm, h-5.8*cm, f"ที่อยู่ : {get_val('คลังรับผลิตภัณฑ์-ที่อยู่')}")
-        c.drawString(1.5*cm, h-6.3*cm, f"เลขประจำตัวผู้เสียภาษี : {get_val('คลังรับผลิตภัณฑ์-เลขผู้เสียภาษี')}")
-
-        c.setFont(FONT_NAME, 14)
-        c.drawString(1.5*cm, h-7.0*cm, "3.ตั๋วขนย้ายน้ำมัน")
-        c.setFont(FONT_NAME, 11)
-        c.drawString(1.5*cm, h-7.6*cm, f"ชื่อเจ้าของตั๋ว : {get_val('ผู้รับผลิตภัณฑ์-ชื่อ')}")
-        c.drawString(1.5*cm, h-8.1*cm, f"ที่อยู่ : {get_val('ผู้รับผลิตภัณฑ์-ที่อยู่')}")
-        c.drawString(1.5*cm, h-8.6*cm, f"เลขประจำตัวผู้เสียภาษี : {get_val('ผู้รับผลิตภัณฑ์-เลขผู้เสียภาษี')}")
-        c.drawString(1.5*cm, h-9.1*cm, f"ตั๋วขนย้ายเลขที่ : {get_val('ผู้รับผลิตภัณฑ์-หมายเลขตั๋ว')}")
-        
-        c.setFont(FONT_NAME, 14)
-        c.drawString(1.5*cm, h-9.8*cm, "4.ผู้รับน้ำมัน (ปลายทาง)")
-        c.setFont(FONT_NAME, 11)
-        c.drawString(1.5*cm, h-10.4*cm, f"ชื่อผู้รับน้ำมัน : {get_val('ผู้รับสินค้า-ชื่อ')}")
-        c.drawString(1.5*cm, h-10.9*cm, f"ที่อยู่ : {get_val('ผู้รับสินค้า-ที่อยู่')}")
-        c.drawString(1.5*cm, h-11.4*cm, f"เลขประจำตัวผู้เสียภาษี : {get_val('ผู้รับสินค้า-เลขผู้เสียภาษี')}")
-
-        c.line(1*cm, h-11.9*cm, 20*cm, h-11.9*cm)
-
-        c.setFont(FONT_NAME, 14)
-        c.drawString(1.2*cm, h-12.4*cm, "  5.ข้อมูลการขนส่ง")
-        c.setFont(FONT_NAME, 11)
-        
-        c.drawString(1.5*cm, h-13.0*cm, f"ผู้ดำเนินการขนส่ง : {get_val('ผู้ดำเนินการขนส่ง-ชื่อ')}")
-        c.drawString(1.5*cm, h-13.5*cm, f"เลขประจำตัวผู้เสียภาษี : {get_val('ผู้ดำเนินการขนส่ง-เลขผู้เสียภาษี')}")
-        c.drawString(1.5*cm, h-14.0*cm, f"ที่อยู่ : {get_val('ผู้ดำเนินการขนส่ง-ที่อยู่')}")
-        c.drawString(1.5*cm, h-14.5*cm, f"เบอร์โทร : {get_val('ผู้ดำเนินการขนส่ง-เบอร์โทร')}")
-        c.drawString(1.5*cm, h-15.0*cm, f"ประเภทผู้รับจ้าง : {get_val('ผู้ดำเนินการขนส่ง-ประเภทผู้รับจ้าง')}")
-        c.drawString(1.5*cm, h-15.5*cm, f"ใบอนุญาต : {get_val('ผู้ดำเนินการขนส่ง-ใบอนุญาต')}")
-        
-        x_col2 = 11*cm + (1.5 * inch)
-        c.drawString(x_col2, h-13.0*cm, f"พนักงานขับรถ : {get_val('ข้อมูลพนักงานขับรถ-ชื่อ')}")
-        c.drawString(x_col2, h-13.5*cm, f"เลขใบขับขี่ : {get_val('ข้อมูลพนักงานขับรถ-เลขใบขับขี่')}")
-        c.drawString(x_col2, h-14.0*cm, f"เบอร์โทร : {get_val('ข้อมูลพนักงานขับรถ-เบอร์โทร')}")
-        c.drawString(x_col2, h-14.5*cm, f"ทะเบียนรถ : {get_val('ข้อมูลพนักงานขับรถ-ทะเบียนรถ')}")
-        c.drawString(x_col2, h-15.0*cm, f"วิธีขนส่ง : {get_val('ข้อมูลพนักงานขับรถ-วิธีขนส่ง')}")
-        c.drawString(x_col2, h-15.5*cm, f"วันออกเดินทาง : {get_val('ข้อมูลพนักงานขับรถ-วันออกเดินทาง')}")
-        c.drawString(x_col2, h-16.0*cm, f"เวลาออกเดินทาง : {get_val('ข้อมูลพนักงานขับรถ-เวลาออกเดินทาง')}")
-        c.drawString(x_col2, h-16.5*cm, f"วันที่ถึงปลายทาง : {get_val('ข้อมูลพนักงานขับรถ-วันที่ถึงปลายทาง')}")
-        c.drawString(x_col2, h-17.0*cm, f"เวลาที่ถึงปลายทาง : {get_val('ข้อมูลพนักงานขับรถ-เวลาที่ถึงปลายทาง')}")
-
-        c.line(1*cm, h-17.5*cm, 20*cm, h-17.5*cm)
-
-        c.setFont(FONT_NAME, 14)
-        c.drawString(1.2*cm, h-18.0*cm, "  6.รายละเอียดน้ำมันเชื้อเพลิง")
-        
-        header = [["ลำดับ", "ช่องถัง", "ซีล", "รายการน้ำมัน", "หน่วย", "จำนวน"]]
-        data_rows = []
-        total_qty = 0.0
-        for i, it in enumerate(items):
-            try:
-                qv = float(str(it.get('qty', '0')).replace(',', ''))
-                total_qty += qv
-                f_qty = "{:,.0f}".format(qv)
-            except: f_qty = it.get('qty', '')
-            data_rows.append([i+1, it.get('tank',''), it.get('seal',''), it.get('product',''), it.get('unit',''), f_qty])
-        
-        while len(data_rows) < 4: data_rows.append(["","","","","",""])
-        data_rows.append(["", "", "", "รวมทั้งสิ้น", "", "{:,.0f}".format(total_qty)])
-
-        t = Table(header + data_rows, colWidths=[1.2*cm, 2.5*cm, 3.5*cm, 6.8*cm, 2*cm, 3*cm])
-        t.setStyle(TableStyle([('FONT', (0,0), (-1,-1), FONT_NAME, 10),('GRID', (0,0), (-1,-1), 0.5, colors.black),('ALIGN', (0,0), (-1,-1), 'CENTER'), ('ALIGN', (3, -1), (3, -1), 'RIGHT'), ('SPAN', (3, -1), (4, -1))]))
-        t.wrapOn(c, 1*cm, h-22.0*cm); t.drawOn(c, 1*cm, h-22.0*cm)
-
-        c.line(1*cm, h-22.5*cm, 20*cm, h-22.5*cm)
-
-        c.setFont(FONT_NAME, 14)
-        c.drawString(1.2*cm, h-23.0*cm, "  7.การยืนยันและรับสินค้า")
-        c.setFont(FONT_NAME, 11)
-        c.drawString(1.5*cm, h-23.8*cm, "ข้าพเจ้าได้รับสินค้าตามรายการข้างต้นในสภาพเรียบร้อย ถูกต้องตามจำนวนและหมายเลขซีลที่ระบุไว้")
-
-        sig_y = (h - 26.6*cm)
-        c.setFont(FONT_NAME, 12)
-        c.drawCentredString(4.5*cm, sig_y, "..................................")
-        c.drawCentredString(10.5*cm, sig_y, "..................................")
-        c.drawCentredString(16.5*cm, sig_y, "..................................")
-        
-        c.drawCentredString(4.5*cm, sig_y-0.6*cm, f"( {get_val('การยืนยันและรับสินค้า-ผู้ออกเอกสาร')} )")
-        c.drawCentredString(10.5*cm, sig_y-0.6*cm, f"( {get_val('การยืนยันและรับสินค้า-พนักงานขับรถ')} )")
-        c.drawCentredString(16.5*cm, sig_y-0.6*cm, f"( {get_val('การยืนยันและรับสินค้า-ผู้รับสินค้า')} )")
-        
-        c.setFont(FONT_NAME, 11)
-        c.drawCentredString(4.5*cm, sig_y-1.2*cm, "ผู้ออกใบกำกับขนส่งน้ำมัน")
-        c.drawCentredString(4.5*cm, sig_y-1.7*cm, "วันที่ : ..................................")
-        
-        c.drawCentredString(10.5*cm, sig_y-1.2*cm, "ผู้ดำเนินการขนส่งน้ำมัน")
-        c.drawCentredString(10.5*cm, sig_y-1.7*cm, "วันที่ : ..................................")
-        
-        c.drawCentredString(16.5*cm, sig_y-1.2*cm, "ผู้รับสินค้า")
-        c.drawCentredString(16.5*cm, sig_y-1.7*cm, "วันที่ : ..................................")
-
-        c.rect(1*cm, 1*cm, 19*cm, h-2*cm)
-        c.showPage()
-    c.save()
-    buf.seek(0)
-    return buf
+    return invoice_pdf.generate_pdf_file(inv_no, items, data_dict if data_dict else form_data(), **PDF_LAYOUT)
+
+@st.cache_resource
+def get_pdf_cache():
+    return pdf_cache.PdfCache(max_entries=int(os.environ.get("JP_PDF_CACHE_ENTRIES", 64)),
+                              max_bytes=int(float(os.environ.get("JP_PDF_CACHE_MB", 32)) * 2 ** 20),
+                              disk_dir=os.environ.get("JP_PDF_CACHE_DIR"))
+
+def pdf_source(inv_no, items, data_dict=None):
+    # คืนฟังก์ชันสำหรับ st.download_button: PDF จะถูกสร้าง (หรือดึงจาก cache) เมื่อกดดาวน์โหลดเท่านั้น
+    items = [dict(it) for it in items]
+    data = dict(data_dict) if data_dict else form_data()
+    cache = get_pdf_cache()
+    key = pdf_cache.pdf_key(inv_no, items, data, PDF_LAYOUT)
+    return lambda: cache.get_or_render(key, lambda: generate_pdf_file(inv_no, items, data).getvalue())
+
+def pdf_ref(inv_no, items, data_dict=None):
+    data = dict(data_dict) if data_dict else form_data()
+    return str(inv_no), pdf_cache.pdf_key(inv_no, items, data, PDF_LAYOUT)
+
+def saved_pdf(ref):
+    # PDF ของบิลที่บันทึกแล้ว: ดึงจาก cache ร่วม ถ้าถูกไล่ออกไปแล้วจึงสร้างใหม่จากข้อมูลที่บันทึกไว้
+    inv_no, key = ref
+    def load():
+        data = get_pdf_cache().get(key)
+        if data is not None: return data
+        row, items = get_frames().lookup(inv_no) or get_store().get_invoice(inv_no) or ({INV_KEY: inv_no}, [])
+        return pdf_source(inv_no, items, data_dict=row)()
+    return load
 
 # ================= 4. MAIN UI =================
 st.title("🚚 ใบกำกับขนส่ง JP POWER PLUS")
 
-with st.expander("🔍 ค้นหา/แก้ไข/พิมพ์บิลเก่า"):
-    if not inv_df.empty:
-        options = [f"{r[INV_KEY]} | {r.get('ผู้รับสินค้า-ชื่อ', '')}" for _, r in inv_df.iterrows()]
-        selected = st.selectbox("เลือกบิล", [""] + options[::-1])
+# แต่ละส่วนเป็น fragment: การพิมพ์/กดปุ่มในส่วนใดจะรันใหม่เฉพาะส่วนนั้น ไม่ต้องรันทั้งแอป
+# ส่วนที่เปลี่ยนข้อมูลของส่วนอื่น (โหลดบิล, บันทึก, เริ่มบิลใหม่) จึงค่อยสั่ง st.rerun() ทั้งแอป
+@st.fragment
+def search_section():
+    versions = sync_versions()
+    get_data_cached(versions)   # ให้ get_frames() ตามทัน version ล่าสุดก่อนค้นหา
+    with st.expander("🔍 ค้นหา/แก้ไข/พิมพ์บิลเก่า"):
+        sc0, sc1, sc2, sc3 = st.columns([1, 3, 2, 1])
+        period = sc0.selectbox("เดือน", ["ล่าสุด"] + get_older_months(versions), key="search_period")
+        query = sc1.text_input("ค้นหา (เลขที่ / ผู้รับสินค้า / ทะเบียนรถ / เลขตั๋ว / วันที่)", key="search_q")
+        search_dates = sc2.date_input("ช่วงวันที่", value=[], key="search_dates")
+        page = sc3.number_input("หน้า", min_value=1, value=1, step=1, key="search_page")
+        d_from, d_to = (search_dates[0], search_dates[-1]) if search_dates else (None, None)
+        if period == "ล่าสุด": index, lookup = get_search_index(get_frames().stamp), get_frames().lookup
+        else: index, lookup = get_month_index(period, versions, d_from, d_to), get_store().get_invoice
+        if not len(index): return
+        with perf.span("search.query"):
+            total, options = index.search(query, d_from, d_to, page - 1)
+        st.caption(f"พบ {total} บิล · หน้า {page}/{max(1, -(-total // invoice_search.PAGE_SIZE))}")
+        selected = st.selectbox("เลือกบิล", [""] + options)
         if selected:
             sel_no = selected.split(" | ")[0]
+            with perf.span("invoice.lookup"):
+                row_data, it_rows = lookup(sel_no) or ({INV_KEY: sel_no}, [])
             col_a, col_b, col_c = st.columns(3)
-            row_data = inv_df[inv_df[INV_KEY] == sel_no].iloc[0].to_dict()
-            it_rows = item_df[item_df["invoice_no"] == sel_no].to_dict('records')
-            if col_a.button("📝 โหลดมาแก้ไข"):
-                st.session_state.editing_no = sel_no
-                st.session_state.form_date = str(row_data.get('date', st.session_state.form_date))
-                for f in transport_fields: st.session_state[f"in_{f}"] = str(row_data.get(f, ""))
-                st.session_state.invoice_items = [{"product": i.get('product',''), "unit": i.get('unit',''), "qty": i.get('qty',''), "tank": str(i.get('tank','')), "seal": str(i.get('seal',''))} for i in it_rows]
-                st.session_state.pdf_buffer = generate_pdf_file(sel_no, st.session_state.invoice_items)
-                st.rerun()
-            if col_b.button("🔄 โหลดมาสร้างซ้ำ"):
-                st.session_state.editing_no = None
-                for f in transport_fields: st.session_state[f"in_{f}"] = str(row_data.get(f, ""))
-                st.session_state.invoice_items = [{"product": i.get('product',''), "unit": i.get('unit',''), "qty": i.get('qty',''), "tank": str(i.get('tank','')), "seal": str(i.get('seal',''))} for i in it_rows]
-                st.session_state.pdf_buffer = None
-                st.rerun()
-            quick_pdf = generate_pdf_file(sel_no, it_rows, data_dict=row_data)
-            col_c.download_button("📥 ดาวน์โหลด PDF (ทันที)", data=quick_pdf, file_name=f"Invoice_{sel_no}.pdf", mime="application/pdf")
-
-tabs = st.tabs(["📦 ข้อมูล-ต้นทาง-ปลายทาง", "🚛 ผู้ขนส่ง", "⛽ สินค้าที่ขนย้าย", "🏢 ผู้จัดจำหน่าย"])
-with tabs[0]:
-    for f in transport_fields[0:11]: st.text_input(f, key=f"in_{f}")
-with tabs[1]:
-    for f in transport_fields[11:26]: st.text_input(f, key=f"in_{f}")
-with tabs[2]:
+            if col_a.button("📝 โหลดมาแก้ไข", on_click=load_invoice_action, args=(sel_no, row_data, it_rows, True)): st.rerun()
+            if col_b.button("🔄 โหลดมาสร้างซ้ำ", on_click=load_invoice_action, args=(sel_no, row_data, it_rows, False)): st.rerun()
+            col_c.download_button("📥 ดาวน์โหลด PDF (ทันที)", data=pdf_source(sel_no, it_rows, data_dict=row_data), file_name=f"Invoice_{sel_no}.pdf", mime="application/pdf")
+
+@st.fragment
+def bulk_section():
+    sessions.touch(SESSION_ID)
+    with st.expander("📦 พิมพ์บิลหลายใบ (ทั้งเดือน/ช่วงวันที่)"):
+        bc1, bc2, bc3 = st.columns([2, 2, 1])
+        bulk_prefix = bc1.text_input("ขึ้นต้นด้วยเลขที่", value=f"{INV_PREFIX}-{datetime.now().year}-{datetime.now().month:02d}", key="bulk_prefix")
+        bulk_dates = bc2.date_input("ช่วงวันที่ (ไม่บังคับ)", value=[], key="bulk_dates")
+        bulk_fmt = bc3.radio("รูปแบบ", ["zip", "pdf"], format_func=lambda f: "ZIP แยกไฟล์" if f == "zip" else "PDF ไฟล์เดียว", key="bulk_fmt")
+        if st.button("🖨️ สร้างไฟล์"):
+            month = partitions.prefix_month(bulk_prefix)
+            d_from, d_to = (bulk_dates[0], bulk_dates[-1]) if bulk_dates else (None, None)
+            if month and month not in partitions.hot_months(): inv_df, item_df = get_store().load_range(d_from, d_to, month)
+            else: inv_df, item_df = get_data_cached(sync_versions())
+            selected_bulk = bulk_export.select_invoices(inv_df, bulk_prefix, d_from, d_to)
+            if selected_bulk.empty:
+                st.warning("ไม่พบบิลตามเงื่อนไข")
+            else:
+                bar = st.progress(0.0)
+                # ไฟล์แยกตาม session และถูกลบเมื่อสร้างไฟล์ใหม่หรือ session ไม่ได้ใช้งานนานเกิน JP_IDLE_SECONDS
+                out_path = sessions.session_file(SESSION_ID, f"Invoices_{bulk_prefix or 'export'}.{bulk_fmt}")
+                sessions.own_file(SESSION_ID, out_path)
+                stats = bulk_export.export(bulk_export.iter_jobs(selected_bulk, item_df), out_path, bulk_fmt, PDF_LAYOUT,
+                                           progress=lambda n: bar.progress(n / len(selected_bulk)))
+                st.session_state.bulk_file = out_path
+                st.success(f"✅ {stats['count']} บิล ใน {stats['seconds']:.1f} วินาที ({stats['rate']:.1f} บิล/วินาที) · "
+                           f"{stats['bytes'] / 1024:,.0f} KB ({stats['bytes_per_invoice'] / 1024:.1f} KB/บิล)")
+        if st.session_state.get("bulk_file") and os.path.exists(st.session_state.bulk_file):
+            path = st.session_state.bulk_file
+            st.download_button("📥 ดาวน์โหลดไฟล์รวม", data=lambda: Path(path).read_bytes(), file_name=os.path.basename(path).split("_", 1)[-1],
+                               mime="application/zip" if path.endswith(".zip") else "application/pdf")
+
+# ตารางและกราฟของรายงานคำนวณครั้งเดียวต่อ stamp ของยอดรวม (เปลี่ยนเมื่อมีบิลถูกแก้) และเดือนที่เลือก
+@st.cache_data(max_entries=32)
+def get_report_view(by, months, stamp):
+    with perf.span("rollup.view", by=by):
+        table = get_rollups().rollup(by, list(months), get_store().load_month)
+        top = table[table[by].isin(table[by].unique()[:20])]   # กราฟแสดง 20 อันดับแรก
+        chart = top.pivot_table(index=by, columns="unit", values="qty", aggfunc="sum") if len(table) else None
+        return table.rename(columns=reports.LABELS), chart
+
+@st.fragment
+def report_section():
+    with st.expander("📊 รายงานปริมาณขนส่ง"):
+        # expander ที่ปิดอยู่ก็ยังรันโค้ดข้างในทุก rerun จึงสร้างรายงานเมื่อสั่งแสดงเท่านั้น
+        if not st.toggle("แสดงรายงาน", key="report_on"): return
+        versions = sync_versions()
+        get_data_cached(versions)
+        rollups = get_rollups().sync(get_frames())
+        hot = [m for m in partitions.hot_months() if m]
+        months = st.multiselect("เดือน", hot + get_older_months(versions), default=hot, key="report_months")
+        if not months: return
+        load_month = get_store().load_month
+        for by, tab in zip(reports.DIMENSIONS, st.tabs(list(reports.DIMENSIONS.values()))):
+            with tab:
+                table, chart = get_report_view(by, tuple(months), rollups.stamp)
+                st.dataframe(table, hide_index=True, use_container_width=True)
+                if chart is not None: st.bar_chart(chart)
+        st.download_button("📥 ดาวน์โหลด CSV", data=lambda: reports.to_csv(rollups.table(months, load_month)),
+                           file_name=f"Volume_{min(months)}_{max(months)}.csv", mime="text/csv")
+
+@st.fragment
+def field_inputs(fields, with_date=False):
+    master = get_master_index().sync(get_frames())
+    for group in dict.fromkeys(filter(None, map(master_data.group_of, fields))):
+        mc1, mc2 = st.columns([1, 3])
+        query = mc1.text_input(f"ค้นหา{group}", key=f"mq_{group}", placeholder="พิมพ์คำขึ้นต้น")
+        with perf.span("master.lookup"):
+            choices = master.lookup(group, query)
+        mc2.selectbox(f"กรอก{group}ทั้งกลุ่ม", range(len(choices)), index=None, format_func=lambda i: master_data.label(choices[i]),
+                      key=f"ms_{group}", placeholder="ใช้บ่อย/ล่าสุดขึ้นก่อน",
+                      on_change=fill_group_action, args=(group, f"ms_{group}", choices))
+    if with_date: st.session_state.form_date = st.text_input("วันที่", value=st.session_state.form_date)
+    for f in fields: st.text_input(f, key=f"in_{f}")
+
+@st.fragment
+def items_editor():
     ca, cb, cc, cd, ce = st.columns([3,1,1,2,2])
     p_n = ca.text_input("รายการ", key="t_n")
     p_u = cb.text_input("หน่วย", value="ลิตร", key="t_u")
@@ -278,50 +280,86 @@ with tabs[2]:
     if st.button("➕ เพิ่มรายการสินค้า"):
         if p_n and p_q:
             st.session_state.invoice_items.append({"product":p_n, "unit":p_u, "qty":p_q, "tank":p_p, "seal":p_a})
-            st.rerun()
     st.markdown("---")
     if st.session_state.invoice_items:
         df_items = pd.DataFrame(st.session_state.invoice_items)
         edited_df = st.data_editor(df_items, num_rows="dynamic", use_container_width=True, key="logistics_editor")
         if not edited_df.equals(df_items): st.session_state.invoice_items = edited_df.to_dict('records')
-        if st.button("🗑️ ล้างรายการสินค้าทั้งหมด"): st.session_state.invoice_items = []; st.rerun()
-
-with tabs[3]:
-    st.session_state.form_date = st.text_input("วันที่", value=st.session_state.form_date)
-    for f in transport_fields[26:]: st.text_input(f, key=f"in_{f}")
-
-if st.button("💾 บันทึกและอัปเดต PDF", type="primary", use_container_width=True):
-    def get_next_no():
-        prefix = f"JPP-{datetime.now().year}-{datetime.now().month:02d}"
-        if inv_df.empty: return f"{prefix}-0001"
-        curr = inv_df[inv_df[INV_KEY].astype(str).str.startswith(prefix)]
-        if curr.empty: return f"{prefix}-0001"
-        suffixes = curr[INV_KEY].apply(lambda x: int(str(x).split('-')[-1]))
-        max_val = suffixes.max()
-        return f"{prefix}-{int(max_val)+1:04d}"
+        st.button("🗑️ ล้างรายการสินค้าทั้งหมด", on_click=lambda: st.session_state.update(invoice_items=[]))
+
+@st.fragment(run_every="3s")
+def sync_status_panel(inv_no):
+    state = store.save_status(inv_no)
+    target = store.save_target
+    if state:
+        if state["status"] == write_queue.DONE: st.caption(f"✅ {inv_no} บันทึกลง {target} แล้ว")
+        elif state["status"] == write_queue.FAILED: st.error(f"❌ {inv_no} บันทึกลง {target} ไม่สำเร็จหลังลอง {state['attempts']} ครั้ง: {state['last_error']}")
+        elif state["attempts"]: st.warning(f"⏳ {inv_no} รอบันทึกลง {target} (ลองใหม่ครั้งที่ {state['attempts']}: {state['last_error']})")
+        else: st.caption(f"⏳ {inv_no} กำลังบันทึกลง {target}…")
+    pending = store.pending_count()
+    if pending: st.caption(f"รายการที่รอบันทึกทั้งหมด: {pending}")
+    # รายการที่ผิดพลาดเกิน write_queue.MAX_ATTEMPTS ครั้งถูกพักไว้ ไม่ขวางบิลอื่น จนกว่าจะสั่งลองใหม่
+    failed = store.failed_count()
+    if failed:
+        st.error(f"รายการที่บันทึกไม่สำเร็จ: {failed}")
+        st.button("🔁 ลองบันทึกรายการที่ไม่สำเร็จอีกครั้ง", on_click=store.retry_failed)
+
+@st.fragment
+def save_bar():
+    if st.button("💾 บันทึกและอัปเดต PDF", type="primary", use_container_width=True):
+        def get_next_no():
+            prefix = f"{INV_PREFIX}-{datetime.now().year}-{datetime.now().month:02d}"
+            return store.next_number(prefix)
     
-    final_no = st.session_state.editing_no if st.session_state.editing_no else get_next_no()
-    new_data = [final_no, st.session_state.form_date] + [st.session_state[f"in_{f}"] for f in transport_fields]
-
-    if st.session_state.editing_no:
-        try:
-            cell = ws_inv.find(final_no)
-            if cell:
-                ws_inv.update(f"A{cell.row}", [new_data])
-            found_items = ws_item.findall(final_no)
-            for cell_it in reversed(found_items):
-                ws_item.delete_rows(cell_it.row)
-        except: pass
-    else:
-        ws_inv.append_row(new_data)
-
-    for it in st.session_state.invoice_items:
-        ws_item.append_row([final_no, it['product'], it['unit'], it['qty'], it['tank'], it['seal']])
-
-    st.session_state.pdf_buffer = generate_pdf_file(final_no, st.session_state.invoice_items)
-    st.session_state.editing_no = final_no
-    st.cache_data.clear(); st.rerun()
-
-if st.session_state.pdf_buffer:
-    st.download_button("📥 ดาวน์โหลด PDF", data=st.session_state.pdf_buffer, file_name=f"Invoice_{st.session_state.editing_no}.pdf", mime="application/pdf", use_container_width=True)
-    if st.button("🆕 เริ่มบิลใหม่"): reset_form_action(); st.rerun()
+        final_no = st.session_state.editing_no if st.session_state.editing_no else get_next_no()
+        new_data = [final_no, st.session_state.form_date] + [st.session_state[f"in_{f}"] for f in transport_fields]
+
+        store.save_invoice(final_no, new_data, st.session_state.invoice_items)
+        # แสดงบิลที่บันทึกในรายการค้นหาทันที (ทุก session) ไม่ต้องรอให้เขียนลงชีทเสร็จ
+        get_frames().apply_local(final_no, new_data, st.session_state.invoice_items)
+
+        # สร้าง PDF ลง cache ร่วมตอนนี้เลย (ข้อมูลในฟอร์มตรงกับที่บันทึก) session เก็บแค่ค่าอ้างอิง
+        pdf_source(final_no, st.session_state.invoice_items)()
+        st.session_state.pdf_ref = pdf_ref(final_no, st.session_state.invoice_items)
+        st.session_state.editing_no = final_no
+        st.rerun()
+
+    if st.session_state.pdf_ref:
+        sync_status_panel(st.session_state.editing_no)
+        st.download_button("📥 ดาวน์โหลด PDF", data=saved_pdf(st.session_state.pdf_ref), file_name=f"Invoice_{st.session_state.editing_no}.pdf", mime="application/pdf", use_container_width=True)
+        if st.button("🆕 เริ่มบิลใหม่", on_click=reset_form_action): st.rerun()
+
+search_section()
+bulk_section()
+report_section()
+
+tabs = st.tabs(["📦 ข้อมูล-ต้นทาง-ปลายทาง", "🚛 ผู้ขนส่ง", "⛽ สินค้าที่ขนย้าย", "🏢 ผู้จัดจำหน่าย"])
+with tabs[0]: field_inputs(transport_fields[0:11])
+with tabs[1]: field_inputs(transport_fields[11:26])
+with tabs[2]: items_editor()
+with tabs[3]: field_inputs(transport_fields[26:], with_date=True)
+
+save_bar()
+
+# ================= 5. PERFORMANCE PANEL =================
+if storage.flag(st.secrets, "perf_panel", "JP_PERF_PANEL"):
+    with st.sidebar.expander("⏱️ เวลาประมวลผล", expanded=True):
+        run = perf.current()
+        last = perf.last_rerun(run.session) if run else None
+        if last: st.caption(f"รอบก่อน: {last['ms']:.0f} ms · API {sum(last['api'].values())} ครั้ง")
+        if run and run.spans:
+            st.dataframe(pd.DataFrame(run.spans, columns=["span", "ms"]).round(1), hide_index=True)
+        st.caption(f"API call รอบนี้: {dict(run.api) if run and run.api else 'ไม่มี'}")
+        st.markdown("**ทั้ง process (ล่าสุด)**")
+        stats = perf.span_stats()
+        if stats: st.dataframe(pd.DataFrame(stats), hide_index=True)
+        cache = get_pdf_cache()
+        mem, live = sessions.process_memory(), sessions.stats()
+        st.caption(f"หน่วยความจำ process {mem['rss_mb'] or '-'} MB (สูงสุด {mem['peak_mb'] or '-'} MB) · session ที่ใช้งาน {live['sessions']} · "
+                   f"ไฟล์รวมค้าง {live['files']} ({live['file_mb']} MB)")
+        st.caption(f"PDF cache {len(cache)} ไฟล์ {cache.size_bytes / 2 ** 20:.1f} MB · hit {cache.hits} / miss {cache.misses} · บันทึกค้าง {store.pending_count()} · API รวม {perf.api_totals()}")
+        quota = sheets_client.metrics()
+        st.caption(f"โควตา Sheets/นาที: อ่าน {quota['read_last_min']}/{quota['read_limit']} · เขียน {quota['write_last_min']}/{quota['write_limit']} · "
+                   f"รวมคำขอซ้ำ {quota['coalesced']} · รอโควตา {quota['throttled']} ครั้ง ({quota['waited_s']} วินาที) · ลองใหม่ {quota['retries']} · ล้มเหลว {quota['failed']}")
+
+perf.end_rerun()
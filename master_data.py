@@ -0,0 +1,204 @@
+# ================= MASTER DATA =================
+# รายชื่อที่ใช้ซ้ำข้ามบิล (ผู้รับสินค้า, คลัง, ผู้ขนส่ง, พนักงานขับรถ/ทะเบียนรถ, ผู้จำหน่าย ฯลฯ)
+# สร้างจาก Invoices ครั้งเดียว แล้วตาม patch ของ FrameCache ทีละบิล (headers_since) ไม่ต้องสร้างใหม่ทั้งหมด
+# ชุดค่าของแต่ละกลุ่มที่ซ้ำกันรวมเป็นรายการเดียว จัดอันดับตามความถี่และความใหม่ (frecency)
+# ค้นด้วยคำขึ้นต้นของคำใดก็ได้ในกลุ่ม (bisect บน key ที่เรียงไว้) แล้วเลือกเพื่อกรอกทั้งกลุ่มในครั้งเดียว
+import heapq
+import threading
+from bisect import bisect_left, insort
+from datetime import date, datetime
+from functools import lru_cache
+from itertools import islice
+
+import perf
+from invoice_search import normalize
+from sheet_store import INV_KEY, TRANSPORT_FIELDS
+
+# ค่าเฉพาะของเที่ยวนั้น ไม่ใช่ข้อมูลหลัก
+PER_INVOICE = {
+    "ผู้รับผลิตภัณฑ์-หมายเลขตั๋ว",
+    "ข้อมูลพนักงานขับรถ-วันออกเดินทาง", "ข้อมูลพนักงานขับรถ-เวลาออกเดินทาง",
+    "ข้อมูลพนักงานขับรถ-วันที่ถึงปลายทาง", "ข้อมูลพนักงานขับรถ-เวลาที่ถึงปลายทาง",
+}
+GROUPS = {}
+for _f in TRANSPORT_FIELDS:
+    if _f not in PER_INVOICE: GROUPS.setdefault(_f.split("-")[0], []).append(_f)
+
+# บิลที่เก่ากว่านี้หนึ่งช่วงมีน้ำหนักครึ่งหนึ่งของบิลวันนี้
+HALF_LIFE_DAYS = 30
+# ปี พ.ศ. (เช่น 17/10/2569) ที่พบบ่อยในวันที่ที่กรอกเอง แปลงเป็น ค.ศ. ก่อนคิดน้ำหนัก
+BE_OFFSET = 543
+BE_YEARS_FROM = 2400
+
+
+def group_of(field):
+    name = field.split("-")[0]
+    return name if field in GROUPS.get(name, ()) else None
+
+
+def day_of(day_text, today=None):
+    """Date of a dd/mm/YYYY text (Buddhist-era years converted); invalid or future dates count as today."""
+    today = today or date.today()
+    try:
+        day = datetime.strptime(str(day_text).strip(), "%d/%m/%Y").date()
+        if day.year >= BE_YEARS_FROM: day = day.replace(year=day.year - BE_OFFSET)
+    except ValueError:
+        return today
+    return min(day, today)
+
+
+def weight(day_text, origin, today=None):
+    # 2^(วัน/HALF_LIFE) นับจาก origin (วันที่สร้างดัชนี): ผลรวมเรียงลำดับเหมือน frecency ที่ลดลงตามเวลา
+    # ณ วันใดก็ได้ จึงบวก/ลบทีละบิลได้โดยไม่ต้องคำนวณน้ำหนักของบิลเก่าใหม่
+    # วันที่ไม่เกินวันนี้ เลขชี้กำลังจึงไม่ล้น ส่วนบิลเก่ามากน้ำหนักเป็น 0 (เรียงตามจำนวนบิลแทน)
+    return 2 ** ((day_of(day_text, today) - origin).days / HALF_LIFE_DAYS)
+
+
+class _Group:
+    def __init__(self, fields):
+        self.fields = fields
+        self.entries = {}     # ชุดค่า -> [จำนวนบิล, คะแนน]
+        self.keys = []        # (คำค้นที่ normalize แล้ว, ชุดค่า) เรียงไว้สำหรับ bisect
+        self._rank = None     # ชุดค่า -> อันดับ (0 = ดีที่สุด) คำนวณเมื่อถูกค้นหลังข้อมูลเปลี่ยน
+
+    def add(self, values, w, index=True):
+        entry = self.entries.get(values)
+        if entry is None:
+            entry = self.entries[values] = [0, 0.0]
+            if index:
+                for k in _search_keys(values): insort(self.keys, (k, values))
+        entry[0] += 1
+        entry[1] += w
+        self._rank = None
+
+    def reindex(self):
+        self.keys = sorted((k, values) for values in self.entries for k in _search_keys(values))
+
+    def remove(self, values, w):
+        entry = self.entries.get(values)
+        if entry is None: return
+        entry[0] -= 1
+        entry[1] -= w
+        if entry[0] > 0: return
+        self._rank = None
+        del self.entries[values]
+        for k in _search_keys(values):
+            i = bisect_left(self.keys, (k, values))
+            if i < len(self.keys) and self.keys[i] == (k, values): del self.keys[i]
+
+    def ranked(self):
+        if self._rank is None:
+            order = sorted(self.entries, key=lambda v: (self.entries[v][1], self.entries[v][0]), reverse=True)
+            self._rank = {v: i for i, v in enumerate(order)}
+        return self._rank
+
+    def top(self, candidates, limit):
+        return heapq.nsmallest(limit, candidates, key=self.ranked().__getitem__)
+
+
+@lru_cache(maxsize=65536)
+def _words(value):
+    # ทุกคำของช่อง: "บริษัท ปิโตรไทย จำกัด" ค้นเจอด้วย "บริษัท", "ปิโตร" หรือ "จำกัด"
+    words = value.split()
+    return frozenset(normalize(" ".join(words[i:])) for i in range(len(words))) - {""}
+
+
+def _search_keys(values):
+    return frozenset().union(*map(_words, values))
+
+
+class MasterIndex:
+    """Deduplicated field groups of the Invoices frame ranked by frequency and recency.
+
+    sync(frames) follows a storage.FrameCache: the first call (and any call
+    after a full reload) indexes inv_df, later calls only re-index the
+    invoices in frames.headers_since(). Thread-safe; shared by every session.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stamp = None
+        self.groups = {}
+        self.origin = None
+        self._seen = {}   # invoice_no -> (น้ำหนัก, {กลุ่ม: ชุดค่า}) ที่นับไว้ เพื่อถอนออกเมื่อบิลถูกแก้
+
+    def sync(self, frames):
+        stamp = frames.stamp   # อ่าน stamp ก่อน inv_df: ถ้ามี patch แทรกจะถูกนับซ้ำรอบหน้าแบบไม่มีผลเสีย
+        if stamp == self.stamp or frames.inv_df is None: return self
+        with self._lock:
+            if stamp == self.stamp: return self
+            headers = frames.headers_since(self.stamp) if self.stamp is not None else None
+            if headers is None:
+                with perf.span("master.build"):
+                    self._build(frames.inv_df)
+            else:
+                with perf.span("master.patch"):
+                    for inv_no, header in headers.items(): self._put(inv_no, header)
+            for grp in self.groups.values(): grp.ranked()   # จัดอันดับครั้งเดียวตอนข้อมูลเปลี่ยน ไม่ใช่ตอนค้น
+            self.stamp = stamp
+        return self
+
+    def _build(self, inv_df):
+        self.groups = {g: _Group(fields) for g, fields in GROUPS.items()}
+        self.origin = date.today()
+        self._seen = {}
+        columns = {c: inv_df[c].astype(str).tolist() if c in inv_df.columns else [""] * len(inv_df)
+                   for c in [INV_KEY, "date"] + TRANSPORT_FIELDS}
+        # น้ำหนักคำนวณครั้งเดียวต่อวันที่ที่ต่างกัน
+        weights = {d: weight(d, self.origin) for d in set(columns["date"])}
+        group_cols = {g: [columns[f] for f in fields] for g, fields in GROUPS.items()}
+        for i, inv_no in enumerate(columns[INV_KEY]):
+            w = weights[columns["date"][i]]
+            picked = {}
+            for g, cols in group_cols.items():
+                values = tuple(c[i].strip() for c in cols)
+                if any(values):
+                    picked[g] = values
+                    self.groups[g].add(values, w, index=False)
+            self._unseen(inv_no)
+            self._seen[inv_no] = (w, picked)
+        for grp in self.groups.values(): grp.reindex()
+
+    def _put(self, inv_no, header):
+        self._unseen(inv_no)
+        if header is None: return
+        w = weight(header.get("date", ""), self.origin)
+        picked = {}
+        for g, fields in GROUPS.items():
+            values = tuple(str(header.get(f, "")).strip() for f in fields)
+            if any(values):
+                picked[g] = values
+                self.groups[g].add(values, w)
+        self._seen[str(inv_no)] = (w, picked)
+
+    def _unseen(self, inv_no):
+        # เลขที่ซ้ำในชีท: นับแถวล่าสุด เหมือน patch ที่แทนทุกแถวของเลขนั้น
+        w, picked = self._seen.pop(str(inv_no), (0.0, {}))
+        for g, values in picked.items(): self.groups[g].remove(values, w)
+
+    def lookup(self, group, query="", limit=8):
+        """Best-ranked value tuples of group (ordered like GROUPS[group]) with a word starting with query."""
+        g = self.groups.get(group)
+        if g is None: return []
+        q = normalize(query) if query else ""
+        with self._lock:
+            if not q: return list(islice(g.ranked(), limit))   # dict เรียงตามอันดับอยู่แล้ว
+            i = bisect_left(g.keys, (q,))
+            hits = set()
+            while i < len(g.keys) and g.keys[i][0].startswith(q):
+                hits.add(g.keys[i][1])
+                i += 1
+            return g.top(hits, limit)
+
+    def stats(self):
+        return {g: len(grp.entries) for g, grp in self.groups.items()}
+
+
+def fill(group, values):
+    """{field: value} to put in the form for a tuple returned by MasterIndex.lookup()."""
+    return dict(zip(GROUPS[group], values))
+
+
+def label(values, max_parts=3):
+    parts = [v for v in values if v]
+    return " · ".join(parts[:max_parts]) or "-"
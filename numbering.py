@@ -0,0 +1,65 @@
+# ================= INVOICE NUMBER ALLOCATOR =================
+# ออกเลขที่บิล PREFIX-NNNN จากตัวนับต่อ prefix ใน SQLite (ไฟล์เดียวกับที่เก็บข้อมูลบิล)
+# การออกเลขอยู่ใน transaction แบบ BEGIN IMMEDIATE จึงไม่ซ้ำกันแม้หลาย session/process บันทึกพร้อมกัน
+import sqlite3
+
+from sheet_store import INV_SHEET
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoice_counters (
+    prefix TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# เลขที่บิลสูงสุดในช่วง [prefix-, prefix.) ของแต่ละที่เก็บข้อมูล ค้นผ่าน index ไม่ต้องสแกนทั้งตาราง
+# ("." ตามหลัง "-" ในลำดับ ASCII จึงเป็นขอบบนของช่วง)
+# เทียบแบบตัวเลข: เลขที่ยาวกว่ามากกว่าเสมอ ("-10000" > "-9999" แม้ MAX แบบข้อความจะได้ "-9999")
+MIRROR_MAX_SQL = (f"SELECT key FROM sheet_rows WHERE sheet = '{INV_SHEET}' AND key >= ? AND key < ? "
+                  "ORDER BY length(key) DESC, key DESC LIMIT 1")
+INVOICES_MAX_SQL = ("SELECT invoice_no FROM invoices WHERE invoice_no >= ? AND invoice_no < ? "
+                    "ORDER BY length(invoice_no) DESC, invoice_no DESC LIMIT 1")
+
+
+def suffix_of(inv_no):
+    try: return int(str(inv_no).split('-')[-1])
+    except ValueError: return 0
+
+
+class InvoiceNumberAllocator:
+    """O(1), collision-free allocation of the next number for a prefix.
+
+    The counter never goes below the highest number already stored (max_sql
+    runs on the same SQLite file, e.g. over the mirrored Invoices sheet), so
+    numbers saved by other hosts are never handed out again. The first
+    allocation for a prefix rebuilds the counter from the stored invoices.
+    """
+
+    def __init__(self, path, max_sql=MIRROR_MAX_SQL):
+        self.path = path
+        self.max_sql = max_sql
+        with sqlite3.connect(self.path, timeout=30) as con:
+            con.executescript(_SCHEMA)
+
+    def allocate(self, prefix):
+        return self.allocate_many(prefix, 1)[0]
+
+    def allocate_many(self, prefix, count):
+        """count consecutive numbers for prefix in one transaction (e.g. for a batch import)."""
+        con = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            row = con.execute("SELECT value FROM invoice_counters WHERE prefix = ?", (prefix,)).fetchone()
+            first = max(row[0] if row else 0, self._stored_max(con, prefix)) + 1
+            con.execute("INSERT OR REPLACE INTO invoice_counters (prefix, value) VALUES (?, ?)", (prefix, first + count - 1))
+            con.execute("COMMIT")
+        except:
+            if con.in_transaction: con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+        return [f"{prefix}-{value:04d}" for value in range(first, first + count)]
+
+    def _stored_max(self, con, prefix):
+        row = con.execute(self.max_sql, (f"{prefix}-", f"{prefix}.")).fetchone()
+        return suffix_of(row[0]) if row and row[0] else 0
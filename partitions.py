@@ -0,0 +1,157 @@
+# ================= MONTHLY PARTITIONS =================
+# เลขที่บิล PREFIX-YYYY-MM-NNNN บอกเดือนของบิล หน้าแอปโหลดล่วงหน้าเฉพาะเดือนล่าสุด (HOT_MONTHS เดือน)
+# เดือนที่เก่ากว่าโหลดเมื่อค้นหา/พิมพ์ซ้ำเท่านั้น
+# ชีทหลักเก็บเฉพาะเดือนล่าสุด: งานย้ายเดือนที่ปิดแล้วไปชีทรายเดือน "Invoices YYYY-MM" / "InvoiceItems YYYY-MM"
+#   python partitions.py archive --keep 2 --dry-run
+# ควรรันตอนไม่มีใครบันทึกบิล (เช่นต้นเดือนนอกเวลาทำงาน) เพราะการลบแถวทำให้เลขแถวในชีทหลักเลื่อน
+import argparse
+import os
+import re
+import sys
+from collections import defaultdict
+from datetime import date
+
+from gspread.exceptions import WorksheetNotFound
+from gspread.utils import numericise_all
+
+import sheet_store
+from sheet_store import INV_SHEET, ITEM_SHEET
+
+HOT_MONTHS = int(os.environ.get("JP_HOT_MONTHS", 2))
+
+_MONTH = re.compile(r"-(\d{4})-(\d{2})-\d")
+_PREFIX_MONTH = re.compile(r"-(\d{4})-(\d{2})(?:-|$)")
+# แบบเดียวกับ _MONTH สำหรับ SQLite GLOB
+NUMBERED_GLOB = "*-[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9]*"
+
+
+def month_of(inv_no):
+    """'YYYY-MM' of an invoice number like JPP-2026-09-0001, or None if it has no month."""
+    m = _MONTH.search(str(inv_no))
+    return f"{m[1]}-{m[2]}" if m else None
+
+
+def prefix_month(prefix):
+    """'YYYY-MM' of a number prefix like JPP-2026-09, or None."""
+    m = _PREFIX_MONTH.search(str(prefix or ""))
+    return f"{m[1]}-{m[2]}" if m else None
+
+
+def month_glob(month):
+    return f"*-{month}-[0-9]*"
+
+
+def hot_months(keep=HOT_MONTHS, today=None):
+    """The keep most recent months, newest first, plus None (numbers without a month are always loaded)."""
+    today = today or date.today()
+    index = today.year * 12 + today.month - 1
+    return [f"{(index - i) // 12:04d}-{(index - i) % 12 + 1:02d}" for i in range(keep)] + [None]
+
+
+def archive_title(sheet, month):
+    return f"{sheet} {month}"
+
+
+def archived_months(spreadsheet):
+    """Months that have an archive worksheet, newest first."""
+    titles = {ws.title for ws in spreadsheet.worksheets()}
+    return sorted({t.rsplit(" ", 1)[1] for t in titles if re.fullmatch(rf"{INV_SHEET} \d{{4}}-\d{{2}}", t)}, reverse=True)
+
+
+def records(values):
+    """get_all_values() rows (header first) as records, converted like get_all_records()."""
+    if not values: return []
+    header = values[0]
+    return [dict(zip(header, numericise_all(list(r) + [""] * (len(header) - len(r))))) for r in values[1:]]
+
+
+def read_archive(spreadsheet, sheet, month):
+    """get_all_values() of the archive worksheet of sheet for month ([] if there is none)."""
+    try: return spreadsheet.worksheet(archive_title(sheet, month)).get_all_values()
+    except WorksheetNotFound: return []
+
+
+# ================= ARCHIVAL JOB =================
+def _ranges(rows):
+    ranges = []
+    for r in rows:
+        if ranges and ranges[-1][1] == r - 1: ranges[-1] = (ranges[-1][0], r)
+        else: ranges.append((r, r))
+    return ranges
+
+
+def _cells(row):
+    # get_all_values() เติมช่องว่างท้ายแถวตามความกว้างของชีท จึงเทียบหลังตัดช่องว่างท้ายแถวออก
+    row = [str(v) for v in row]
+    while row and row[-1] == "": row.pop()
+    return row
+
+
+def _archive_ws(spreadsheet, sheet, month, header):
+    try:
+        return spreadsheet.worksheet(archive_title(sheet, month))
+    except WorksheetNotFound:
+        ws = spreadsheet.add_worksheet(archive_title(sheet, month), rows=1, cols=len(header))
+        ws.update(range_name="A1", values=[header])
+        return ws
+
+
+def archive_closed_months(spreadsheet, keep=HOT_MONTHS, today=None, dry_run=False):
+    """Move the rows of months older than the keep most recent ones into monthly worksheets.
+
+    Rows are copied as RAW values (like every other write, so numbers with
+    leading zeros, dates and "1,000" stay text), read back and compared with
+    the main sheet, and only then deleted from it; on any difference nothing
+    is deleted and RuntimeError is raised. An invoice that is already in the
+    archive (edited after it was archived, or copied by an interrupted run)
+    is replaced by the main sheet's rows, so running the job again is safe.
+    Returns {month: {sheet: rows moved}}.
+    """
+    cutoff = hot_months(keep, today)[keep - 1]
+    moved = defaultdict(dict)
+    for sheet in (INV_SHEET, ITEM_SHEET):
+        ws = spreadsheet.worksheet(sheet)
+        values = ws.get_all_values()
+        if not values: continue
+        by_month, rows_moved = defaultdict(list), []
+        for row_no, row in enumerate(values[1:], start=2):
+            month = month_of(row[0]) if row else None
+            if month and month < cutoff:
+                by_month[month].append(row)
+                rows_moved.append(row_no)
+        differs = []
+        for month, rows in sorted(by_month.items()):
+            moved[month][sheet] = len(rows)
+            if dry_run: continue
+            arch = _archive_ws(spreadsheet, sheet, month, values[0])
+            keys = {str(r[0]) for r in rows}
+            stale = [i for i, k in enumerate(arch.col_values(1), start=1) if i > 1 and str(k) in keys]
+            sheet_store.delete_row_ranges(arch, _ranges(stale))
+            arch.append_rows(rows)
+            copied = [r for r in arch.get_all_values()[1:] if r and str(r[0]) in keys]
+            if list(map(_cells, copied)) != list(map(_cells, rows)): differs.append(month)
+        if differs:
+            raise RuntimeError(f"สำเนาใน {', '.join(archive_title(sheet, m) for m in differs)} ไม่ตรงกับ {sheet} จึงยังไม่ลบแถวจากชีทหลัก")
+        if not dry_run: sheet_store.delete_row_ranges(ws, _ranges(rows_moved))
+    return dict(moved)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monthly partitions of the invoice sheets")
+    sub = parser.add_subparsers(dest="command", required=True)
+    arc = sub.add_parser("archive", help="move closed months out of the main sheets into monthly worksheets")
+    arc.add_argument("--keep", type=int, default=HOT_MONTHS, help="recent months that stay in the main sheets")
+    arc.add_argument("--dry-run", action="store_true", help="only report what would be moved")
+    arc.add_argument("--secrets", default=".streamlit/secrets.toml")
+    args = parser.parse_args(argv)
+
+    spreadsheet = sheet_store.open_spreadsheet(sheet_store.load_service_account(args.secrets))
+    moved = archive_closed_months(spreadsheet, args.keep, dry_run=args.dry_run)
+    for month, counts in sorted(moved.items()):
+        print(f"{month}: {counts.get(INV_SHEET, 0)} invoices, {counts.get(ITEM_SHEET, 0)} items", file=sys.stderr)
+    if not moved: print("nothing to archive", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
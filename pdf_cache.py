@@ -0,0 +1,112 @@
+# ================= PDF CACHE =================
+# เก็บ PDF ที่สร้างแล้วโดยใช้ hash ของเนื้อหาบิลเป็น key บิลที่ไม่เปลี่ยนจะได้ bytes เดิมทันที
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import invoice_pdf
+from sheet_store import ITEM_FIELDS
+
+
+def pdf_key(inv_no, items, data, *variant):
+    """Hash of everything that ends up on the page: header values, items, template version and layout variant."""
+    payload = {
+        "template": invoice_pdf.TEMPLATE_VERSION,
+        "variant": repr(variant),
+        "no": str(inv_no),
+        # ค่าที่ไม่มีใน data ใช้ None เพราะตัวสร้าง PDF จะใช้ค่าเริ่มต้นแทน
+        "data": {k: (str(data[k]) if k in data else None) for k in invoice_pdf.DATA_KEYS},
+        "items": [{k: (str(it[k]) if k in it else None) for k in ITEM_FIELDS} for it in items],
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+class PdfCache:
+    """Thread-safe LRU of PDF bytes, capped by entries and total bytes, with an optional on-disk second tier."""
+
+    def __init__(self, max_entries=64, disk_dir=None, disk_max_entries=2000, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self.hits = self.misses = 0
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_dir: os.makedirs(disk_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self._mem)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return self._mem[key]
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, data)
+        return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._remember(key, data)
+        self._write_disk(key, data)
+
+    def get_or_render(self, key, render):
+        """Return cached bytes for key, calling render() -> bytes only on a miss."""
+        data = self.get(key)
+        if data is None:
+            data = render()
+            self.put(key, data)
+        return data
+
+    def _remember(self, key, data):
+        self.size_bytes += len(data) - len(self._mem.get(key, b""))
+        self._mem[key] = data
+        self._mem.move_to_end(key)
+        # ไล่ใบที่ใช้นานที่สุดออกจนกว่าจะอยู่ในขนาดที่กำหนด (ใบล่าสุดเก็บไว้เสมอ)
+        while len(self._mem) > 1 and (len(self._mem) > self.max_entries or
+                                      (self.max_bytes and self.size_bytes > self.max_bytes)):
+            self.size_bytes -= len(self._mem.popitem(last=False)[1])
+
+    # ---------- disk tier ----------
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.pdf")
+
+    def _read_disk(self, key):
+        if not self.disk_dir: return None
+        try:
+            with open(self._path(key), "rb") as fh:
+                data = fh.read()
+            os.utime(self._path(key))   # ให้การลบไฟล์เก่าเป็นแบบ LRU
+            return data
+        except OSError:
+            return None
+
+    def _write_disk(self, key, data):
+        if not self.disk_dir: return
+        tmp = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp, self._path(key))
+            self._prune_disk()
+        except OSError:
+            pass
+
+    def _prune_disk(self):
+        files = [e for e in os.scandir(self.disk_dir) if e.name.endswith(".pdf")]
+        if len(files) <= self.disk_max_entries: return
+        files.sort(key=lambda e: e.stat().st_mtime)
+        for e in files[:len(files) - self.disk_max_entries]:
+            try: os.remove(e.path)
+            except OSError: pass
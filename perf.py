@@ -0,0 +1,216 @@
+# ================= PERFORMANCE INSTRUMENTATION =================
+# จับเวลาแต่ละช่วงงาน (span) และนับ API call ของ Google Sheets แยกตาม rerun ของแต่ละ session
+# ผลสรุปแสดงในแผงผู้ดูแลของแอป และเขียนเป็น JSON lines ลงไฟล์ JP_PERF_LOG (ถ้ากำหนด)
+# เพื่อนำไปรวมสถิติข้าม session ได้ เช่น  python perf.py perf.jsonl
+import argparse
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from functools import wraps
+
+import numpy as np
+
+LOG_PATH = os.environ.get("JP_PERF_LOG", "")
+HISTORY = 500   # จำนวนค่าล่าสุดต่อ span ที่เก็บไว้คำนวณ percentile ของ process
+MAX_SESSIONS = 1000
+
+_current = contextvars.ContextVar("perf_rerun", default=None)
+_lock = threading.Lock()
+_history = defaultdict(lambda: deque(maxlen=HISTORY))
+_api_totals = Counter()
+_open_runs = {}
+_last_runs = {}
+
+
+class Rerun:
+    def __init__(self, session):
+        self.session = session
+        self.started = time.perf_counter()
+        self.spans = []
+        self.api = Counter()
+
+    def summary(self, interrupted=False):
+        totals = defaultdict(float)
+        for name, ms in self.spans: totals[name] += ms
+        return {"type": "rerun", "ts": time.time(), "session": self.session,
+                "ms": round((time.perf_counter() - self.started) * 1000, 3), "interrupted": interrupted,
+                "spans": {k: round(v, 3) for k, v in totals.items()}, "api": dict(self.api)}
+
+
+# ---------- reruns ----------
+def begin_rerun(session):
+    """Start collecting spans and API calls for one script run of a session."""
+    with _lock:
+        unfinished = _open_runs.pop(session, None)
+    # st.rerun()/st.stop() จบสคริปต์ก่อนถึง end_rerun จึงปิดรอบที่ค้างไว้ตอนเริ่มรอบใหม่
+    if unfinished: _finish(unfinished, interrupted=True)
+    run = Rerun(session)
+    with _lock:
+        _open_runs[session] = run
+    _current.set(run)
+    return run
+
+
+def end_rerun():
+    run = _current.get()
+    if run is None: return None
+    with _lock:
+        if _open_runs.get(run.session) is run: del _open_runs[run.session]
+    _current.set(None)
+    return _finish(run)
+
+
+def _finish(run, interrupted=False):
+    summary = run.summary(interrupted)
+    with _lock:
+        _last_runs.pop(run.session, None)
+        _last_runs[run.session] = summary
+        if len(_last_runs) > MAX_SESSIONS: del _last_runs[next(iter(_last_runs))]
+    _log(summary)
+    return summary
+
+
+def current():
+    return _current.get()
+
+
+def last_rerun(session):
+    with _lock:
+        return _last_runs.get(session)
+
+
+# ---------- spans ----------
+@contextmanager
+def span(name, **fields):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - started) * 1000, **fields)
+
+
+def timed(name):
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def record(name, ms, **fields):
+    run = _current.get()
+    if run is not None: run.spans.append((name, ms))
+    with _lock:
+        _history[name].append(ms)
+    if LOG_PATH:
+        _log({"type": "span", "ts": time.time(), "name": name, "ms": round(ms, 3),
+              "session": run.session if run else None, "thread": threading.current_thread().name, **fields})
+
+
+# ---------- API calls ----------
+def count_api(name):
+    run = _current.get()
+    if run is not None: run.api[name] += 1
+    with _lock:
+        _api_totals[name] += 1
+
+
+def api_call_name(method, endpoint):
+    # gspread ใส่ช่วงเซลล์แบบ URL-encoded (":" กลายเป็น %3A) จึงมี ":" เฉพาะหน้าชื่อ action
+    #   .../ID/values/RANGE:append -> "POST values:append", .../ID:batchUpdate -> "POST batchUpdate"
+    #   Drive API (modifiedTime) -> "GET drive/files"
+    if "/drive/" in str(endpoint): return f"{method.upper()} drive/files"
+    last = str(endpoint).split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+    action = last.split(":", 1)[1] if ":" in last else ""
+    if "/values" in str(endpoint):
+        return f"{method.upper()} values" + (f":{action}" if action else "")
+    return f"{method.upper()} {action or 'spreadsheet'}"
+
+
+def instrument_client(http_client):
+    """Count every HTTP request a gspread client makes (shared by all its worksheets)."""
+    if getattr(http_client, "_perf_instrumented", False): return http_client
+    request = http_client.request
+
+    @wraps(request)
+    def counted(method, endpoint, *args, **kwargs):
+        count_api(api_call_name(method, endpoint))
+        with span("sheets.api"):
+            return request(method, endpoint, *args, **kwargs)
+    http_client.request = counted
+    http_client._perf_instrumented = True
+    return http_client
+
+
+# ---------- process-wide view ----------
+def span_stats():
+    """Per span name: count, p50/p95/max ms and total seconds over the recent history."""
+    with _lock:
+        snapshot = {k: list(v) for k, v in _history.items()}
+    rows = []
+    for name, values in snapshot.items():
+        p50, p95 = np.percentile(values, [50, 95])
+        rows.append({"span": name, "n": len(values), "p50_ms": round(p50, 1), "p95_ms": round(p95, 1),
+                     "max_ms": round(max(values), 1), "total_s": round(sum(values) / 1000, 2)})
+    return sorted(rows, key=lambda r: -r["total_s"])
+
+
+def api_totals():
+    with _lock:
+        return dict(_api_totals)
+
+
+def _log(entry):
+    if not LOG_PATH: return
+    line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+    with _lock:
+        with open(LOG_PATH, "a", encoding="utf-8") as fh:
+            fh.write(line)
+
+
+# ================= LOG AGGREGATION =================
+def aggregate(lines):
+    """Slowest spans across all sessions in a JSON-lines log, plus API calls per rerun."""
+    spans, api, reruns = defaultdict(list), Counter(), 0
+    for line in lines:
+        try: entry = json.loads(line)
+        except ValueError: continue
+        if entry.get("type") == "span":
+            spans[entry["name"]].append(entry["ms"])
+        elif entry.get("type") == "rerun":
+            reruns += 1
+            api.update(entry.get("api", {}))
+    rows = []
+    for name, values in spans.items():
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        rows.append((name, len(values), p50, p95, p99, sum(values) / 1000))
+    return sorted(rows, key=lambda r: -r[5]), api, reruns
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarise a JP_PERF_LOG file")
+    parser.add_argument("log", nargs="+")
+    args = parser.parse_args(argv)
+    lines = []
+    for path in args.log:
+        with open(path, encoding="utf-8") as fh:
+            lines.extend(fh)
+    rows, api, reruns = aggregate(lines)
+    print(f"{'span':<24} {'n':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'total s':>9}")
+    for name, n, p50, p95, p99, total in rows:
+        print(f"{name:<24} {n:>7} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f} {total:>9.1f}")
+    print(f"\n{reruns} reruns")
+    for name, n in api.most_common():
+        print(f"{name:<24} {n:>7} calls ({n / max(reruns, 1):.2f} per rerun)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+# ================= VOLUME REPORTS =================
+# ปริมาณที่ขนส่งตามเดือน สินค้า ผู้ขนส่ง และคลัง จาก InvoiceItems ต่อกับ Invoices
+# qty ในชีทเป็นข้อความมีจุลภาค ("1,500") แปลงเป็นตัวเลขครั้งเดียวทั้งคอลัมน์ (vectorized)
+# VolumeRollups เก็บผลรวมที่ละเอียดที่สุด (เดือน × สินค้า × หน่วย × ผู้ขนส่ง × คลัง) และปรับทีละบิลตาม patch
+# ของ FrameCache (invoices_since) เมื่อบันทึก รายงานแต่ละแบบรวมจากตารางนี้ซึ่งมีไม่กี่ร้อยแถว
+# เดือนเก่า (นอก partitions.hot_months) คำนวณเมื่อเลือกดูครั้งแรกแล้วเก็บไว้ จนกว่าจะมีบิลของเดือนนั้นถูกแก้
+import math
+import threading
+
+import pandas as pd
+
+import partitions
+import perf
+from sheet_store import INV_KEY
+
+CARRIER = "ผู้ดำเนินการขนส่ง-ชื่อ"
+DEPOT = "คลังรับผลิตภัณฑ์-ชื่อ"
+# มิติที่รายงานได้ -> ชื่อที่แสดง
+DIMENSIONS = {"product": "สินค้า", "carrier": "ผู้ขนส่ง", "depot": "คลัง", "month": "เดือน"}
+KEYS = ["month", "product", "unit", "carrier", "depot"]
+VALUES = ["qty", "lines"]
+LABELS = {**DIMENSIONS, "unit": "หน่วย", "qty": "ปริมาณ", "lines": "รายการ"}
+NO_MONTH = ""   # เลขที่บิลที่ไม่มีเดือน
+
+
+def qty_value(text):
+    """Number of one sheet quantity like "1,500" (blank, invalid or non-finite -> 0), as parse_qty does per column."""
+    try: value = float(str(text if text is not None else "").replace(",", "").strip() or 0)
+    except ValueError: return 0.0
+    return value if math.isfinite(value) else 0.0
+
+
+def parse_qty(values):
+    """Numeric quantities of a column of sheet text like "1,500" (blank, invalid or non-finite -> 0)."""
+    s = pd.Series(values).astype("string").str.replace(",", "", regex=False).str.strip()
+    qty = pd.to_numeric(s, errors="coerce").astype(float)
+    return qty.where(qty.abs() < math.inf, 0.0)   # NaN เทียบแล้วเป็นเท็จ จึงเป็น 0 ด้วย
+
+
+def item_lines(inv_df, item_df):
+    """One row per item: invoice_no, KEYS and numeric qty (month from the invoice number)."""
+    if item_df is None or item_df.empty or INV_KEY not in item_df.columns:
+        return pd.DataFrame(columns=[INV_KEY] + KEYS + ["qty"])
+    text = lambda df, c: df[c].astype(str).str.strip() if c in df.columns else pd.Series("", index=df.index)
+    items = pd.DataFrame({INV_KEY: item_df[INV_KEY].astype(str), "product": text(item_df, "product"),
+                          "unit": text(item_df, "unit"), "qty": parse_qty(text(item_df, "qty"))})
+    if inv_df is not None and len(inv_df):
+        # เลขที่ซ้ำในชีทใช้แถวแรก เหมือน lookup()
+        heads = pd.DataFrame({INV_KEY: inv_df[INV_KEY].astype(str), "carrier": text(inv_df, CARRIER),
+                              "depot": text(inv_df, DEPOT)}).drop_duplicates(INV_KEY)
+        items = items.merge(heads, on=INV_KEY, how="left")
+    items[["carrier", "depot"]] = items.reindex(columns=["carrier", "depot"]).fillna("")
+    keys = items[INV_KEY].unique()
+    items["month"] = items[INV_KEY].map({k: partitions.month_of(k) or NO_MONTH for k in keys})
+    return items[[INV_KEY] + KEYS + ["qty"]]
+
+
+def _per_invoice(lines):
+    return lines.groupby([INV_KEY] + KEYS, sort=False)["qty"].agg(["sum", "size"]).reset_index()
+
+
+def _cube(per_invoice):
+    return per_invoice.groupby(KEYS, sort=False)[["sum", "size"]].sum().reset_index() \
+        .rename(columns={"sum": "qty", "size": "lines"})
+
+
+class VolumeRollups:
+    """Quantities per month/product/unit/carrier/depot, kept up to date invoice by invoice.
+
+    sync(frames) follows a storage.FrameCache like master_data.MasterIndex:
+    built once from the frames (vectorized), then only the invoices in
+    frames.invoices_since() are taken out and added back. Older months are
+    computed on demand with load_month(month) -> (inv_df, item_df) and kept
+    until one of their invoices changes. Thread-safe; shared by every session.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stamp = None
+        self._cube = {}       # KEYS -> [ปริมาณ, จำนวนรายการ] ของเดือนที่อยู่ใน frames
+        self._invoices = {}   # invoice_no -> [(KEYS, ปริมาณ, จำนวนรายการ)] ที่นับไว้ เพื่อถอนออกเมื่อบิลถูกแก้
+        self._older = {}      # เดือนเก่า -> ตาราง KEYS + VALUES
+        self._table = None    # _cube ในรูป DataFrame สร้างครั้งเดียวต่อ stamp
+
+    def sync(self, frames):
+        stamp = frames.stamp   # อ่าน stamp ก่อน frames: ถ้ามี patch แทรกจะถูกนับซ้ำรอบหน้าแบบไม่มีผลเสีย
+        if stamp == self.stamp or frames.inv_df is None: return self
+        with self._lock:
+            if stamp == self.stamp: return self
+            changed = frames.invoices_since(self.stamp) if self.stamp is not None else None
+            if changed is None:
+                with perf.span("rollup.build"):
+                    self._build(frames.inv_df, frames.item_df)
+            else:
+                with perf.span("rollup.patch"):
+                    for inv_no, (header, items) in changed.items():
+                        if header is None: self._older.pop(partitions.month_of(inv_no), None)
+                        self._put(inv_no, header, items)
+            self._table = None
+            self.stamp = stamp
+        return self
+
+    def _build(self, inv_df, item_df):
+        per_invoice = _per_invoice(item_lines(inv_df, item_df))
+        self._cube = {tuple(r[:-2]): [r[-2], r[-1]] for r in _cube(per_invoice).itertuples(index=False)}
+        self._invoices = {}
+        for r in per_invoice.itertuples(index=False):
+            self._invoices.setdefault(r[0], []).append((tuple(r[1:-2]), r[-2], r[-1]))
+
+    def _put(self, inv_no, header, items):
+        inv_no = str(inv_no)
+        for key, qty, n in self._invoices.pop(inv_no, []):
+            entry = self._cube[key]
+            entry[0] -= qty
+            entry[1] -= n
+            if entry[1] <= 0: del self._cube[key]
+        if header is None: return
+        month = partitions.month_of(inv_no) or NO_MONTH
+        carrier, depot = (str(header.get(c, "")).strip() for c in (CARRIER, DEPOT))
+        sums = {}
+        for it in items:
+            key = (month, str(it.get("product", "")).strip(), str(it.get("unit", "")).strip(), carrier, depot)
+            qty, n = sums.get(key, (0.0, 0))
+            sums[key] = (qty + qty_value(it.get("qty")), n + 1)
+        self._invoices[inv_no] = [(key, qty, n) for key, (qty, n) in sums.items()]
+        for key, (qty, n) in sums.items():
+            entry = self._cube.setdefault(key, [0.0, 0])
+            entry[0] += qty
+            entry[1] += n
+
+    def table(self, months=None, load_month=None):
+        """The finest rollup (KEYS + VALUES) of months, default the months in the frames."""
+        hot = set(partitions.hot_months())
+        with self._lock:
+            if self._table is None:
+                self._table = pd.DataFrame([(*k, *v) for k, v in self._cube.items()], columns=KEYS + VALUES)
+            table = self._table
+        parts = [table if months is None else table[table["month"].isin(months)]]
+        for month in months or []:
+            if month in hot or load_month is None: continue
+            with self._lock:
+                older = self._older.get(month)
+            if older is None:
+                with perf.span("rollup.month", month=month):
+                    older = _cube(_per_invoice(item_lines(*load_month(month))))
+                with self._lock:
+                    self._older[month] = older
+            parts.append(older)
+        parts = [p for p in parts if len(p)]
+        return pd.concat(parts, ignore_index=True) if parts else _empty_table()
+
+    def rollup(self, by, months=None, load_month=None):
+        """Totals per by (a DIMENSIONS key) and unit: by month oldest first, otherwise largest first."""
+        table = self.table(months, load_month)
+        out = table.groupby([by, "unit"], sort=False)[VALUES].sum().reset_index()
+        if by == "month": return out.sort_values([by, "unit"], ignore_index=True)
+        return out.sort_values("qty", ascending=False, ignore_index=True)
+
+
+def _empty_table():
+    return pd.DataFrame(columns=KEYS + VALUES).astype({"qty": float, "lines": int})
+
+
+def to_csv(table):
+    """CSV bytes with Thai column names; utf-8-sig so Excel shows Thai correctly."""
+    return table.rename(columns=LABELS).to_csv(index=False).encode("utf-8-sig")
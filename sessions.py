@@ -0,0 +1,86 @@
+# ================= SESSION HYGIENE =================
+# state ของแต่ละ session เก็บเฉพาะค่าอ้างอิงขนาดเล็ก (เช่นเลขที่บิล + hash ของ PDF) ส่วนข้อมูลใหญ่อยู่ใน cache ร่วม
+# ไฟล์ที่ session สร้าง (เช่นไฟล์รวมของการพิมพ์หลายใบ) ลงทะเบียนไว้ที่นี่ และถูกลบเมื่อ session ไม่ได้ใช้งาน
+# เกิน IDLE_SECONDS หรือเมื่อ session นั้นสร้างไฟล์ใหม่แทน
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:   # Windows ไม่มี resource: ไม่รายงานหน่วยความจำสูงสุด
+    resource = None
+
+IDLE_SECONDS = float(os.environ.get("JP_IDLE_SECONDS", 1800))
+
+_lock = threading.Lock()
+_seen = OrderedDict()   # session -> เวลาที่ใช้งานล่าสุด (เรียงจากเก่าไปใหม่)
+_files = {}             # session -> path
+
+
+def touch(session, now=None):
+    """Mark session as active and release what idle sessions still hold."""
+    now = now or time.time()
+    with _lock:
+        _seen[session] = now
+        _seen.move_to_end(session)
+        idle = []
+        while _seen:
+            oldest, seen = next(iter(_seen.items()))
+            if now - seen <= IDLE_SECONDS: break
+            del _seen[oldest]
+            idle.append(_files.pop(oldest, None))
+    for path in idle: _remove(path)
+
+
+def own_file(session, path):
+    """Register path as the session's output file, deleting the one it replaces."""
+    with _lock:
+        old = _files.get(session)
+        _files[session] = path
+    if old != path: _remove(old)
+
+
+def session_file(session, name):
+    # แยกไฟล์ตาม session เพื่อไม่ให้สองคนที่พิมพ์เดือนเดียวกันเขียนทับไฟล์กัน
+    return os.path.join(os.environ.get("JP_EXPORT_DIR") or _tempdir(), f"{session[:8] or 'cli'}_{name}")
+
+
+def _tempdir():
+    import tempfile
+    return tempfile.gettempdir()
+
+
+def _remove(path):
+    if not path: return
+    try: os.remove(path)
+    except OSError: pass
+
+
+def stats():
+    """Sessions seen within IDLE_SECONDS and the files they hold."""
+    with _lock:
+        files = list(_files.values())
+        sessions = len(_seen)
+    size = sum(os.path.getsize(p) for p in files if os.path.exists(p))
+    return {"sessions": sessions, "files": len(files), "file_mb": round(size / 2 ** 20, 1)}
+
+
+def process_memory():
+    """Resident and peak memory of this process in MB, None where unavailable.
+
+    Current RSS needs /proc (Linux); the peak needs the resource module (not on Windows).
+    """
+    peak_mb = rss_mb = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_mb = peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024   # macOS รายงานเป็น bytes
+    try:
+        with open("/proc/self/statm") as fh:
+            rss_mb = int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        pass
+    mb = lambda v: round(v, 1) if v is not None else None
+    return {"rss_mb": mb(rss_mb), "peak_mb": mb(peak_mb)}
@@ -0,0 +1,338 @@
+# ================= LOCAL SHEET MIRROR =================
+# เก็บสำเนาของ worksheet ไว้ใน SQLite บนดิสก์ แล้วดึงเฉพาะแถวที่เปลี่ยน/ต่อท้าย
+# แทนการ get_all_records() ทั้งชีททุกครั้งที่ cache หมดอายุ
+# ตรวจว่าไฟล์ถูกแก้หรือไม่จาก modifiedTime ใน Drive ก่อน (ไม่กินโควตาอ่านของ Sheets) ถ้าไม่เปลี่ยนก็ไม่อ่านชีทเลย
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from gspread.exceptions import APIError
+from gspread.utils import numericise_all, rowcol_to_a1
+
+import partitions
+
+MIRROR_PATH = os.environ.get("JP_MIRROR_PATH", os.path.join(".cache", "sheet_mirror.sqlite"))
+# ดึงทั้งชีทใหม่เพื่อตรวจความถูกต้องเป็นครั้งคราวเท่านั้น (ค่าเริ่มต้น 1 ชั่วโมง)
+FULL_SYNC_SECONDS = float(os.environ.get("JP_FULL_SYNC_SECONDS", 3600))
+CHANGE_HISTORY = 1000   # จำนวน version ล่าสุดต่อชีทที่จำได้ว่าเปลี่ยน invoice_no ใดบ้าง
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheet_meta (
+    sheet TEXT PRIMARY KEY,
+    header TEXT NOT NULL,
+    last_full REAL NOT NULL,
+    version INTEGER NOT NULL,
+    modified TEXT   -- modifiedTime ของไฟล์ที่ mirror ของชีทนี้ตรงกับชีทครบทุกแถว (NULL = ไม่รู้)
+);
+CREATE TABLE IF NOT EXISTS sheet_rows (
+    sheet TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    month TEXT NOT NULL DEFAULT '',   -- partitions.month_of(key) ('' = เลขที่ไม่มีเดือน)
+    PRIMARY KEY (sheet, row)
+);
+-- (sheet, key, row) ครอบทั้งเงื่อนไขและการเรียงลำดับ ไม่เช่นนั้น SQLite จะเลือก primary key แล้วสแกนทั้งชีทแทน
+DROP INDEX IF EXISTS sheet_rows_key;
+CREATE INDEX IF NOT EXISTS sheet_rows_key_row ON sheet_rows (sheet, key, row);
+-- invoice_no ที่เปลี่ยนในแต่ละ version (key เป็น NULL = เปลี่ยนทั้งชีท) ให้ผู้อ่านแก้เฉพาะบิลนั้นแทนการโหลดใหม่ทั้งหมด
+CREATE TABLE IF NOT EXISTS sheet_changes (
+    sheet TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    key TEXT
+);
+CREATE INDEX IF NOT EXISTS sheet_changes_version ON sheet_changes (sheet, version);
+"""
+# สร้างหลังเติมคอลัมน์ month ให้ mirror ที่สร้างก่อนมีคอลัมน์นี้
+_MONTH_INDEX = "CREATE INDEX IF NOT EXISTS sheet_rows_month ON sheet_rows (sheet, month, row);"
+
+log = logging.getLogger(__name__)
+
+
+class SheetMirror:
+    """On-disk copy of worksheets, kept current with incremental syncs.
+
+    Rows are stored with their 1-based sheet row number, so the mirror also
+    knows where each invoice_no lives in the sheet.
+    """
+
+    def __init__(self, path=MIRROR_PATH, full_sync_seconds=FULL_SYNC_SECONDS):
+        self.path = path
+        self.full_sync_seconds = full_sync_seconds
+        self._lock = threading.Lock()
+        self._no_drive = False
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as con:
+            con.executescript(_SCHEMA)
+            if "month" not in {c[1] for c in con.execute("PRAGMA table_info(sheet_rows)")}:
+                con.execute("ALTER TABLE sheet_rows ADD COLUMN month TEXT NOT NULL DEFAULT ''")
+                con.executemany("UPDATE sheet_rows SET month = ? WHERE sheet = ? AND row = ?",
+                                [(_month(k), sheet, row) for sheet, row, k in con.execute("SELECT sheet, row, key FROM sheet_rows").fetchall()])
+            con.execute(_MONTH_INDEX)
+            if "modified" not in {c[1] for c in con.execute("PRAGMA table_info(sheet_meta)")}:
+                con.execute("ALTER TABLE sheet_meta ADD COLUMN modified TEXT")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    # ---------- reading ----------
+    def version(self, sheet):
+        with self._connect() as con:
+            row = con.execute("SELECT version FROM sheet_meta WHERE sheet = ?", (sheet,)).fetchone()
+        return row[0] if row else 0
+
+    def header(self, sheet):
+        with self._connect() as con:
+            row = con.execute("SELECT header FROM sheet_meta WHERE sheet = ?", (sheet,)).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def changes_since(self, sheet, version):
+        """invoice_nos changed after version, or None if that is unknown (reload everything)."""
+        with self._connect() as con:
+            row = con.execute("SELECT version FROM sheet_meta WHERE sheet = ?", (sheet,)).fetchone()
+            current = row[0] if row else 0
+            if version == current: return set()
+            if version > current: return None
+            rows = con.execute("SELECT version, key FROM sheet_changes WHERE sheet = ? AND version > ? AND version <= ?",
+                               (sheet, version, current)).fetchall()
+        if len({v for v, _ in rows}) != current - version or any(k is None for _, k in rows): return None
+        return {k for _, k in rows}
+
+    def keys(self, sheet):
+        with self._connect() as con:
+            return [k for (k,) in con.execute("SELECT key FROM sheet_rows WHERE sheet = ? ORDER BY row", (sheet,))]
+
+    def records(self, sheet, months=None):
+        """Same shape and numeric conversion as Worksheet.get_all_records().
+
+        With months, only the rows whose invoice_no falls in one of them (see
+        partitions.month_of; None stands for numbers without a month).
+        """
+        header = self.header(sheet)
+        with self._connect() as con:
+            if months is None:
+                rows = con.execute("SELECT data FROM sheet_rows WHERE sheet = ? ORDER BY row", (sheet,)).fetchall()
+            else:
+                # อ่านเฉพาะแถวของเดือนที่ต้องการผ่าน index (sheet, month, row) ไม่ขึ้นกับจำนวนแถวทั้งชีท
+                # (ถ้าไม่ระบุ SQLite จะเลือก primary key เพราะ ORDER BY row แล้วสแกนทั้งชีท)
+                months = [m or "" for m in months]
+                rows = con.execute(f"SELECT data FROM sheet_rows INDEXED BY sheet_rows_month WHERE sheet = ? AND month IN ({', '.join('?' * len(months))}) "
+                                   "ORDER BY row", (sheet, *months)).fetchall()
+        return [dict(zip(header, numericise_all(_pad(json.loads(d), len(header))))) for (d,) in rows]
+
+    def months(self, sheet):
+        """Months (partitions.month_of) of the keys of sheet, None for keys without one."""
+        with self._connect() as con:
+            return {m or None for (m,) in con.execute("SELECT DISTINCT month FROM sheet_rows WHERE sheet = ?", (sheet,))}
+
+    def records_of(self, sheet, key):
+        """Records of one invoice_no, looked up through the (sheet, key) index."""
+        header = self.header(sheet)
+        with self._connect() as con:
+            rows = con.execute("SELECT data FROM sheet_rows WHERE sheet = ? AND key = ? ORDER BY row", (sheet, str(key))).fetchall()
+        return [dict(zip(header, numericise_all(_pad(json.loads(d), len(header))))) for (d,) in rows]
+
+    # ---------- syncing ----------
+    def modified(self, ws):
+        """Drive modifiedTime of the spreadsheet of ws (changes with any edit), or None if unavailable."""
+        if self._no_drive: return None
+        try:
+            return str(ws.spreadsheet.get_lastUpdateTime())
+        except APIError as e:
+            if e.code not in (403, 404): return None   # ผิดพลาดชั่วคราว รอบหน้าลองใหม่
+            log.warning("sheet mirror: cannot read the Drive modifiedTime (%s), watching the key column only", e)
+            self._no_drive = True   # ยังไม่เปิด Drive API หรือ service account ไม่มีสิทธิ์
+            return None
+
+    def sync(self, ws, force_full=False, modified=None):
+        """Bring the mirror of ws up to date and return its version number.
+
+        modified is the spreadsheet's modifiedTime (see modified(); fetched if
+        not given). While it is unchanged nothing is read from the sheet. When
+        it changed, one read of the key column finds appended or deleted rows
+        and one ranged read fetches the rows after the first key that differs
+        (usually just the appended tail); if the keys are all the same, the
+        change is an in-place edit and the sheet is read in full to find it.
+        Without a modifiedTime only the key column is compared. A full refetch
+        also happens on first use, when forced, or every full_sync_seconds as
+        a consistency check.
+
+        The sheet is read without holding the mirror's lock, so readers and
+        local edits never wait while a sync waits for quota. If the mirror
+        changed in the meantime, what was read may predate that change: it is
+        dropped and the next sync reads again.
+        """
+        sheet = ws.title
+        with self._connect() as con:
+            meta = con.execute("SELECT header, last_full, version, modified FROM sheet_meta WHERE sheet = ?", (sheet,)).fetchone()
+        if modified is None: modified = self.modified(ws)
+        if force_full or meta is None or time.time() - meta[1] > self.full_sync_seconds:
+            return self._full_sync(ws, meta, modified)
+
+        header, version = json.loads(meta[0]), meta[2]
+        if modified is not None and modified == meta[3]: return version
+        sheet_keys = [str(k) for k in ws.col_values(1)[1:]]
+        mirror_keys = self.keys(sheet)
+        same = 0
+        for a, b in zip(sheet_keys, mirror_keys):
+            if a != b: break
+            same += 1
+        if same == len(sheet_keys) == len(mirror_keys):
+            # key เหมือนเดิมทุกแถวแต่ไฟล์ถูกแก้: แก้ค่าในแถวเดิม (จากแอปอื่น เครื่องอื่น หรือแก้ในชีทเอง) ต้องอ่านทั้งชีทจึงจะเห็น
+            return version if modified is None else self._full_sync(ws, meta, modified)
+
+        first_row = same + 2   # แถวที่ 1 คือหัวตาราง
+        values = []
+        if len(sheet_keys) > same:
+            rng = f"A{first_row}:{rowcol_to_a1(len(sheet_keys) + 1, max(len(header), 1))}"
+            values = ws.get(rng)
+        with self._lock, self._connect() as con:
+            current = self._begin(con, sheet)
+            if current != version: return current
+            con.execute("DELETE FROM sheet_rows WHERE sheet = ? AND row >= ?", (sheet, first_row))
+            self._insert(con, sheet, first_row, values)
+            # ถือว่าครบถึง modified นี้: การแก้ในแถวก่อน first_row ที่เกิดในช่วงเดียวกันพอดีจะเห็นตอน full sync
+            con.execute("UPDATE sheet_meta SET modified = ? WHERE sheet = ?", (modified, sheet))
+            return self._bump(con, sheet, mirror_keys[same:] + sheet_keys[same:])
+
+    def _full_sync(self, ws, meta, modified):
+        sheet = ws.title
+        values = ws.get_all_values()
+        header, body = (values[0], values[1:]) if values else ([], [])
+        with self._lock, self._connect() as con:
+            current = self._begin(con, sheet)
+            if current != (meta[2] if meta else 0): return current
+            old = [json.loads(d) for (d,) in con.execute("SELECT data FROM sheet_rows WHERE sheet = ? ORDER BY row", (sheet,))]
+            new = [_trim(r) for r in body]
+            con.execute(
+                "INSERT OR REPLACE INTO sheet_meta (sheet, header, last_full, version, modified) VALUES (?, ?, ?, ?, ?)",
+                (sheet, json.dumps(header, ensure_ascii=False), time.time(), current, modified),
+            )
+            same_shape = meta is not None and json.loads(meta[0]) == header and len(old) == len(new)
+            if same_shape and old == new: return current
+            # แถวเดิมครบทุกแถว: บอกผู้อ่านเฉพาะบิลที่ค่าเปลี่ยน แทนการให้โหลดใหม่ทั้งหมด
+            changed = None
+            if same_shape and all(_key(o) == _key(n) for o, n in zip(old, new)):
+                changed = {_key(n) for o, n in zip(old, new) if o != n}
+            con.execute("DELETE FROM sheet_rows WHERE sheet = ?", (sheet,))
+            self._insert(con, sheet, 2, body)
+            return self._bump(con, sheet, changed)
+
+    def mark_written(self, sheets, before, after):
+        """Our own writes, already recorded in the mirror, took the spreadsheet's modifiedTime from before to after.
+
+        Sheets whose mirror was complete at before are complete at after too,
+        so the next sync does not read them again to look for these changes.
+        """
+        if before is None or after is None: return
+        with self._lock, self._connect() as con:
+            con.executemany("UPDATE sheet_meta SET modified = ? WHERE sheet = ? AND modified = ?",
+                            [(after, sheet, before) for sheet in sheets])
+
+    def _begin(self, con, sheet):
+        # เปิด transaction เขียนก่อนอ่าน version เพื่อไม่ให้ process อื่นแก้ mirror แทรกระหว่างเทียบกับบันทึก
+        con.execute("BEGIN IMMEDIATE")
+        row = con.execute("SELECT version FROM sheet_meta WHERE sheet = ?", (sheet,)).fetchone()
+        return row[0] if row else 0
+
+    def _bump(self, con, sheet, keys):
+        """Advance the version of sheet, logging the changed keys (None: the whole sheet)."""
+        con.execute("UPDATE sheet_meta SET version = version + 1 WHERE sheet = ?", (sheet,))
+        (version,) = con.execute("SELECT version FROM sheet_meta WHERE sheet = ?", (sheet,)).fetchone()
+        con.executemany("INSERT INTO sheet_changes (sheet, version, key) VALUES (?, ?, ?)",
+                        [(sheet, version, k) for k in (set(map(str, keys)) if keys is not None else [None])])
+        con.execute("DELETE FROM sheet_changes WHERE sheet = ? AND version <= ?", (sheet, version - CHANGE_HISTORY))
+        return version
+
+    def _insert(self, con, sheet, first_row, values):
+        con.executemany(
+            "INSERT INTO sheet_rows (sheet, row, key, data, month) VALUES (?, ?, ?, ?, ?)",
+            [(sheet, first_row + i, str(r[0]) if r else "", json.dumps(_trim(r), ensure_ascii=False), _month(r[0] if r else ""))
+             for i, r in enumerate(values)],
+        )
+
+    # ---------- local edits ----------
+    def apply_row(self, sheet, key, values):
+        """Record an in-place edit of the row keyed by invoice_no (the sheet was updated by us)."""
+        with self._lock, self._connect() as con:
+            cur = con.execute(
+                "UPDATE sheet_rows SET data = ? WHERE sheet = ? AND key = ?",
+                (json.dumps(_trim([str(v) for v in values]), ensure_ascii=False), sheet, str(key)),
+            )
+            if cur.rowcount: self._bump(con, sheet, [key])
+            else: _unknown_modified(con, sheet)
+
+    # ---------- invoice_no -> sheet row index ----------
+    def row_of(self, sheet, key):
+        """Sheet row number of the (first) row keyed by invoice_no, or None."""
+        with self._connect() as con:
+            row = con.execute("SELECT MIN(row) FROM sheet_rows WHERE sheet = ? AND key = ?", (sheet, str(key))).fetchone()
+        return row[0] if row else None
+
+    def row_ranges(self, sheet, key):
+        """Contiguous (start, end) sheet row ranges holding invoice_no."""
+        with self._connect() as con:
+            rows = [r for (r,) in con.execute("SELECT row FROM sheet_rows WHERE sheet = ? AND key = ? ORDER BY row", (sheet, str(key)))]
+        ranges = []
+        for r in rows:
+            if ranges and ranges[-1][1] == r - 1: ranges[-1] = (ranges[-1][0], r)
+            else: ranges.append((r, r))
+        return ranges
+
+    def record_delete(self, sheet, ranges):
+        """Mirror a deletion of sheet rows: drop them and shift the rows below up."""
+        with self._lock, self._connect() as con:
+            keys = set()
+            for start, end in sorted(ranges, reverse=True):
+                keys.update(k for (k,) in con.execute("SELECT key FROM sheet_rows WHERE sheet = ? AND row BETWEEN ? AND ?", (sheet, start, end)))
+                con.execute("DELETE FROM sheet_rows WHERE sheet = ? AND row BETWEEN ? AND ?", (sheet, start, end))
+                # เลื่อนเลขแถวผ่านค่าติดลบก่อน เพื่อไม่ให้ชน primary key ระหว่าง UPDATE
+                con.execute("UPDATE sheet_rows SET row = -(row - ?) WHERE sheet = ? AND row > ?", (end - start + 1, sheet, end))
+                con.execute("UPDATE sheet_rows SET row = -row WHERE sheet = ? AND row < 0", (sheet,))
+            if ranges:
+                self._bump(con, sheet, keys)
+
+    def record_append(self, sheet, response, rows):
+        """Mirror rows we just appended, at the position reported by the append response.
+
+        If the position cannot be read from the response, nothing is recorded and
+        the next sync picks the rows up from the key column instead.
+        """
+        match = re.search(r"!\$?[A-Z]+\$?(\d+)", str((response or {}).get("updates", {}).get("updatedRange", "")))
+        if not rows: return
+        with self._lock, self._connect() as con:
+            (last,) = con.execute("SELECT COALESCE(MAX(row), 1) FROM sheet_rows WHERE sheet = ?", (sheet,)).fetchone()
+            if not match or int(match.group(1)) != last + 1:
+                _unknown_modified(con, sheet)   # มีแถวอื่นต่อท้ายที่เรายังไม่เห็น ให้ sync จัดการ
+                return
+            first_row = int(match.group(1))
+            self._insert(con, sheet, first_row, [[str(v) for v in r] for r in rows])
+            self._bump(con, sheet, [r[0] if r else "" for r in rows])
+
+
+def _unknown_modified(con, sheet):
+    # mirror ขาดการแก้ไขที่เราเขียนเองไป: sync รอบหน้าต้องอ่านชีท แม้ modifiedTime จะถูก mark_written แล้ว
+    con.execute("UPDATE sheet_meta SET modified = NULL WHERE sheet = ?", (sheet,))
+
+
+def _trim(row):
+    # ตัดช่องว่างท้ายแถวออก เพื่อให้ผลจาก get() และ get_all_values() เทียบกันได้
+    row = list(row)
+    while row and row[-1] == "": row.pop()
+    return row
+
+
+def _key(row):
+    return str(row[0]) if row else ""
+
+
+def _month(key):
+    return partitions.month_of(key) or ""
+
+
+def _pad(row, n):
+    return row + [""] * (n - len(row))
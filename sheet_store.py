@@ -0,0 +1,93 @@
+# ================= GOOGLE SHEETS ACCESS =================
+# เปิด spreadsheet และเขียนข้อมูลแบบรวมคำสั่ง เพื่อให้จำนวน API call ต่อการบันทึกคงที่
+# ไม่ว่าบิลจะมีกี่รายการสินค้า
+import tomllib
+
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+
+import perf
+import sheets_client
+
+SHEET_ID = "1ZdTeTyDkrvR3ZbIisCJdzKRlU8jMvFvnSvtEmQR2Tzs"
+INV_SHEET = "Invoices"
+ITEM_SHEET = "InvoiceItems"
+INV_KEY = "invoice_no"
+
+
+def open_spreadsheet(service_account_info):
+    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(service_account_info, scope)
+    client = gspread.authorize(creds)
+    perf.instrument_client(client.http_client)   # นับ API call ทุกครั้งที่ไปถึง Google
+    sheets_client.install(client.http_client)    # รวมคำขอซ้ำ จำกัดอัตราตามโควตา และลองใหม่เมื่อโดน 429/5xx
+    return client.open_by_key(SHEET_ID)
+
+
+def load_service_account(secrets_path=".streamlit/secrets.toml"):
+    # สำหรับสคริปต์ที่รันนอก Streamlit: อ่าน gcp_service_account จากไฟล์ secrets เดียวกับแอป
+    with open(secrets_path, "rb") as fh:
+        return tomllib.load(fh)["gcp_service_account"]
+
+
+ITEM_FIELDS = ('product', 'unit', 'qty', 'tank', 'seal')
+
+# คอลัมน์ของชีท Invoices: invoice_no, date แล้วตามด้วยข้อมูลขนส่งตามลำดับนี้
+TRANSPORT_FIELDS = [
+    "ผู้รับสินค้า-ชื่อ", "ผู้รับสินค้า-ที่อยู่", "ผู้รับสินค้า-เลขผู้เสียภาษี", "ผู้รับสินค้า-เบอร์โทร",
+    "คลังรับผลิตภัณฑ์-ชื่อ", "คลังรับผลิตภัณฑ์-เลขผู้เสียภาษี", "คลังรับผลิตภัณฑ์-ที่อยู่",
+    "ผู้รับผลิตภัณฑ์-ชื่อ", "ผู้รับผลิตภัณฑ์-เลขผู้เสียภาษี", "ผู้รับผลิตภัณฑ์-ที่อยู่", "ผู้รับผลิตภัณฑ์-หมายเลขตั๋ว",
+    "ผู้ดำเนินการขนส่ง-ชื่อ", "ผู้ดำเนินการขนส่ง-เลขผู้เสียภาษี", "ผู้ดำเนินการขนส่ง-ที่อยู่", "ผู้ดำเนินการขนส่ง-เบอร์โทร",
+    "ผู้ดำเนินการขนส่ง-ประเภทผู้รับจ้าง", "ผู้ดำเนินการขนส่ง-ใบอนุญาต",
+    "ข้อมูลพนักงานขับรถ-ชื่อ", "ข้อมูลพนักงานขับรถ-เลขใบขับขี่", "ข้อมูลพนักงานขับรถ-เบอร์โทร", "ข้อมูลพนักงานขับรถ-ทะเบียนรถ",
+    "ข้อมูลพนักงานขับรถ-วิธีขนส่ง", "ข้อมูลพนักงานขับรถ-วันออกเดินทาง", "ข้อมูลพนักงานขับรถ-เวลาออกเดินทาง",
+    "ข้อมูลพนักงานขับรถ-วันที่ถึงปลายทาง", "ข้อมูลพนักงานขับรถ-เวลาที่ถึงปลายทาง",
+    "การยืนยันและรับสินค้า-ผู้ออกเอกสาร", "การยืนยันและรับสินค้า-พนักงานขับรถ", "การยืนยันและรับสินค้า-ผู้รับสินค้า",
+    "ผู้จำหน่าย-ชื่อ", "ผู้จำหน่าย-ที่อยู่", "ผู้จำหน่าย-เลขผู้เสียภาษี", "ผู้จำหน่าย-เบอร์โทร",
+    "ผู้จำหน่าย-ชื่อเอกสาร", "ผู้จำหน่าย-อธิบายเพิ่ม"
+]
+INV_HEADER = [INV_KEY, 'date'] + TRANSPORT_FIELDS
+ITEM_HEADER = [INV_KEY] + list(ITEM_FIELDS)
+
+
+def item_rows(inv_no, items):
+    return [[inv_no] + [it[k] for k in ITEM_FIELDS] for it in items]
+
+
+def key_row_ranges(keys, inv_no):
+    """Contiguous 1-based (start, end) sheet rows whose key column equals inv_no."""
+    ranges = []
+    for row, key in enumerate(keys, start=1):
+        if row == 1 or str(key) != str(inv_no):
+            continue
+        if ranges and ranges[-1][1] == row - 1:
+            ranges[-1] = (ranges[-1][0], row)
+        else:
+            ranges.append((row, row))
+    return ranges
+
+
+def delete_row_ranges(ws, ranges):
+    # ลบจากล่างขึ้นบนในคำขอเดียว เพื่อไม่ให้เลขแถวของช่วงก่อนหน้าเลื่อน
+    if not ranges: return
+    requests = [
+        {"deleteDimension": {"range": {"sheetId": ws.id, "dimension": "ROWS", "startIndex": start - 1, "endIndex": end}}}
+        for start, end in sorted(ranges, reverse=True)
+    ]
+    ws.spreadsheet.batch_update({"requests": requests})
+
+
+def replace_items(ws_item, inv_no, items, ranges=None):
+    """Drop every existing item row of inv_no and append the new ones.
+
+    ranges are the known (start, end) rows of inv_no, e.g. from the mirror's
+    row index; without them the key column is read once to find them.
+    Returns the append response (None when there are no items).
+    """
+    if ranges is None: ranges = key_row_ranges(ws_item.col_values(1), inv_no)
+    delete_row_ranges(ws_item, ranges)
+    return append_items(ws_item, inv_no, items)
+
+
+def append_items(ws_item, inv_no, items):
+    if items: return ws_item.append_rows(item_rows(inv_no, items))
@@ -0,0 +1,262 @@
+# ================= SHARED SHEETS CLIENT =================
+# ชั้นกลางของ HTTP client ของ gspread ที่ทุก session ใน process ใช้ร่วมกัน (spreadsheet อยู่ใน st.cache_resource)
+# - คำขออ่านที่เหมือนกันและยิงพร้อมกันหลาย session รวมเป็นคำขอเดียว (coalescing)
+# - จำกัดอัตราด้วย sliding window ตามโควตาของ Sheets API (อ่าน/เขียนแยกกัน ต่อนาที): ไม่มีช่วง 60 วินาทีใด
+#   ที่ส่งเกินโควตา แม้ตอนยิงพร้อมกัน เมื่อโดน 429 ทุก thread หยุดรอพร้อมกัน ไม่แย่งกันยิงซ้ำจนโดนจำกัดต่อ
+#   คำขอ Drive API (เช่น modifiedTime ที่ sheet_mirror ใช้ตรวจการแก้ไข) มีโควตาของตัวเอง ไม่นับรวมกับการอ่าน Sheets
+# - ลองใหม่แบบ exponential backoff + jitter เมื่อโดน 408/429/5xx ทั้งอ่านและเขียน ยกเว้นคำขอเขียนที่ส่งซ้ำแล้ว
+#   ผลไม่เหมือนเดิม (ต่อท้ายแถว/ลบแถว) ซึ่งลองใหม่เฉพาะ 429 เพราะ 5xx อาจเขียนสำเร็จไปแล้ว
+#   (คิวเขียนเบื้องหลังจะ sync แล้วเขียนซ้ำแบบ idempotent เอง)
+# - คำขอจากหน้าแอป (ผู้ใช้รออยู่) ไม่รอโควตานาน: ภายใน wait_at_most() คำขอที่ต้องรอเกินกำหนด raise QuotaBusy
+#   แทนการ sleep ผู้เรียกแสดงข้อมูลที่มีอยู่ไปก่อน (คิวเขียนเบื้องหลังยังรอตามปกติ)
+# ตัวเลขการใช้โควตาดูได้จาก metrics() (แสดงในแผง ⏱️ ของแอป)
+import os
+import random
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from functools import wraps
+
+import requests
+from gspread.exceptions import APIError
+
+import perf
+
+# โควตาเริ่มต้นของ Sheets API ต่อผู้ใช้ (service account) ต่อนาที
+READS_PER_MINUTE = int(os.environ.get("JP_SHEETS_READS_PER_MIN", 60))
+WRITES_PER_MINUTE = int(os.environ.get("JP_SHEETS_WRITES_PER_MIN", 60))
+DRIVE_PER_MINUTE = int(os.environ.get("JP_DRIVE_PER_MIN", 1000))
+MAX_RETRIES = 5
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 64.0
+RETRY_READ = {408, 429, 500, 502, 503, 504}
+RETRY_WRITE = RETRY_READ
+RETRY_UNREPEATABLE = {429}
+# วินาทีที่หน้าแอปยอมรอโควตาตอน refresh ก่อนแสดงข้อมูลใน mirror ไปก่อน
+UI_WAIT = float(os.environ.get("JP_SHEETS_UI_WAIT", 1.0))
+# โควตานับต่อ 60 วินาทีที่ฝั่ง server ซึ่งรับคำขอช้ากว่าที่ส่งตาม latency จึงเว้นระยะเผื่อไว้
+WINDOW_SECONDS = 61.0
+
+
+class QuotaBusy(Exception):
+    """Sending would mean waiting longer for quota than the caller allows (see wait_at_most)."""
+
+
+_local = threading.local()
+
+
+@contextmanager
+def wait_at_most(seconds):
+    """Requests of this thread inside the block raise QuotaBusy instead of waiting longer than seconds.
+
+    That covers waiting for a slot, for a retry and for another thread's
+    identical read that is still waiting itself. None waits as long as needed.
+    """
+    old = getattr(_local, "max_wait", None)
+    _local.max_wait = seconds
+    try:
+        yield
+    finally:
+        _local.max_wait = old
+
+
+def _max_wait():
+    return getattr(_local, "max_wait", None)
+
+
+class SlidingWindow:
+    """Thread-safe limit of at most limit requests in any window seconds.
+
+    reserve() hands out send times in order (a sliding-window log of the
+    last limit of them), so bursts are allowed up to the quota but the
+    requests sent in any rolling window never exceed it.
+    """
+
+    def __init__(self, limit, window=WINDOW_SECONDS, clock=time.monotonic):
+        self.limit = max(1, limit)
+        self.window = window
+        self.clock = clock
+        self.granted = deque()   # เวลาส่งของ limit คำขอล่าสุด เรียงจากเก่าไปใหม่
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait=None):
+        """Take a slot and return how long the caller must wait before sending.
+
+        Returns None without taking a slot if that wait would exceed max_wait.
+        """
+        with self._lock:
+            now = self.clock()
+            at = max(now, self.paused_until, self.granted[-1] if self.granted else now)
+            if len(self.granted) >= self.limit: at = max(at, self.granted[0] + self.window)
+            if max_wait is not None and at - now > max_wait: return None
+            self.granted.append(at)
+            if len(self.granted) > self.limit: self.granted.popleft()
+            return at - now
+
+    def pause(self, seconds):
+        """Hold every caller back for seconds (the server said we are over quota)."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.sent = threading.Event()   # ผู้นำได้โควตาแล้ว (ไม่ได้รอโควตาอยู่)
+        self.response = None
+        self.error = None
+
+
+class QuotaLimiter:
+    """Coalescing, rate limiting and retries around one gspread HTTP client's request()."""
+
+    def __init__(self, reads_per_minute=READS_PER_MINUTE, writes_per_minute=WRITES_PER_MINUTE,
+                 max_retries=MAX_RETRIES, sleep=time.sleep, drive_per_minute=DRIVE_PER_MINUTE):
+        self.limits = {"read": reads_per_minute, "write": writes_per_minute, "drive": drive_per_minute}
+        self.buckets = {kind: SlidingWindow(limit) for kind, limit in self.limits.items()}
+        self.max_retries = max_retries
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._sent = {kind: deque() for kind in self.limits}
+        self.counters = Counter()
+        self.errors = Counter()
+        self.waited = 0.0
+
+    def wrap(self, request):
+        @wraps(request)
+        def limited(method, endpoint, params=None, *args, **kwargs):
+            if method.upper() != "GET" or args or kwargs.get("json") or kwargs.get("data"):
+                return self._send("write", request, method, endpoint, params, *args, **kwargs)
+            kind = "drive" if _is_drive(endpoint) else "read"
+            key = (endpoint, repr(sorted((params or {}).items())))
+            while True:
+                with self._lock:
+                    flight = self._flights.get(key)
+                    leader = flight is None
+                    if leader: flight = self._flights[key] = _Flight()
+                    else: self.counters["coalesced"] += 1
+                if leader: break
+                max_wait = _max_wait()
+                if max_wait is not None and not flight.sent.wait(max_wait): self._busy(kind, max_wait)
+                flight.done.wait()
+                # ผู้นำเลิกรอเพราะรอนานเกินที่ตัวเองรับได้ ไม่ใช่ข้อผิดพลาดของคำขอ จึงลองใหม่เอง
+                if isinstance(flight.error, QuotaBusy): continue
+                if flight.error is not None: raise flight.error
+                return flight.response
+
+            def send(*a, **kw):
+                flight.sent.set()
+                return request(*a, **kw)
+            try:
+                flight.response = self._send(kind, send, method, endpoint, params, *args, **kwargs)
+                flight.response.content   # อ่าน body ให้เสร็จก่อนส่งต่อให้ thread อื่นใช้ร่วม
+                return flight.response
+            except Exception as e:
+                flight.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.sent.set()
+                flight.done.set()
+        return limited
+
+    def _send(self, kind, request, method, endpoint, *args, **kwargs):
+        bucket = self.buckets[kind]
+        repeatable = kind != "write" or _repeatable(method, endpoint)
+        retry_codes = RETRY_READ if kind != "write" else RETRY_WRITE if repeatable else RETRY_UNREPEATABLE
+        max_wait = _max_wait()
+        for attempt in range(self.max_retries + 1):
+            wait = bucket.reserve(max_wait)
+            if wait is None: self._busy(kind, max_wait)
+            if wait > 0:
+                with self._lock:
+                    self.counters["throttled"] += 1
+                    self.waited += wait
+                with perf.span("sheets.throttle"):
+                    self.sleep(wait)
+            with self._lock:
+                self.counters[kind] += 1
+                self._sent[kind].append(time.monotonic())
+                self._prune()
+            try:
+                return request(method, endpoint, *args, **kwargs)
+            except APIError as e:
+                code, retry_after = e.code, e.response.headers.get("Retry-After")
+                if code not in retry_codes or attempt == self.max_retries: return self._failed(code, e)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                code, retry_after = type(e).__name__, None
+                if not repeatable or attempt == self.max_retries: return self._failed(code, e)
+            delay = float(retry_after) if retry_after and str(retry_after).isdigit() else \
+                random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt))
+            with self._lock:
+                self.counters["retries"] += 1
+                self.errors[code] += 1
+            if code == 429: bucket.pause(delay)   # รอผ่าน reserve() รอบหน้า พร้อมกับ thread อื่น
+            elif max_wait is not None and delay > max_wait: self._busy(kind, max_wait)
+            else: self.sleep(delay)
+
+    def _busy(self, kind, max_wait):
+        with self._lock:
+            self.counters["busy"] += 1
+        raise QuotaBusy(f"{kind} would wait more than {max_wait:g}s for quota")
+
+    def _failed(self, code, error):
+        with self._lock:
+            self.errors[code] += 1
+            self.counters["failed"] += 1
+        raise error
+
+    def _prune(self):
+        cutoff = time.monotonic() - 60
+        for sent in self._sent.values():
+            while sent and sent[0] < cutoff: sent.popleft()
+
+    def metrics(self):
+        """Requests sent in the last minute against the quota, plus totals since start."""
+        with self._lock:
+            self._prune()
+            usage = {f"{k}_last_min": len(v) for k, v in self._sent.items()}
+            return {**usage, **{f"{k}_limit": v for k, v in self.limits.items()},
+                    "reads": self.counters["read"], "writes": self.counters["write"], "drive": self.counters["drive"],
+                    "coalesced": self.counters["coalesced"], "throttled": self.counters["throttled"],
+                    "waited_s": round(self.waited, 2), "retries": self.counters["retries"],
+                    "failed": self.counters["failed"], "busy": self.counters["busy"], "errors": dict(self.errors)}
+
+
+def _is_drive(endpoint):
+    return "/drive/" in str(endpoint)
+
+
+def _repeatable(method, endpoint):
+    # เขียนค่าทับช่องเดิม (values.update / values:batchUpdate) ส่งซ้ำได้ผลเหมือนเดิม
+    # ต่อท้ายแถว (:append) และแก้โครงชีท (spreadsheets:batchUpdate เช่นลบแถว) ถ้าซ้ำจะได้แถวซ้ำหรือลบแถวอื่นไปด้วย
+    endpoint = str(endpoint)
+    return method.upper() == "PUT" or endpoint.endswith("values:batchUpdate")
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def limiter():
+    """The process-wide limiter: every client in the process shares one quota."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None: _limiter = QuotaLimiter()
+        return _limiter
+
+
+def install(http_client):
+    """Route every request of a gspread HTTP client through the shared limiter."""
+    if getattr(http_client, "_quota_limited", False): return http_client
+    http_client.request = limiter().wrap(http_client.request)
+    http_client._quota_limited = True
+    return http_client
+
+
+def metrics():
+    return limiter().metrics()
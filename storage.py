@@ -0,0 +1,699 @@
+# ================= STORAGE BACKENDS =================
+# หน้าแอปคุยกับที่เก็บข้อมูลผ่าน InvoiceStore เท่านั้น มีให้เลือก 2 แบบ
+#   sheets : Google Sheets (mirror + write-behind queue + ตัวนับเลขที่บิล) แบบเดิม
+#   sqlite : ไฟล์ SQLite ในเครื่อง มี index บน invoice_no และวันที่ (เลือก sync ขึ้น Sheets เพื่อทำรายงานได้)
+# เลือกด้วย env JP_STORAGE หรือ storage_backend ใน secrets.toml
+# นำข้อมูลจากชีทเดิมเข้า SQLite ครั้งเดียว:
+#   python storage.py import --db .cache/invoices.sqlite
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import numbering
+import partitions
+import perf
+import sheet_mirror
+import sheet_store
+import sheets_client
+import write_queue
+from sheet_store import INV_SHEET, ITEM_SHEET, INV_KEY, ITEM_FIELDS, INV_HEADER
+
+SQLITE_PATH = os.environ.get("JP_SQLITE_PATH", os.path.join(".cache", "invoices.sqlite"))
+
+
+class InvoiceStore:
+    """What the UI needs from persistence.
+
+    refresh() is cheap and returns a hashable version that changes whenever
+    load_frames() would return different data, so callers can cache frames
+    per version. With max_wait, a remote backend waits at most that many
+    seconds for API quota and otherwise returns the version of the data it
+    already has.
+    """
+
+    # ปลายทางที่ save_status() ติดตามอยู่ ใช้แสดงในหน้าแอป
+    save_target = ""
+
+    def refresh(self, max_wait=None):
+        raise NotImplementedError
+
+    def load_frames(self, months=None):
+        """(Invoices frame, InvoiceItems frame), both in insertion order.
+
+        months limits them to invoices of those months (see partitions.hot_months).
+        """
+        raise NotImplementedError
+
+    def older_months(self):
+        """Months before partitions.hot_months() that hold invoices, newest first."""
+        raise NotImplementedError
+
+    def load_month(self, month):
+        """Frames of one month, loaded on demand (e.g. to search or reprint older invoices)."""
+        return self.load_frames([month])
+
+    def load_range(self, date_from=None, date_to=None, month=None):
+        """Frames of the invoices dated date_from..date_to (inclusive, either may be None), optionally of one month only."""
+        inv_df, item_df = self.load_month(month) if month else self.load_frames()
+        if inv_df.empty or not (date_from or date_to): return inv_df, item_df
+        dates = pd.to_datetime(inv_df["date"].astype(str), format="%d/%m/%Y", errors="coerce")
+        mask = dates.notna()
+        if date_from: mask &= dates >= pd.Timestamp(date_from)
+        if date_to: mask &= dates <= pd.Timestamp(date_to)
+        inv_df = inv_df[mask]
+        return inv_df, item_df[item_df[INV_KEY].astype(str).isin(set(inv_df[INV_KEY].astype(str)))] if not item_df.empty else item_df
+
+    def get_invoice(self, inv_no):
+        """(header dict, item dicts) of one invoice, or None."""
+        raise NotImplementedError
+
+    def changes_since(self, version):
+        """invoice_nos whose data changed after version (as returned by refresh), or None if unknown."""
+        return None
+
+    def next_number(self, prefix):
+        raise NotImplementedError
+
+    def next_numbers(self, prefix, count):
+        return [self.next_number(prefix) for _ in range(count)]
+
+    def save_invoice(self, inv_no, header_row, items):
+        """Create or replace an invoice; header_row is ordered like INV_HEADER."""
+        raise NotImplementedError
+
+    def save_invoices(self, entries):
+        """save_invoice() for many (inv_no, header_row, items) at once."""
+        for inv_no, header_row, items in entries: self.save_invoice(inv_no, header_row, items)
+
+    def save_status(self, inv_no):
+        """Dict with status/attempts/last_error of the latest save of inv_no, or None."""
+        raise NotImplementedError
+
+    def pending_count(self):
+        return 0
+
+    def failed_count(self):
+        """Saves set aside after too many failed attempts (see write_queue.FAILED)."""
+        return 0
+
+    def retry_failed(self):
+        return 0
+
+    def flush_pending(self, progress=None):
+        """Write the queued saves from the calling thread; returns when none is pending (stores opened with background=False)."""
+
+
+# ================= GOOGLE SHEETS =================
+class SheetsStore(InvoiceStore):
+    """Google Sheets backend: reads come from the local mirror, saves go through the write-behind queue.
+
+    Without a spreadsheet the store only reads the mirror as it is on disk
+    (e.g. for offline exports). With background=False no worker thread is
+    started: CLI tools that exit when done call flush_pending() instead.
+    """
+
+    save_target = "Google Sheets"
+
+    # จำนวนเดือนเก่าที่เก็บไว้ในหน่วยความจำหลังโหลดจากชีทรายเดือน
+    ARCHIVE_CACHE = 6
+
+    def __init__(self, spreadsheet=None, mirror_path=sheet_mirror.MIRROR_PATH, background=True):
+        self.mirror = sheet_mirror.SheetMirror(mirror_path)
+        self.allocator = numbering.InvoiceNumberAllocator(self.mirror.path)
+        self.spreadsheet = spreadsheet
+        self.ws_inv = self.ws_item = self.queue = None
+        self._months = {}
+        self._months_lock = threading.Lock()
+        if spreadsheet is not None:
+            self.ws_inv = spreadsheet.worksheet(INV_SHEET)
+            self.ws_item = spreadsheet.worksheet(ITEM_SHEET)
+            self.queue = write_queue.WriteBehindQueue(self.mirror, self.ws_inv, self.ws_item)
+            if background: self.queue.start()
+
+    @perf.timed("store.refresh")
+    def refresh(self, max_wait=None):
+        # ดึงเฉพาะแถวที่เพิ่ม/เปลี่ยนลง mirror
+        if self.ws_inv is not None:
+            try:
+                with sheets_client.wait_at_most(max_wait):
+                    modified = self.mirror.modified(self.ws_inv)   # ทั้งสองชีทอยู่ในไฟล์เดียวกัน
+                    return self.mirror.sync(self.ws_inv, modified=modified), self.mirror.sync(self.ws_item, modified=modified)
+            except sheets_client.QuotaBusy:
+                pass   # โควตาเต็ม (เช่นคิวเขียนกำลังใช้): แสดงข้อมูลใน mirror ไปก่อน refresh รอบหน้าค่อยอ่านชีท
+        return self.mirror.version(INV_SHEET), self.mirror.version(ITEM_SHEET)
+
+    @perf.timed("store.load_frames")
+    def load_frames(self, months=None):
+        return pd.DataFrame(self.mirror.records(INV_SHEET, months)), pd.DataFrame(self.mirror.records(ITEM_SHEET, months))
+
+    def older_months(self):
+        hot = partitions.hot_months()
+        months = self.mirror.months(INV_SHEET)
+        if self.spreadsheet is not None: months.update(partitions.archived_months(self.spreadsheet))
+        return sorted((m for m in months if m not in hot), reverse=True)
+
+    @perf.timed("store.load_month")
+    def load_month(self, month):
+        # ชีทรายเดือน (ที่ย้ายออกไปแล้ว) ตามด้วยแถวของเดือนนั้นที่ยังอยู่ในชีทหลัก ซึ่งใหม่กว่าถ้าเลขที่ซ้ำกัน
+        # เก็บไว้จนกว่า mirror จะเปลี่ยน version (งานย้ายเดือนก็ทำให้ชีทหลักเปลี่ยนด้วย)
+        key = (month, self.mirror.version(INV_SHEET), self.mirror.version(ITEM_SHEET))
+        with self._months_lock:
+            if key in self._months: return self._months[key]
+        frames = []
+        for sheet in (INV_SHEET, ITEM_SHEET):
+            hot = pd.DataFrame(self.mirror.records(sheet, [month]))
+            archived = pd.DataFrame(partitions.records(partitions.read_archive(self.spreadsheet, sheet, month))
+                                    if self.spreadsheet is not None else [])
+            if not archived.empty and not hot.empty:
+                archived = archived[~archived[INV_KEY].astype(str).isin(hot[INV_KEY].astype(str))]
+            frames.append(pd.concat([archived, hot], ignore_index=True) if not archived.empty else hot)
+        with self._months_lock:
+            self._months[key] = tuple(frames)
+            while len(self._months) > self.ARCHIVE_CACHE: del self._months[next(iter(self._months))]
+        return tuple(frames)
+
+    @perf.timed("store.get_invoice")
+    def get_invoice(self, inv_no):
+        headers = self.mirror.records_of(INV_SHEET, inv_no)
+        if headers: return headers[0], self.mirror.records_of(ITEM_SHEET, inv_no)
+        month = partitions.month_of(inv_no)
+        if self.spreadsheet is None or month is None or month in partitions.hot_months(): return None
+        inv_df, item_df = self.load_month(month)
+        rows = inv_df[inv_df[INV_KEY].astype(str) == str(inv_no)] if not inv_df.empty else inv_df
+        if rows.empty: return None
+        items = item_df[item_df[INV_KEY].astype(str) == str(inv_no)] if not item_df.empty else item_df
+        return rows.iloc[0].to_dict(), items.to_dict('records')
+
+    def changes_since(self, version):
+        keys = [self.mirror.changes_since(sheet, v) for sheet, v in zip((INV_SHEET, ITEM_SHEET), version)]
+        return None if None in keys else keys[0] | keys[1]
+
+    @perf.timed("store.next_number")
+    def next_number(self, prefix):
+        return self.allocator.allocate(prefix)
+
+    def next_numbers(self, prefix, count):
+        return self.allocator.allocate_many(prefix, count)
+
+    @perf.timed("store.save")
+    def save_invoice(self, inv_no, header_row, items):
+        self.save_invoices([(inv_no, header_row, items)])
+
+    def save_invoices(self, entries):
+        if self.queue is None: raise RuntimeError("SheetsStore เปิดแบบอ่านอย่างเดียว (ไม่มี spreadsheet)")
+        self.queue.enqueue_saves(entries)
+
+    def save_status(self, inv_no):
+        return self.queue.status(inv_no) if self.queue else None
+
+    def pending_count(self):
+        return self.queue.pending_count() if self.queue else 0
+
+    def failed_count(self):
+        return self.queue.failed_count() if self.queue else 0
+
+    def retry_failed(self):
+        return self.queue.retry_failed() if self.queue else 0
+
+    def flush_pending(self, progress=None):
+        if self.queue: self.queue.flush_pending(progress)
+
+
+# ================= LOCAL SQLITE =================
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS invoices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    invoice_no TEXT NOT NULL UNIQUE,
+    date TEXT,
+    date_iso TEXT,
+    month TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS invoice_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    invoice_no TEXT NOT NULL,
+    product TEXT, unit TEXT, qty TEXT, tank TEXT, seal TEXT
+);
+CREATE INDEX IF NOT EXISTS invoice_items_invoice ON invoice_items (invoice_no, id);
+CREATE TABLE IF NOT EXISTS store_changes (
+    version INTEGER NOT NULL,
+    invoice_no TEXT
+);
+CREATE INDEX IF NOT EXISTS store_changes_version ON store_changes (version);
+"""
+# สร้างหลังเพิ่มคอลัมน์ให้ไฟล์เก่าแล้ว: ช่วงวันที่ (bulk_export, การค้นหา) และรายการเดือนเก่าค้นผ่าน index
+_INVOICE_INDEXES = """
+CREATE INDEX IF NOT EXISTS invoices_date ON invoices (date_iso);
+CREATE INDEX IF NOT EXISTS invoices_month ON invoices (month);
+"""
+
+# แก้บิลเดิมด้วย ON CONFLICT ... DO UPDATE เพื่อให้บิลคงลำดับเดิม (id ไม่เปลี่ยน) เหมือนการแก้แถวในชีท
+_UPSERT_INVOICE = """
+INSERT INTO invoices (invoice_no, date, date_iso, month, data) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (invoice_no) DO UPDATE SET date = excluded.date, date_iso = excluded.date_iso, data = excluded.data
+"""
+_INSERT_ITEM = f"INSERT INTO invoice_items (invoice_no, {', '.join(ITEM_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?)"
+
+
+def _months_where(months):
+    # เงื่อนไขบน invoice_no ที่ตรงกับ partitions.month_of (None = เลขที่ไม่มีเดือน)
+    if months is None: return "1", ()
+    terms, params = [], []
+    for month in months:
+        terms.append("invoice_no NOT GLOB ?" if month is None else "invoice_no GLOB ?")
+        params.append(partitions.NUMBERED_GLOB if month is None else partitions.month_glob(month))
+    return "(" + (" OR ".join(terms) or "0") + ")", tuple(params)
+
+
+def _iso_date(text):
+    try: return datetime.strptime(str(text).strip(), "%d/%m/%Y").date().isoformat()
+    except ValueError: return None
+
+
+def _invoice_values(inv_no, record, data):
+    # ค่าของ _UPSERT_INVOICE: date_iso สำหรับค้นช่วงวันที่ month ตาม partitions.month_of แบบเดียวกับ sheet_mirror
+    date = str(record.get("date", ""))
+    return inv_no, date, _iso_date(date), partitions.month_of(inv_no) or "", data
+
+
+class SqliteStore(InvoiceStore):
+    """Invoices and items in one local SQLite file, saved synchronously.
+
+    Values are kept as the strings that were saved (no numeric conversion as
+    with get_all_records). With a spreadsheet every save is also queued for
+    Google Sheets, which then only serves as a reporting copy.
+    """
+
+    def __init__(self, path=SQLITE_PATH, spreadsheet=None, mirror_path=sheet_mirror.MIRROR_PATH, background=True):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as con:
+            con.executescript(_SCHEMA)
+            columns = {c[1] for c in con.execute("PRAGMA table_info(invoices)")}
+            if "month" not in columns:
+                # ไฟล์เก่า: ไม่มี date_iso หรือมีแต่ไม่ได้เขียนค่าไว้ เติมทั้งสองคอลัมน์จากข้อมูลเดิม
+                if "date_iso" not in columns: con.execute("ALTER TABLE invoices ADD COLUMN date_iso TEXT")
+                con.execute("ALTER TABLE invoices ADD COLUMN month TEXT NOT NULL DEFAULT ''")
+                con.executemany("UPDATE invoices SET date_iso = ?, month = ? WHERE id = ?",
+                                [(_iso_date(d), partitions.month_of(k) or "", i)
+                                 for i, k, d in con.execute("SELECT id, invoice_no, date FROM invoices").fetchall()])
+            con.executescript(_INVOICE_INDEXES)
+        self.allocator = numbering.InvoiceNumberAllocator(path, numbering.INVOICES_MAX_SQL)
+        self.sheets = SheetsStore(spreadsheet, mirror_path, background) if spreadsheet is not None else None
+        self.save_target = self.sheets.save_target if self.sheets else "SQLite"
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _meta(self, con, key, default=None):
+        row = con.execute("SELECT value FROM store_meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _bump(self, con, keys):
+        # บันทึกว่า version ใหม่เปลี่ยนบิลใดบ้าง (NULL = ทั้งหมด) เหมือน sheet_mirror
+        con.execute(
+            "INSERT INTO store_meta (key, value) VALUES ('version', '1') "
+            "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+        version = self._meta(con, "version")
+        con.executemany("INSERT INTO store_changes (version, invoice_no) VALUES (?, ?)",
+                        [(version, k) for k in (set(map(str, keys)) if keys is not None else [None])])
+        con.execute("DELETE FROM store_changes WHERE version <= ?", (version - sheet_mirror.CHANGE_HISTORY,))
+
+    # ---------- reading ----------
+    @perf.timed("store.refresh")
+    def refresh(self, max_wait=None):
+        with self._connect() as con:
+            return self._meta(con, "version", 0)
+
+    def header(self, con):
+        return self._meta(con, "header", INV_HEADER)
+
+    @perf.timed("store.load_frames")
+    def load_frames(self, months=None):
+        where, params = _months_where(months)
+        with self._connect() as con:
+            header = self.header(con)
+            rows = [json.loads(d) for (d,) in con.execute(f"SELECT data FROM invoices WHERE {where} ORDER BY id", params)]
+            item_df = pd.read_sql_query(f"SELECT {INV_KEY}, {', '.join(ITEM_FIELDS)} FROM invoice_items WHERE {where} ORDER BY id", con, params=params)
+        return pd.DataFrame.from_records(rows, columns=header).fillna(""), item_df
+
+    @perf.timed("store.load_range")
+    def load_range(self, date_from=None, date_to=None, month=None):
+        if not (date_from or date_to): return super().load_range(month=month)
+        where, params = _months_where([month] if month else None)
+        # บิลที่วันที่อ่านไม่ได้ (date_iso เป็น NULL) ไม่อยู่ในช่วงใด เหมือน bulk_export.select_invoices
+        where += " AND date_iso BETWEEN ? AND ?"
+        params += (pd.Timestamp(date_from).date().isoformat() if date_from else "",
+                   pd.Timestamp(date_to).date().isoformat() if date_to else "~")
+        with self._connect() as con:
+            header = self.header(con)
+            rows = [json.loads(d) for (d,) in con.execute(f"SELECT data FROM invoices WHERE {where} ORDER BY id", params)]
+            item_df = pd.read_sql_query(f"SELECT {INV_KEY}, {', '.join(ITEM_FIELDS)} FROM invoice_items "
+                                        f"WHERE invoice_no IN (SELECT invoice_no FROM invoices WHERE {where}) ORDER BY id",
+                                        con, params=params)
+        return pd.DataFrame.from_records(rows, columns=header).fillna(""), item_df
+
+    def older_months(self):
+        hot = partitions.hot_months()
+        with self._connect() as con:
+            months = {m or None for (m,) in con.execute("SELECT DISTINCT month FROM invoices")}
+        return sorted((m for m in months if m not in hot), reverse=True)
+
+    @perf.timed("store.get_invoice")
+    def get_invoice(self, inv_no):
+        with self._connect() as con:
+            row = con.execute("SELECT data FROM invoices WHERE invoice_no = ?", (str(inv_no),)).fetchone()
+            if row is None: return None
+            cur = con.execute(f"SELECT {INV_KEY}, {', '.join(ITEM_FIELDS)} FROM invoice_items WHERE invoice_no = ? ORDER BY id", (str(inv_no),))
+            items = [dict(zip([d[0] for d in cur.description], r)) for r in cur]
+        return json.loads(row[0]), items
+
+    def changes_since(self, version):
+        with self._connect() as con:
+            current = self._meta(con, "version", 0)
+            if version == current: return set()
+            if version > current: return None
+            rows = con.execute("SELECT version, invoice_no FROM store_changes WHERE version > ? AND version <= ?",
+                               (version, current)).fetchall()
+        if len({v for v, _ in rows}) != current - version or any(k is None for _, k in rows): return None
+        return {k for _, k in rows}
+
+    # ---------- writing ----------
+    @perf.timed("store.next_number")
+    def next_number(self, prefix):
+        return self.allocator.allocate(prefix)
+
+    def next_numbers(self, prefix, count):
+        return self.allocator.allocate_many(prefix, count)
+
+    @perf.timed("store.save")
+    def save_invoice(self, inv_no, header_row, items):
+        self.save_invoices([(inv_no, header_row, items)])
+
+    def save_invoices(self, entries):
+        # ทุกบิลในชุดเขียนใน transaction เดียว และขึ้น version ครั้งเดียว
+        entries = [(str(no), [write_queue.cell_value(v) for v in header_row],
+                    [{k: write_queue.cell_value(it.get(k)) for k in ITEM_FIELDS} for it in items])
+                   for no, header_row, items in entries]
+        with self._lock, self._connect() as con:
+            for inv_no, header_row, items in entries:
+                self._write(con, inv_no, dict(zip(INV_HEADER, header_row)), items)
+            self._bump(con, [no for no, _, _ in entries])
+        if self.sheets: self.sheets.queue.enqueue_saves(entries)
+
+    def _write(self, con, inv_no, record, items):
+        con.execute(_UPSERT_INVOICE, _invoice_values(inv_no, record, json.dumps(record, ensure_ascii=False, default=str)))
+        con.execute("DELETE FROM invoice_items WHERE invoice_no = ?", (inv_no,))
+        con.executemany(_INSERT_ITEM, [[inv_no] + [str(it.get(k, "")) for k in ITEM_FIELDS] for it in items])
+
+    def save_status(self, inv_no):
+        # บันทึกลงไฟล์เสร็จตั้งแต่ตอนกดบันทึก ถ้า sync ขึ้น Sheets ด้วยให้แสดงสถานะของคิวแทน
+        if self.sheets: return self.sheets.save_status(inv_no)
+        return {"status": write_queue.DONE, "attempts": 0, "last_error": None, "updated": None}
+
+    def pending_count(self):
+        return self.sheets.pending_count() if self.sheets else 0
+
+    def failed_count(self):
+        return self.sheets.failed_count() if self.sheets else 0
+
+    def retry_failed(self):
+        return self.sheets.retry_failed() if self.sheets else 0
+
+    def flush_pending(self, progress=None):
+        if self.sheets: self.sheets.flush_pending(progress)
+
+    # ---------- one-shot import ----------
+    def import_rows(self, inv_values, item_values):
+        """Replace everything with the rows of get_all_values() of both sheets (header row first)."""
+        header = inv_values[0] if inv_values else INV_HEADER
+        item_cols = {name: i for i, name in enumerate(item_values[0])} if item_values else {}
+        with self._lock, self._connect() as con:
+            con.execute("DELETE FROM invoices")
+            con.execute("DELETE FROM invoice_items")
+            for row in inv_values[1:]:
+                record = dict(zip(header, sheet_mirror._pad(list(row), len(header))))
+                if not str(record.get(INV_KEY, "")).strip(): continue
+                con.execute(_UPSERT_INVOICE, _invoice_values(str(record[INV_KEY]), record, json.dumps(record, ensure_ascii=False)))
+            pick = lambda row, k: row[item_cols[k]] if k in item_cols and item_cols[k] < len(row) else ""
+            con.executemany(_INSERT_ITEM, [[pick(r, INV_KEY)] + [pick(r, k) for k in ITEM_FIELDS]
+                                           for r in item_values[1:] if str(pick(r, INV_KEY)).strip()])
+            con.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES ('header', ?)", (json.dumps(header, ensure_ascii=False),))
+            self._bump(con, None)
+            counts = [con.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in ("invoices", "invoice_items")]
+        return dict(zip(("invoices", "items"), counts))
+
+
+# ================= SHARED FRAMES =================
+class FrameCache:
+    """The frames of a store, shared by every session and patched per changed invoice.
+
+    Only the recent months (partitions.hot_months) are held; older months are
+    read with store.load_month() when needed.
+
+    get(version) brings the frames up to a version returned by refresh(): only
+    the invoices reported by changes_since() are re-read, the rest of the
+    frames is reused. apply_local() shows a save at once, before the store
+    reports it (Sheets saves are written behind). stamp changes with every
+    update, so caches derived from the frames can be keyed on it. The frames
+    are replaced, never modified, so callers must treat them as read-only.
+
+    Repeated text columns are held as categoricals, and lookup() finds an
+    invoice through an invoice_no -> row / item rows index built once per
+    stamp instead of scanning both frames.
+
+    invoices_since(stamp) lists the invoices patched after a stamp (and
+    headers_since() just their headers), so indexes and rollups derived from
+    the frames can follow them incrementally.
+    """
+
+    # เปลี่ยนมากกว่านี้โหลดใหม่ทั้งหมดเร็วกว่า
+    MAX_PATCH = 200
+    # จำนวน patch ล่าสุดที่จำไว้ให้ headers_since()
+    LOG_SIZE = 256
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self.months = None   # เดือนที่อยู่ใน frames (partitions.hot_months ตอนโหลด)
+        self.version = None
+        self.stamp = 0
+        self.inv_df = self.item_df = None
+        self.local = set()   # บิลที่แสดงจาก apply_local และยังรอ store ยืนยัน
+        self._index = (None, {}, {}, [], [])
+        self._log = deque(maxlen=self.LOG_SIZE)   # (stamp, {invoice_no: (header หรือ None, items)})
+
+    def get(self, version):
+        with self._lock:
+            months = partitions.hot_months()
+            if self.inv_df is None or version != self.version or months != self.months:
+                changed = self.store.changes_since(self.version) if self.inv_df is not None else None
+                if changed is None or len(changed) > self.MAX_PATCH or self.inv_df.empty or months != self.months:
+                    with perf.span("frames.reload"):
+                        inv_df, item_df = self.store.load_frames(months)
+                        self.inv_df, self.item_df, self.months = compact(inv_df), compact(item_df), months
+                    self.local.clear()
+                    self._log.clear()
+                    self.stamp += 1
+                else:
+                    self._patch(changed)
+                self.version = version
+            elif self.local:
+                self._patch(set())
+            return self.inv_df, self.item_df
+
+    def lookup(self, inv_no):
+        """(header dict, item dicts) of inv_no in the current frames, or None."""
+        with self._lock:
+            if self._index[0] != self.stamp:
+                with perf.span("frames.index"):
+                    keys = self.inv_df[INV_KEY].astype(str)
+                    # แถวแรกของแต่ละเลขที่ (ถ้าชีทมีเลขซ้ำ) เหมือน records_of()[0]
+                    rows = dict(zip(keys.iloc[::-1], range(len(keys) - 1, -1, -1)))
+                    items = self.item_df.groupby(self.item_df[INV_KEY].astype(str), sort=False).indices if len(self.item_df) else {}
+                    self._index = (self.stamp, rows, items, _columns(self.inv_df), _columns(self.item_df))
+            _, rows, items, inv_cols, item_cols = self._index
+        pos = rows.get(str(inv_no))
+        if pos is None: return None
+        idx = items.get(str(inv_no), [])
+        values = [list(take(idx)) for _, take in item_cols]
+        return {c: take(pos) for c, take in inv_cols}, [dict(zip([c for c, _ in item_cols], r)) for r in zip(*values)]
+
+    def invoices_since(self, stamp):
+        """{invoice_no: (header dict or None if it left the frames, item dicts)} patched after stamp.
+
+        None when the frames were reloaded since stamp or it is older than
+        the last LOG_SIZE patches: the caller must start over from the frames.
+        """
+        with self._lock:
+            if stamp == self.stamp: return {}
+            log = [(s, fresh) for s, fresh in self._log if s > stamp]
+            if not log or log[0][0] != stamp + 1: return None
+            invoices = {}
+            for _, fresh in log: invoices.update(fresh)
+            return invoices
+
+    def headers_since(self, stamp):
+        invoices = self.invoices_since(stamp)
+        return None if invoices is None else {k: header for k, (header, _) in invoices.items()}
+
+    def apply_local(self, inv_no, header_row, items):
+        """Patch in a save the store may not report yet; header_row is ordered like INV_HEADER."""
+        inv_no = str(inv_no)
+        with self._lock:
+            if self.inv_df is None or self.inv_df.empty or partitions.month_of(inv_no) not in self.months: return
+            self.local.add(inv_no)
+            self._apply({inv_no: (dict(zip(INV_HEADER, header_row)),
+                                  [{INV_KEY: inv_no, **{k: it.get(k, "") for k in ITEM_FIELDS}} for it in items])})
+
+    def _confirmed(self, inv_no):
+        state = self.store.save_status(inv_no)
+        return state is None or state["status"] == write_queue.DONE
+
+    def _patch(self, changed):
+        fresh = {}
+        with perf.span("frames.patch"):
+            for inv_no in sorted(set(map(str, changed)) | self.local):
+                got = None
+                # ค่าจาก apply_local ใช้ต่อจนกว่าการบันทึกจะเสร็จและ store อ่านบิลนั้นได้แล้ว
+                if inv_no in self.local:
+                    if not self._confirmed(inv_no) or (got := self.store.get_invoice(inv_no)) is None: continue
+                    self.local.discard(inv_no)
+                # บิลของเดือนเก่าที่ถูกแก้ไม่ต้องเข้ามาใน frames (ดูได้จาก load_month)
+                if partitions.month_of(inv_no) not in self.months: got = (None, [])
+                fresh[inv_no] = got or self.store.get_invoice(inv_no) or (None, [])
+            if fresh: self._apply(fresh)
+
+    def _apply(self, fresh):
+        self.inv_df, self.item_df = patch_frames(self.inv_df, self.item_df, fresh)
+        self.stamp += 1
+        self._log.append((self.stamp, dict(fresh)))
+
+
+def patch_frames(inv_df, item_df, fresh):
+    """New frames with the invoices in fresh ({invoice_no: (header or None, items)}) replaced.
+
+    Edited headers keep their position and new ones are appended, as in the
+    sheet; the items of every invoice in fresh move to the end.
+    """
+    keys = inv_df[INV_KEY].astype(str)
+    hit = keys.isin(fresh.keys())
+    positions = {}
+    for i, k in keys[hit].items(): positions.setdefault(k, []).append(i)
+    rows, index, nxt = [], [], len(inv_df)
+    for inv_no, (header, _) in fresh.items():
+        if header is None: continue
+        if inv_no not in positions:
+            positions[inv_no] = [nxt]
+            nxt += 1
+        for i in positions[inv_no]:
+            rows.append({c: header.get(c, "") for c in inv_df.columns})
+            index.append(i)
+    inv = inv_df[~hit]
+    if rows: inv = _concat(inv, pd.DataFrame(rows, index=index, columns=inv_df.columns)).sort_index(kind="stable")
+    item_cols = item_df.columns if len(item_df.columns) else [INV_KEY] + list(ITEM_FIELDS)
+    items = [{c: it.get(c, "") for c in item_cols} for _, its in fresh.values() for it in its]
+    item = item_df[~item_df[INV_KEY].astype(str).isin(fresh.keys())] if len(item_df.columns) else item_df
+    if items: item = _concat(item, pd.DataFrame(items, columns=item_cols, index=pd.RangeIndex(len(item_df), len(item_df) + len(items))))
+    return inv.reset_index(drop=True), item.reset_index(drop=True)
+
+
+def compact(df, max_unique=0.5):
+    """df with text columns that repeat (at most max_unique distinct values per row) as categoricals."""
+    df = df.copy()
+    for c in df.columns:
+        s = df[c]
+        if (s.dtype == object or isinstance(s.dtype, pd.StringDtype)) and len(s) and s.nunique() <= len(s) * max_unique:
+            df[c] = s.astype("category")
+    return df
+
+
+def _concat(base, extra):
+    # ต่อทีละคอลัมน์: categorical ต่อกันที่ codes (ค่าใหม่เพิ่มท้าย categories) แทน pd.concat
+    # ซึ่งจะได้ object เมื่อต่อกับคอลัมน์ธรรมดา และเทียบ categories ทั้งชุดทุกครั้ง
+    if not len(base.columns): return extra
+    columns = {}
+    for c in base.columns:
+        a, b = base[c], extra[c]
+        if isinstance(a.dtype, pd.CategoricalDtype):
+            cats = a.cat.categories
+            new = [v for v in pd.unique(b.to_numpy(dtype=object)) if v not in cats]
+            if new: cats = cats.append(pd.Index(new, dtype=object))
+            codes = np.concatenate([a.cat.codes.to_numpy(), cats.get_indexer(b.to_numpy(dtype=object))])
+            columns[c] = pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(cats))
+        else:
+            columns[c] = pd.concat([a, b]).array
+    return pd.DataFrame(columns, index=base.index.append(extra.index))
+
+
+def _columns(df):
+    # ตัวดึงค่าตามตำแหน่งของแต่ละคอลัมน์ (ใช้ codes ของ categorical โดยตรง) เร็วกว่า iloc ทีละแถวมาก
+    def getter(s):
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            values, codes = np.append(s.cat.categories.to_numpy(dtype=object), None), s.cat.codes.to_numpy()
+            return lambda i: values[codes[i]]
+        # คอลัมน์ตัวเลขแปลงเป็น object เพื่อให้ได้ int/float ของ Python เหมือน to_dict()
+        return (s.array if s.dtype == object or isinstance(s.dtype, pd.StringDtype) else s.to_numpy(dtype=object)).__getitem__
+    return [(c, getter(df[c])) for c in df.columns]
+
+
+def import_from_sheets(spreadsheet, store):
+    """Copy both sheets into a SqliteStore, replacing its contents. Returns row counts."""
+    return store.import_rows(spreadsheet.worksheet(INV_SHEET).get_all_values(),
+                             spreadsheet.worksheet(ITEM_SHEET).get_all_values())
+
+
+# ================= BACKEND SELECTION =================
+def setting(secrets, name, env, default=None):
+    """Value of environment variable env, else of name in secrets, else default."""
+    if os.environ.get(env): return os.environ[env]
+    try: return secrets.get(name, default)
+    except Exception: return default   # ไม่มีไฟล์ secrets
+
+
+def flag(secrets, name, env):
+    return str(setting(secrets, name, env, "")).lower() in ("1", "true", "yes")
+
+
+def open_store(secrets, background=True):
+    """Open the backend chosen by JP_STORAGE / storage_backend ("sheets" by default)."""
+    backend = setting(secrets, "storage_backend", "JP_STORAGE", "sheets")
+    if backend == "sheets":
+        return SheetsStore(sheet_store.open_spreadsheet(secrets["gcp_service_account"]), background=background)
+    if backend == "sqlite":
+        path = setting(secrets, "sqlite_path", "JP_SQLITE_PATH", SQLITE_PATH)
+        sync = flag(secrets, "sqlite_sync_sheets", "JP_SQLITE_SYNC_SHEETS")
+        return SqliteStore(path, sheet_store.open_spreadsheet(secrets["gcp_service_account"]) if sync else None, background=background)
+    raise ValueError(f"unknown storage backend: {backend!r}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Storage maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="copy the Google Sheets into the SQLite store (replaces its contents)")
+    imp.add_argument("--db", default=SQLITE_PATH)
+    imp.add_argument("--secrets", default=".streamlit/secrets.toml")
+    args = parser.parse_args(argv)
+
+    spreadsheet = sheet_store.open_spreadsheet(sheet_store.load_service_account(args.secrets))
+    counts = import_from_sheets(spreadsheet, SqliteStore(args.db))
+    print(f"{counts['invoices']} invoices, {counts['items']} items -> {args.db}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+# โมดูลของแอปอยู่ระดับบนสุดของ repo (ไม่ใช่แพ็กเกจ) ให้ import ได้เมื่อรัน pytest จากที่ใดก็ได้
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import partitions
+import storage
+from sheet_store import INV_HEADER
+
+
+class Invoices:
+    """Invoices numbered in the current month, saved to a SqliteStore and read through a FrameCache.
+
+    Header columns are passed by field name, so each test file adds only the
+    columns it looks at; the rest are blank.
+    """
+
+    month = partitions.hot_months()[0]
+
+    def __init__(self, path):
+        self.store = storage.SqliteStore(str(path / "invoices.sqlite"))
+        self.frames = storage.FrameCache(self.store)
+
+    def no(self, n):
+        return f"JPP-{self.month}-{n:04d}"
+
+    def row(self, n, day="01/10/2026", **columns):
+        row = {**dict.fromkeys(INV_HEADER, ""), **columns, "invoice_no": self.no(n), "date": day}
+        return [row[f] for f in INV_HEADER]
+
+    def save(self, n, items=(), **columns):
+        self.store.save_invoice(self.no(n), self.row(n, **columns), list(items))
+
+    def load(self):
+        """The FrameCache brought up to date with the store."""
+        self.frames.get(self.store.refresh())
+        return self.frames
+
+    def edit(self, n, items=(), **columns):
+        """Patch invoice n into the frames as the app does right after a save."""
+        self.frames.apply_local(self.no(n), self.row(n, **columns), list(items))
+
+
+@pytest.fixture
+def invoices(tmp_path):
+    return Invoices(tmp_path)
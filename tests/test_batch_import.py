@@ -0,0 +1,85 @@
+import io
+import json
+from datetime import date
+
+import pytest
+
+import batch_import
+import storage
+
+TODAY = date(2026, 10, 17)
+CUSTOMER = "ผู้รับสินค้า-ชื่อ"
+
+
+def record(**fields):
+    items = fields.pop("items", [{"product": "ดีเซล", "unit": "ลิตร", "qty": "1,000"}])
+    return {CUSTOMER: "ลูกค้า", **fields, "items": items}
+
+
+def reason(rec):
+    with pytest.raises(ValueError) as e:
+        batch_import.validate(rec, TODAY)
+    return str(e.value)
+
+
+def test_validate_accepts_a_good_record():
+    day, data, items = batch_import.validate(record(date="2026-09-30"), TODAY)
+    assert day == date(2026, 9, 30) and data["date"] == "30/09/2026" and data[CUSTOMER] == "ลูกค้า"
+    assert items == [{"product": "ดีเซล", "unit": "ลิตร", "qty": "1,000", "tank": "", "seal": ""}]
+    assert batch_import.validate(record(), TODAY)[0] == TODAY
+
+
+@pytest.mark.parametrize("qty", ["0", "-5", "abc", "nan", "NaN", "inf", "-inf", "1e999"])
+def test_validate_rejects_bad_qty(qty):
+    assert reason(record(items=[{"product": "ดีเซล", "qty": qty}])).startswith("item 1:")
+
+
+@pytest.mark.parametrize("text, why", [("17/10/2569", "Buddhist-era year, use 2026"), ("01/01/1899", "out of range"),
+                                       ("31/02/2026", "dd/mm/YYYY")])
+def test_validate_rejects_bad_dates(text, why):
+    assert why in reason(record(date=text))
+
+
+def test_validate_rejects_unknown_fields_and_missing_items():
+    assert reason(record(color="แดง")) == "unknown fields: color"
+    assert reason(record(items=[{"qty": "5"}])) == "item 1: product is required"
+    assert reason(record(items=[])) == "no items"
+    assert reason(ValueError("invalid JSON: x")) == "invalid JSON: x"
+
+
+def test_csv_row_with_extra_cells_is_rejected_alone():
+    manifest = io.StringIO(f"ref,{CUSTOMER},product,qty\nA,ลูกค้า ก,ดีเซล,100\nB,ลูกค้า ข,ดีเซล,200,เกิน,อีก\nC,ลูกค้า ค,เบนซิน,300\n")
+    rejects, stats = [], {}
+    saved = list(batch_import.import_invoices(batch_import.read_csv(manifest), None, "JPP", TODAY,
+                                              reject=lambda line, why: rejects.append((line, why)), stats=stats, dry_run=True))
+    assert saved == [] and stats == {"read": 3, "saved": 2, "rejected": 1}
+    assert rejects == [(3, "2 more cells than the header")]
+
+
+def test_numbers_follow_the_month_of_each_date(tmp_path):
+    store = storage.SqliteStore(str(tmp_path / "s.sqlite"))
+    records = enumerate([record(date="01/10/2026"), record(date="02/09/2026"), record(), record(date="bad")], start=1)
+    rejects = []
+    jobs = list(batch_import.import_invoices(records, store, "JPP", TODAY, chunk_size=2,
+                                             reject=lambda line, why: rejects.append(line)))
+    assert [no for no, _, _ in jobs] == ["JPP-2026-10-0001", "JPP-2026-09-0001", "JPP-2026-10-0002"]
+    assert rejects == [4]
+    assert store.get_invoice("JPP-2026-09-0001")[0]["date"] == "02/09/2026"
+    more = list(batch_import.import_invoices(enumerate([record()]), store, "JPP", TODAY))
+    assert [no for no, _, _ in more] == ["JPP-2026-10-0003"]
+
+
+def test_main_writes_the_rejection_report(tmp_path, monkeypatch):
+    monkeypatch.setenv("JP_STORAGE", "sqlite")
+    monkeypatch.setenv("JP_SQLITE_PATH", str(tmp_path / "s.sqlite"))
+    manifest = tmp_path / "m.jsonl"
+    manifest.write_text("\n".join([json.dumps(record(date="05/10/2026"), ensure_ascii=False), "{bad",
+                                   json.dumps(record(items=[{"product": "ดีเซล", "qty": "nan"}]), ensure_ascii=False)]),
+                        encoding="utf-8")
+    rejects = tmp_path / "rejects.jsonl"
+    code = batch_import.main([str(manifest), "--rejects", str(rejects), "--secrets", str(tmp_path / "none.toml")])
+    assert code == 1
+    report = [json.loads(line) for line in rejects.read_text(encoding="utf-8").splitlines()]
+    assert [r["line"] for r in report] == [2, 3]
+    assert report[0]["reason"].startswith("invalid JSON") and report[1]["reason"] == "item 1: bad qty 'nan'"
+    assert storage.SqliteStore(str(tmp_path / "s.sqlite")).get_invoice("JPP-2026-10-0001") is not None
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+import invoice_search
+from invoice_search import InvoiceSearchIndex, normalize
+
+
+def _frame():
+    return pd.DataFrame({
+        "invoice_no": ["JPP-2026-09-0001", "JPP-2026-09-0002", "JPP-2026-10-0001"],
+        "date": ["01/09/2026", "15/09/2026", "02/10/2026"],
+        "ผู้รับสินค้า-ชื่อ": ["บริษัท ปิโตรไทย จำกัด", np.nan, "สยามน้ำมัน"],
+        "ข้อมูลพนักงานขับรถ-ทะเบียนรถ": ["70-1234", "71-0001", None],
+        "ผู้รับผลิตภัณฑ์-หมายเลขตั๋ว": ["0001/69", "", ""],
+    })
+
+
+def test_normalize_ignores_spaces_dashes_and_sara_am():
+    assert normalize("70-1234") == normalize("70 1234") == "701234"
+    assert normalize("นํามัน") == normalize("นำมัน")
+
+
+def test_blank_fields_give_plain_labels():
+    index = InvoiceSearchIndex(_frame())
+    total, labels = index.search()
+    assert total == 3
+    assert labels == ["JPP-2026-10-0001 | สยามน้ำมัน", "JPP-2026-09-0002 | ", "JPP-2026-09-0001 | บริษัท ปิโตรไทย จำกัด"]
+    assert all(isinstance(label, str) and "nan" not in label for label in labels)
+
+
+def test_blank_fields_in_categorical_columns():
+    df = _frame().astype({"ผู้รับสินค้า-ชื่อ": "category"})
+    assert InvoiceSearchIndex(df).search("0002")[1] == ["JPP-2026-09-0002 | "]
+
+
+def test_prefix_matches_come_first():
+    total, labels = InvoiceSearchIndex(_frame()).search("70")
+    assert total == 1 and labels[0].startswith("JPP-2026-09-0001")
+    # เลขตั๋วขึ้นต้นด้วย "0001" มาก่อน บิลที่เจอกลางข้อความ (เลขที่/ทะเบียน) เรียงใหม่ไปเก่า
+    total, labels = InvoiceSearchIndex(_frame()).search("0001")
+    assert total == 3
+    assert [label.split(" | ")[0] for label in labels] == ["JPP-2026-09-0001", "JPP-2026-10-0001", "JPP-2026-09-0002"]
+
+
+def test_date_range_and_pages():
+    index = InvoiceSearchIndex(_frame())
+    assert index.search(date_from=pd.Timestamp(2026, 9, 10))[0] == 2
+    assert index.search(date_to=pd.Timestamp(2026, 9, 10))[1] == ["JPP-2026-09-0001 | บริษัท ปิโตรไทย จำกัด"]
+    assert index.search(page=1, page_size=2)[1] == ["JPP-2026-09-0001 | บริษัท ปิโตรไทย จำกัด"]
+
+
+def test_empty_frame():
+    assert len(InvoiceSearchIndex(pd.DataFrame(columns=invoice_search.SEARCH_FIELDS))) == 0
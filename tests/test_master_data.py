@@ -0,0 +1,66 @@
+import master_data
+
+GROUP = "ผู้รับสินค้า"
+NAME, ADDRESS = master_data.GROUPS[GROUP][:2]
+
+
+def customer(name, address=""):
+    return {NAME: name, ADDRESS: address}
+
+
+def index_of(invoices, *customers):
+    """MasterIndex of invoices 1, 2, ... with (name, date) customers."""
+    for n, (name, day) in enumerate(customers, start=1): invoices.save(n, day=day, **customer(name))
+    return master_data.MasterIndex().sync(invoices.load())
+
+
+def names(index, query="", limit=8):
+    return [values[0] for values in index.lookup(GROUP, query, limit)]
+
+
+def test_lookup_matches_the_start_of_any_word(invoices):
+    invoices.save(1, **customer("บริษัท ปิโตรไทย จำกัด", "ชลบุรี"))
+    invoices.save(2, **customer("หจก. ปิโตรสยาม"))
+    invoices.save(3, **customer("สยามออยล์"))
+    index = master_data.MasterIndex().sync(invoices.load())
+    assert sorted(names(index, "ปิโตร")) == ["บริษัท ปิโตรไทย จำกัด", "หจก. ปิโตรสยาม"]
+    assert names(index, "จำกัด") == ["บริษัท ปิโตรไทย จำกัด"]
+    assert names(index, "สยาม") == ["สยามออยล์"]   # "ปิโตรสยาม" ขึ้นต้นด้วย "ปิโตร" ไม่ใช่ "สยาม"
+    assert names(index, "ไม่มี") == []
+    assert master_data.fill(GROUP, index.lookup(GROUP, "ปิโตรไ")[0])[ADDRESS] == "ชลบุรี"
+
+
+def test_lookup_ranks_by_frequency_and_recency(invoices):
+    index = index_of(invoices, ("ลูกค้าเก่า", "01/01/2020"), ("ลูกค้าเก่า", "02/01/2020"), ("ลูกค้าประจำ", "01/10/2026"),
+                     ("ลูกค้าประจำ", "02/10/2026"), ("ลูกค้าใหม่", "03/10/2026"))
+    assert names(index) == ["ลูกค้าประจำ", "ลูกค้าใหม่", "ลูกค้าเก่า"]
+    assert names(index, "ลูกค้า", limit=2) == ["ลูกค้าประจำ", "ลูกค้าใหม่"]
+    assert index.stats()[GROUP] == 3
+
+
+def test_sync_patches_edited_invoices(invoices):
+    index = index_of(invoices, ("ลูกค้า ก", "01/10/2026"), ("ลูกค้า ข", "01/10/2026"))
+    frames = invoices.frames
+    stamp = frames.stamp
+    invoices.edit(1, **customer("ลูกค้า ค"))
+    assert frames.headers_since(stamp) is not None
+    index.sync(frames)
+    assert sorted(names(index, "ลูกค้า")) == ["ลูกค้า ข", "ลูกค้า ค"]
+    assert names(index, "ก") == []
+    assert index.stats() == master_data.MasterIndex().sync(frames).stats()
+
+
+def test_buddhist_era_and_far_future_dates_do_not_overflow(invoices):
+    index = index_of(invoices, ("ลูกค้า พ.ศ.", "17/10/2569"), ("ลูกค้า อนาคต", "01/01/9999"), ("ลูกค้า เก่า", "01/01/1900"))
+    assert sorted(names(index, "ลูกค้า")) == ["ลูกค้า พ.ศ.", "ลูกค้า อนาคต", "ลูกค้า เก่า"]
+    assert names(index)[-1] == "ลูกค้า เก่า"
+    invoices.edit(4, day="31/12/2999", **customer("ลูกค้า ใหม่"))
+    assert "ลูกค้า ใหม่" in names(index.sync(invoices.frames), "ลูกค้า")
+
+
+def test_day_of_converts_buddhist_era_and_clamps_to_today():
+    today = master_data.date(2026, 10, 17)
+    assert master_data.day_of("17/10/2569", today) == today
+    assert master_data.day_of("01/09/2569", today) == master_data.date(2026, 9, 1)
+    assert master_data.day_of("01/01/2090", today) == today
+    assert master_data.day_of("ไม่ใช่วันที่", today) == today
@@ -0,0 +1,64 @@
+import sqlite3
+import threading
+
+import numbering
+import sheet_mirror
+import storage
+from sheet_store import INV_SHEET
+
+PREFIX = "JPP-2026-10"
+
+
+def _mirror_with(path, keys):
+    sheet_mirror.SheetMirror(str(path))
+    with sqlite3.connect(path) as con:
+        con.executemany("INSERT INTO sheet_rows (sheet, row, key, data) VALUES (?, ?, ?, '[]')",
+                        [(INV_SHEET, i + 2, k) for i, k in enumerate(keys)])
+
+
+def test_suffix_of():
+    assert numbering.suffix_of("JPP-2026-10-0042") == 42
+    assert numbering.suffix_of("JPP-2026-10-x") == 0
+
+
+def test_allocates_consecutive_numbers(tmp_path):
+    alloc = numbering.InvoiceNumberAllocator(str(tmp_path / "n.sqlite"), "SELECT NULL WHERE ? < ?")
+    assert alloc.allocate(PREFIX) == f"{PREFIX}-0001"
+    assert alloc.allocate_many(PREFIX, 3) == [f"{PREFIX}-0002", f"{PREFIX}-0003", f"{PREFIX}-0004"]
+    assert alloc.allocate("INV-2026-10") == "INV-2026-10-0001"
+
+
+def test_counter_never_below_mirrored_max(tmp_path):
+    path = tmp_path / "m.sqlite"
+    _mirror_with(path, [f"{PREFIX}-0001", f"{PREFIX}-0007", "JPP-2026-11-0050"])
+    alloc = numbering.InvoiceNumberAllocator(str(path))
+    assert alloc.allocate(PREFIX) == f"{PREFIX}-0008"
+
+
+def test_mirrored_max_is_numeric_past_four_digits(tmp_path):
+    path = tmp_path / "m.sqlite"
+    _mirror_with(path, [f"{PREFIX}-9998", f"{PREFIX}-9999", f"{PREFIX}-10000", f"{PREFIX}-10001"])
+    assert numbering.InvoiceNumberAllocator(str(path)).allocate(PREFIX) == f"{PREFIX}-10002"
+
+
+def test_sqlite_store_max_is_numeric_past_four_digits(tmp_path):
+    store = storage.SqliteStore(str(tmp_path / "s.sqlite"))
+    for no in (f"{PREFIX}-9999", f"{PREFIX}-10000"):
+        store.save_invoice(no, [no, "01/10/2026"], [])
+    assert store.next_number(PREFIX) == f"{PREFIX}-10001"
+
+
+def test_concurrent_allocators_never_collide(tmp_path):
+    path = str(tmp_path / "n.sqlite")
+    got, lock = [], threading.Lock()
+
+    def worker():
+        alloc = numbering.InvoiceNumberAllocator(path, "SELECT NULL WHERE ? < ?")
+        for _ in range(20):
+            no = alloc.allocate(PREFIX)
+            with lock: got.append(no)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert len(set(got)) == 80
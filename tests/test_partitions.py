@@ -0,0 +1,68 @@
+from datetime import date
+
+import pytest
+
+import fake_sheets
+import partitions
+from sheet_store import INV_SHEET, ITEM_SHEET
+
+TODAY = date(2026, 10, 17)
+
+
+def test_month_of():
+    assert partitions.month_of("JPP-2026-09-0001") == "2026-09"
+    assert partitions.month_of("INV-2026-10-12345") == "2026-10"
+    assert partitions.month_of("JPP-0001") is None
+    assert partitions.month_of("") is None
+
+
+def test_prefix_month():
+    assert partitions.prefix_month("JPP-2026-09") == "2026-09"
+    assert partitions.prefix_month("JPP-2026-09-00") == "2026-09"
+    assert partitions.prefix_month("JPP-2026") is None
+
+
+def test_hot_months_cross_the_year():
+    assert partitions.hot_months(2, date(2026, 1, 5)) == ["2026-01", "2025-12", None]
+
+
+def _sheets():
+    # 1,000 บิลต่อเดือน: 2026-08, 2026-09, 2026-10
+    ss = fake_sheets.populate(3000, items_per_invoice=1, end=TODAY)
+    inv = ss.worksheet(INV_SHEET).rows
+    inv[1][2] = "0812345678"    # ค่าที่ Sheets จะแปลงเป็นตัวเลขถ้าส่งแบบ USER_ENTERED
+    return ss
+
+
+def test_archive_moves_closed_months_verbatim():
+    ss = _sheets()
+    august = [list(r) for r in ss.worksheet(INV_SHEET).rows if partitions.month_of(r[0]) == "2026-08"]
+    items = [list(r) for r in ss.worksheet(ITEM_SHEET).rows if partitions.month_of(r[0]) == "2026-08"]
+    moved = partitions.archive_closed_months(ss, keep=2, today=TODAY)
+    assert moved == {"2026-08": {INV_SHEET: 1000, ITEM_SHEET: 1000}}
+    assert ss.worksheet(f"{INV_SHEET} 2026-08").rows[1:] == august
+    assert ss.worksheet(f"{ITEM_SHEET} 2026-08").rows[1:] == items
+    assert {partitions.month_of(r[0]) for r in ss.worksheet(INV_SHEET).rows[1:]} == {"2026-09", "2026-10"}
+    assert partitions.archived_months(ss) == ["2026-08"]
+    # รันซ้ำได้โดยไม่มีอะไรเปลี่ยน
+    assert partitions.archive_closed_months(ss, keep=2, today=TODAY) == {}
+    assert len(ss.worksheet(f"{INV_SHEET} 2026-08").rows) == 1001
+
+
+def test_archive_keeps_the_main_sheet_when_the_copy_differs(monkeypatch):
+    ss = _sheets()
+    before = [list(r) for r in ss.worksheet(INV_SHEET).rows]
+    append_rows = fake_sheets.FakeWorksheet.append_rows
+    # สำเนาที่ Sheets แปลงค่า (เช่นส่งแบบ USER_ENTERED) ต้องไม่ทำให้แถวต้นฉบับถูกลบ
+    monkeypatch.setattr(fake_sheets.FakeWorksheet, "append_rows",
+                        lambda self, values, value_input_option=None: append_rows(self, values, "USER_ENTERED"))
+    with pytest.raises(RuntimeError):
+        partitions.archive_closed_months(ss, keep=2, today=TODAY)
+    assert ss.worksheet(INV_SHEET).rows == before
+
+
+def test_dry_run_changes_nothing():
+    ss = _sheets()
+    before = {t: [list(r) for r in ws.rows] for t, ws in ss.sheets.items()}
+    assert partitions.archive_closed_months(ss, keep=2, today=TODAY, dry_run=True)["2026-08"][INV_SHEET] == 1000
+    assert {t: ws.rows for t, ws in ss.sheets.items()} == before
@@ -0,0 +1,83 @@
+import os
+
+import invoice_pdf
+import pdf_cache
+
+DATA = {"date": "01/10/2026", "ผู้รับสินค้า-ชื่อ": "ลูกค้า"}
+ITEMS = [{"product": "ดีเซล", "unit": "ลิตร", "qty": "1,000", "tank": "1", "seal": "S1"}]
+
+
+def key(inv_no="JPP-2026-10-0001", items=ITEMS, data=DATA, *variant):
+    return pdf_cache.pdf_key(inv_no, items, data, *variant)
+
+
+def test_key_changes_with_everything_on_the_page(monkeypatch):
+    base = key()
+    assert key(data=dict(reversed(list(DATA.items())))) == base
+    assert key(data={**DATA, "ไม่อยู่ในใบ": "x"}) == base
+    assert key("JPP-2026-10-0002") != base
+    assert key(data={**DATA, "date": "02/10/2026"}) != base
+    assert key(items=[{**ITEMS[0], "qty": "1,001"}]) != base
+    assert key(items=ITEMS * 2) != base
+    assert key("JPP-2026-10-0001", ITEMS, DATA, "four") != base
+    monkeypatch.setattr(invoice_pdf, "TEMPLATE_VERSION", invoice_pdf.TEMPLATE_VERSION + 1)
+    assert key() != base
+
+
+def test_lru_evicts_the_least_recently_used():
+    cache = pdf_cache.PdfCache(max_entries=2)
+    cache.put("a", b"A")
+    cache.put("b", b"B")
+    assert cache.get("a") == b"A"   # a ใช้ล่าสุด b จึงถูกไล่ออกก่อน
+    cache.put("c", b"C")
+    assert cache.get("b") is None and cache.get("a") == b"A" and cache.get("c") == b"C"
+    assert len(cache) == 2 and (cache.hits, cache.misses) == (3, 1)
+
+
+def test_byte_cap_keeps_the_newest_entry():
+    cache = pdf_cache.PdfCache(max_entries=10, max_bytes=10)
+    cache.put("a", b"x" * 4)
+    cache.put("b", b"x" * 4)
+    assert cache.size_bytes == 8 and len(cache) == 2
+    cache.put("c", b"x" * 4)
+    assert cache.get("a") is None and cache.size_bytes == 8
+    cache.put("b", b"x" * 6)   # แทนค่าเดิม: ขนาดนับใหม่ ไม่บวกซ้ำ
+    assert cache.size_bytes == 10 and len(cache) == 2
+    cache.put("b", b"x" * 7)
+    assert cache.get("c") is None and cache.size_bytes == 7
+    cache.put("big", b"x" * 50)
+    assert cache.get("big") == b"x" * 50 and len(cache) == 1 and cache.size_bytes == 50
+
+
+def test_render_only_on_a_miss():
+    cache, calls = pdf_cache.PdfCache(), []
+    render = lambda: calls.append(1) or b"%PDF"
+    assert cache.get_or_render("k", render) == b"%PDF" and cache.get_or_render("k", render) == b"%PDF"
+    assert len(calls) == 1
+
+
+def test_disk_tier_survives_memory_eviction_and_restarts(tmp_path):
+    cache = pdf_cache.PdfCache(max_entries=1, disk_dir=str(tmp_path))
+    cache.put("a", b"A")
+    cache.put("b", b"B")
+    assert len(cache) == 1
+    assert cache.get("a") == b"A"   # จาก disk แล้วกลับเข้า memory
+    assert list(cache._mem) == ["a"]
+    restarted = pdf_cache.PdfCache(disk_dir=str(tmp_path))
+    assert restarted.get("b") == b"B" and restarted.get("zzz") is None
+    assert not [f for f in os.listdir(tmp_path) if f.endswith(".tmp")]
+
+
+def test_disk_tier_prunes_the_least_recently_used_files(tmp_path):
+    cache = pdf_cache.PdfCache(max_entries=1, disk_dir=str(tmp_path), disk_max_entries=2)
+    cache.put("a", b"A")
+    cache.put("b", b"B")
+    os.utime(tmp_path / "a.pdf", (1, 1))
+    os.utime(tmp_path / "b.pdf", (2, 2))
+    cache.put("c", b"C")
+    assert sorted(os.listdir(tmp_path)) == ["b.pdf", "c.pdf"]
+    os.utime(tmp_path / "b.pdf", (2, 2))
+    os.utime(tmp_path / "c.pdf", (3, 3))
+    assert cache.get("b") == b"B"   # อ่านแล้ว mtime ใหม่ขึ้น c จึงเก่ากว่า
+    cache.put("d", b"D")
+    assert sorted(os.listdir(tmp_path)) == ["b.pdf", "d.pdf"]
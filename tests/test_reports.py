@@ -0,0 +1,70 @@
+import pandas as pd
+
+import reports
+
+
+def transport(carrier="ขนส่ง ก"):
+    return {reports.CARRIER: carrier, reports.DEPOT: "คลัง 1"}
+
+
+def item(product, qty):
+    return {"product": product, "unit": "ลิตร", "qty": qty}
+
+
+def totals(rollups, by="product"):
+    return {r[by]: (r["qty"], r["lines"]) for r in rollups.rollup(by).to_dict("records")}
+
+
+def test_parse_qty():
+    assert list(reports.parse_qty(["1,500", " 20 ", "", None, "abc", "2.5"])) == [1500, 20, 0, 0, 0, 2.5]
+    assert reports.qty_value("1,500") == 1500 and reports.qty_value(None) == 0 and reports.qty_value("x") == 0
+
+
+def test_non_finite_quantities_count_as_zero():
+    texts = ["nan", "NaN", "inf", "-inf", "1e999", "5"]
+    assert list(reports.parse_qty(texts)) == [0, 0, 0, 0, 0, 5]
+    assert [reports.qty_value(t) for t in texts] == [0, 0, 0, 0, 0, 5]
+
+
+def test_rollups_follow_saves_invoice_by_invoice(invoices):
+    invoices.save(1, [item("ดีเซล", "1,000"), item("ดีเซล", "500")], **transport())
+    invoices.save(2, [item("เบนซิน", "200")], **transport())
+    frames = invoices.load()
+    rollups = reports.VolumeRollups().sync(frames)
+    assert totals(rollups) == {"ดีเซล": (1500, 2), "เบนซิน": (200, 1)}
+
+    # แก้บิลเดิม: ยอดเก่าของบิลถูกถอนออกก่อนบวกยอดใหม่ (patch ไม่ต้องสร้างใหม่ทั้งตาราง)
+    stamp = frames.stamp
+    invoices.edit(1, [item("ดีเซล", "300")], **transport("ขนส่ง ข"))
+    assert frames.stamp != stamp and frames.invoices_since(stamp) is not None
+    rollups.sync(frames)
+    assert totals(rollups) == {"ดีเซล": (300, 1), "เบนซิน": (200, 1)}
+    assert totals(rollups, "carrier") == {"ขนส่ง ข": (300, 1), "ขนส่ง ก": (200, 1)}
+
+    invoices.edit(3, [item("เบนซิน", "1,800")], **transport())
+    assert totals(rollups.sync(frames)) == {"ดีเซล": (300, 1), "เบนซิน": (2000, 2)}
+    built = reports.VolumeRollups().sync(frames)
+    assert totals(built, "carrier") == totals(rollups, "carrier")
+
+
+def test_older_months_load_on_demand():
+    calls = []
+
+    def load_month(month):
+        calls.append(month)
+        inv_no = f"JPP-{month}-0001"
+        return (pd.DataFrame([{"invoice_no": inv_no, **transport()}]),
+                pd.DataFrame([{"invoice_no": inv_no, "product": "ดีเซล", "unit": "ลิตร", "qty": "1,200"}]))
+
+    rollups = reports.VolumeRollups()
+    table = rollups.rollup("month", ["2001-01"], load_month)
+    assert table.to_dict("records") == [{"month": "2001-01", "unit": "ลิตร", "qty": 1200.0, "lines": 1}]
+    rollups.rollup("product", ["2001-01"], load_month)
+    assert calls == ["2001-01"]
+
+
+def test_to_csv_has_thai_headers_and_bom():
+    table = pd.DataFrame([{"product": "ดีเซล", "unit": "ลิตร", "qty": 1500.0, "lines": 2}])
+    data = reports.to_csv(table)
+    assert data.startswith("﻿".encode("utf-8"))
+    assert data.decode("utf-8-sig").splitlines()[0] == "สินค้า,หน่วย,ปริมาณ,รายการ"
@@ -0,0 +1,69 @@
+import importlib
+import sys
+
+import pytest
+
+import sessions
+
+
+@pytest.fixture(autouse=True)
+def fresh():
+    sessions._seen.clear()
+    sessions._files.clear()
+    yield
+    sessions._seen.clear()
+    sessions._files.clear()
+
+
+def make(tmp_path, name, size=1024):
+    path = tmp_path / name
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+def test_idle_sessions_release_their_files(tmp_path):
+    a, b = make(tmp_path, "a.zip"), make(tmp_path, "b.zip")
+    sessions.touch("aaaa", now=1000)
+    sessions.own_file("aaaa", a)
+    sessions.touch("bbbb", now=1000 + sessions.IDLE_SECONDS / 2)
+    sessions.own_file("bbbb", b)
+    assert sessions.stats() == {"sessions": 2, "files": 2, "file_mb": 0.0}
+
+    sessions.touch("bbbb", now=1001 + sessions.IDLE_SECONDS)
+    assert not (tmp_path / "a.zip").exists() and (tmp_path / "b.zip").exists()
+    assert sessions.stats()["sessions"] == 1 and sessions.stats()["files"] == 1
+
+    # session ที่กลับมาใช้งานหลังถูกลบนับเป็น session ใหม่
+    sessions.touch("aaaa", now=1002 + sessions.IDLE_SECONDS)
+    assert sessions.stats()["sessions"] == 2
+
+
+def test_a_new_file_replaces_the_old_one(tmp_path):
+    old, new = make(tmp_path, "old.pdf"), make(tmp_path, "new.pdf", 2 ** 20)
+    sessions.own_file("cccc", old)
+    sessions.own_file("cccc", old)
+    assert (tmp_path / "old.pdf").exists()
+    sessions.own_file("cccc", new)
+    assert not (tmp_path / "old.pdf").exists()
+    assert sessions.stats() == {"sessions": 0, "files": 1, "file_mb": 1.0}
+
+
+def test_session_files_are_kept_apart(tmp_path, monkeypatch):
+    monkeypatch.setenv("JP_EXPORT_DIR", str(tmp_path))
+    assert sessions.session_file("0123456789abcdef", "x.zip") == str(tmp_path / "01234567_x.zip")
+    assert sessions.session_file("", "x.zip") == str(tmp_path / "cli_x.zip")
+
+
+def test_works_without_the_resource_module(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "resource", None)   # import resource จะ raise ImportError เหมือนบน Windows
+    try:
+        module = importlib.reload(sessions)
+        assert module.resource is None
+        memory = module.process_memory()
+        assert memory["peak_mb"] is None and set(memory) == {"rss_mb", "peak_mb"}
+        module.touch("dddd", now=1)
+        module.own_file("dddd", make(tmp_path, "d.zip"))
+        assert module.stats()["files"] == 1
+    finally:
+        monkeypatch.undo()
+        importlib.reload(sessions)
@@ -0,0 +1,233 @@
+import json
+import sqlite3
+from datetime import date
+
+import pytest
+
+from gspread.exceptions import APIError
+
+import fake_sheets
+import sheet_mirror
+from sheet_store import INV_SHEET, ITEM_HEADER, ITEM_SHEET, delete_row_ranges, key_row_ranges, replace_items
+
+
+def _synced(tmp_path, n=3000):
+    ss = fake_sheets.populate(n, items_per_invoice=1, end=date(2026, 10, 17))
+    ws = ss.worksheet(INV_SHEET)
+    ws.rows.append(["ไม่มีเดือน-1", "01/10/2026"])
+    mirror = sheet_mirror.SheetMirror(str(tmp_path / "m.sqlite"))
+    mirror.sync(ws)
+    return ss, ws, mirror
+
+
+def test_records_of_months(tmp_path):
+    _, ws, mirror = _synced(tmp_path)
+    got = mirror.records(INV_SHEET, ["2026-10", None])
+    assert [r["invoice_no"] for r in got] == [r[0] for r in ws.rows[2001:]]
+    assert len(mirror.records(INV_SHEET, ["2026-09"])) == 1000
+    assert mirror.records(INV_SHEET, []) == []
+    assert len(mirror.records(INV_SHEET)) == 3001
+
+
+def test_months(tmp_path):
+    _, ws, mirror = _synced(tmp_path)
+    assert mirror.months(INV_SHEET) == {"2026-08", "2026-09", "2026-10", None}
+    # แถวที่ต่อท้ายจาก sync แบบเพิ่มเฉพาะส่วนที่เปลี่ยนก็มีเดือน
+    ws.rows.append(["JPP-2026-11-0001", "01/11/2026"])
+    mirror.sync(ws)
+    assert "2026-11" in mirror.months(INV_SHEET)
+    assert [r["invoice_no"] for r in mirror.records(INV_SHEET, ["2026-11"])] == ["JPP-2026-11-0001"]
+
+
+def test_month_filter_uses_the_month_index(tmp_path):
+    _, _, mirror = _synced(tmp_path, 100)
+    with sqlite3.connect(mirror.path) as con:
+        plan = con.execute("EXPLAIN QUERY PLAN SELECT data FROM sheet_rows INDEXED BY sheet_rows_month "
+                           "WHERE sheet = ? AND month IN (?) ORDER BY row", (INV_SHEET, "2026-10")).fetchall()
+    assert "sheet_rows_month" in str(plan)
+
+
+def test_mirror_created_before_the_month_column(tmp_path):
+    path = str(tmp_path / "old.sqlite")
+    with sqlite3.connect(path) as con:
+        con.executescript("""
+            CREATE TABLE sheet_meta (sheet TEXT PRIMARY KEY, header TEXT NOT NULL, last_full REAL NOT NULL, version INTEGER NOT NULL);
+            CREATE TABLE sheet_rows (sheet TEXT NOT NULL, row INTEGER NOT NULL, key TEXT NOT NULL, data TEXT NOT NULL,
+                                     PRIMARY KEY (sheet, row));
+        """)
+        con.execute("INSERT INTO sheet_meta VALUES (?, ?, 0, 1)", (INV_SHEET, '["invoice_no"]'))
+        con.executemany("INSERT INTO sheet_rows VALUES (?, ?, ?, ?)",
+                        [(INV_SHEET, 2, "JPP-2026-09-0001", '["JPP-2026-09-0001"]'), (INV_SHEET, 3, "X", '["X"]')])
+    mirror = sheet_mirror.SheetMirror(path)
+    assert mirror.months(INV_SHEET) == {"2026-09", None}
+    with sqlite3.connect(path) as con:
+        assert con.execute("SELECT modified FROM sheet_meta").fetchall() == [(None,)]
+    assert mirror.records(INV_SHEET, [None]) == [{"invoice_no": "X"}]
+
+
+# ---------- การเลื่อนแถวของ mirror ให้ตรงกับชีทหลังลบ/ต่อท้าย ----------
+ITEM_KEYS = ["A", "A", "B", "B", "B", "C", "A", "D"]   # A มีสองช่วงที่ไม่ติดกัน
+
+
+def _items(tmp_path):
+    ss = fake_sheets.FakeSpreadsheet()
+    ws = ss.add_worksheet(ITEM_SHEET, header=ITEM_HEADER)
+    for i, key in enumerate(ITEM_KEYS):
+        ws.rows.append([key, f"{key}{i}", "ลิตร", str(100 * (i + 1)), "1", f"S{i}"])
+    mirror = sheet_mirror.SheetMirror(str(tmp_path / "m.sqlite"))
+    mirror.sync(ws)
+    return ws, mirror
+
+
+def _assert_aligned(ws, mirror):
+    keys = ws.col_values(1)
+    assert mirror.keys(ITEM_SHEET) == keys[1:]
+    for key in set(keys[1:]):
+        assert mirror.row_ranges(ITEM_SHEET, key) == key_row_ranges(keys, key)
+    with sqlite3.connect(mirror.path) as con:
+        rows = con.execute("SELECT row, data FROM sheet_rows WHERE sheet = ? ORDER BY row", (ITEM_SHEET,)).fetchall()
+    assert [(row, json.loads(data)) for row, data in rows] == list(enumerate(ws.rows[1:], start=2))
+
+
+def _delete(ws, mirror, ranges):
+    version = mirror.version(ITEM_SHEET)
+    delete_row_ranges(ws, ranges)
+    mirror.record_delete(ITEM_SHEET, ranges)
+    _assert_aligned(ws, mirror)
+    assert mirror.version(ITEM_SHEET) == version + 1
+    assert mirror.sync(ws) == version + 1   # sync ไม่พบความต่าง: ไม่ต้องดึงใหม่
+
+
+@pytest.mark.parametrize("ranges", [
+    [(2, 3)],            # ก่อนช่วงของ B
+    [(5, 5)],            # กลางช่วงของ B
+    [(4, 6)],            # ทั้งช่วงของ B
+    [(7, 9)],            # หลัง B ต่อเนื่องถึงแถวสุดท้าย
+    [(9, 9)],            # แถวสุดท้าย
+    [(2, 3), (8, 8)],    # A ที่ไม่ติดกัน ลบพร้อมกัน
+    [(8, 8), (2, 3), (5, 5)],
+])
+def test_record_delete_shifts_the_rows_below(tmp_path, ranges):
+    ws, mirror = _items(tmp_path)
+    _delete(ws, mirror, ranges)
+
+
+def test_record_delete_reports_the_deleted_keys(tmp_path):
+    ws, mirror = _items(tmp_path)
+    version = mirror.version(ITEM_SHEET)
+    _delete(ws, mirror, [(2, 3), (7, 8)])
+    assert mirror.changes_since(ITEM_SHEET, version) == {"A", "C"}
+    mirror.record_delete(ITEM_SHEET, [])
+    assert mirror.version(ITEM_SHEET) == version + 1
+
+
+@pytest.mark.parametrize("n", [0, 1, 2, 5])
+def test_replacing_items_keeps_the_mirror_aligned(tmp_path, n):
+    ws, mirror = _items(tmp_path)
+    for key in ["A", "B", "D", "E"]:
+        rows = [[key, f"{key}-ใหม่{i}", "ลิตร", "500", "2", "X"] for i in range(n)]
+        ranges = mirror.row_ranges(ITEM_SHEET, key)
+        resp = replace_items(ws, key, [dict(zip(ITEM_HEADER[1:], r[1:])) for r in rows], ranges)
+        mirror.record_delete(ITEM_SHEET, ranges)
+        mirror.record_append(ITEM_SHEET, resp, rows)
+        _assert_aligned(ws, mirror)
+        assert [r["product"] for r in mirror.records_of(ITEM_SHEET, key)] == [r[1] for r in rows]
+
+
+def test_record_append_skips_rows_it_cannot_place(tmp_path):
+    ws, mirror = _items(tmp_path)
+    version = mirror.version(ITEM_SHEET)
+    ws.rows.append(["X", "จากเครื่องอื่น"])   # แถวที่ mirror ยังไม่เห็น
+    row = ["F", "ใหม่", "ลิตร", "1", "1", "S"]
+    mirror.record_append(ITEM_SHEET, ws.append_rows([row]), [row])
+    mirror.record_append(ITEM_SHEET, {"updates": {}}, [row])
+    mirror.record_append(ITEM_SHEET, None, [row])
+    assert mirror.version(ITEM_SHEET) == version and mirror.keys(ITEM_SHEET) == ITEM_KEYS
+    mirror.sync(ws)
+    _assert_aligned(ws, mirror)
+
+
+# ---------- sync อ่านชีทนอก lock ----------
+def test_sync_reads_the_sheet_without_holding_the_lock(tmp_path):
+    ws, mirror = _items(tmp_path)
+    ws.rows.append(["E", "E8", "ลิตร", "900", "1", "S8"])
+    get = ws.get
+
+    def slow_get(range_name):
+        # ระหว่างที่ sync รอชีท (เช่นรอโควตา) การแก้ mirror ต้องไม่ติด lock
+        assert mirror._lock.acquire(timeout=1)
+        mirror._lock.release()
+        mirror.apply_row(ITEM_SHEET, "D", ["D", "D7", "ลิตร", "1", "1", "S7"])
+        return get(range_name)
+    ws.get = slow_get
+    version = mirror.sync(ws)
+    assert version == mirror.version(ITEM_SHEET) and "E" not in mirror.keys(ITEM_SHEET)   # ผลที่อ่านมาอาจเก่ากว่า จึงทิ้งไป
+    ws.get = get
+    assert mirror.sync(ws) == version + 1 and mirror.keys(ITEM_SHEET)[-1] == "E"
+
+
+# ---------- ตรวจการแก้ไขจาก modifiedTime ----------
+def _reads(ss):
+    return sum(ss.calls[name] for name in ("col_values", "get", "get_all_values"))
+
+
+def test_unchanged_file_is_not_read(tmp_path):
+    ss, ws, mirror = _synced(tmp_path, 10)
+    ss.calls.clear()
+    version = mirror.sync(ws)
+    assert mirror.sync(ws) == version and _reads(ss) == 0 and ss.calls["get_lastUpdateTime"] == 2
+
+
+def test_in_place_edit_is_found(tmp_path):
+    ss, ws, mirror = _synced(tmp_path, 10)
+    version = mirror.sync(ws)
+    ws.update(range_name="C5", values=[["แก้ในชีทเอง"]])
+    assert mirror.sync(ws) == version + 1
+    assert mirror.changes_since(INV_SHEET, version) == {ws.rows[4][0]}   # เฉพาะบิลที่แก้ ไม่ต้องโหลดใหม่ทั้งหมด
+    assert mirror.records_of(INV_SHEET, ws.rows[4][0])[0]["ผู้รับสินค้า-ชื่อ"] == "แก้ในชีทเอง"
+    ss.calls.clear()
+    assert mirror.sync(ws) == version + 1 and _reads(ss) == 0
+
+
+def test_appended_rows_are_read_without_the_rest(tmp_path):
+    ss, ws, mirror = _synced(tmp_path, 10)
+    ws.rows.append(["JPP-2026-10-0999", "01/10/2026"])
+    ss.calls.clear()
+    mirror.sync(ws)
+    mirror.sync(ws)
+    assert (ss.calls["col_values"], ss.calls["get"], ss.calls["get_all_values"]) == (1, 1, 0)
+    assert mirror.keys(INV_SHEET)[-1] == "JPP-2026-10-0999"
+
+
+def test_without_drive_only_the_key_column_is_watched(tmp_path):
+    ss, ws, mirror = _synced(tmp_path, 10)
+    calls = []
+
+    def forbidden():
+        calls.append(1)
+        raise APIError(fake_sheets._response(403, {"error": {"code": 403, "message": "Drive API has not been used"}}))
+    ss.get_lastUpdateTime = forbidden
+    version = mirror.sync(ws)
+    ws.rows.append(["JPP-2026-10-0999", "01/10/2026"])
+    assert mirror.sync(ws) == version + 1 and mirror.keys(INV_SHEET)[-1] == "JPP-2026-10-0999"
+    assert len(calls) == 1
+
+
+def test_own_writes_are_not_read_back(tmp_path):
+    ss, ws, mirror = _synced(tmp_path, 10)
+    before = mirror.modified(ws)
+    mirror.sync(ws, modified=before)
+    row = ["JPP-2026-10-0999", "01/10/2026"]
+    mirror.record_append(INV_SHEET, ws.append_row(row), [row])
+    mirror.mark_written([INV_SHEET], before, mirror.modified(ws))
+    ss.calls.clear()
+    mirror.sync(ws)
+    assert _reads(ss) == 0
+
+    # ต่อท้ายแล้วบันทึกลง mirror ไม่ได้ (มีแถวอื่นแทรก): ต้องอ่านชีทรอบหน้าแม้จะ mark_written
+    before = mirror.modified(ws)
+    ws.rows.append(["แถวจากที่อื่น"])
+    mirror.record_append(INV_SHEET, ws.append_row(row), [row])
+    mirror.mark_written([INV_SHEET], before, mirror.modified(ws))
+    mirror.sync(ws)
+    assert mirror.keys(INV_SHEET)[-2:] == ["แถวจากที่อื่น", "JPP-2026-10-0999"]
@@ -0,0 +1,64 @@
+import pytest
+
+import fake_sheets
+import sheet_store
+from sheet_store import ITEM_HEADER, ITEM_SHEET
+
+# แถวที่ 2.. ของชีทรายการสินค้า: A มีสองช่วงที่ไม่ติดกัน
+KEYS = ["A", "A", "B", "B", "B", "C", "A", "D"]
+
+
+def items_sheet(keys=KEYS):
+    ss = fake_sheets.FakeSpreadsheet()
+    ws = ss.add_worksheet(ITEM_SHEET, header=ITEM_HEADER)
+    for i, key in enumerate(keys):
+        ws.rows.append([key, f"{key}{i}", "ลิตร", str(100 * (i + 1)), "1", f"S{i}"])
+    return ws
+
+
+def item(product, qty="500"):
+    return {"product": product, "unit": "ลิตร", "qty": qty, "tank": "2", "seal": "X"}
+
+
+def products(ws, key):
+    return [r[1] for r in ws.rows[1:] if r[0] == key]
+
+
+def test_key_row_ranges():
+    keys = ["invoice_no"] + KEYS
+    assert sheet_store.key_row_ranges(keys, "A") == [(2, 3), (8, 8)]
+    assert sheet_store.key_row_ranges(keys, "B") == [(4, 6)]
+    assert sheet_store.key_row_ranges(keys, "D") == [(9, 9)]
+    assert sheet_store.key_row_ranges(keys, "Z") == []
+    assert sheet_store.key_row_ranges(["A", "A"], "A") == [(2, 2)]   # แถวที่ 1 คือหัวตาราง ไม่นับ
+    assert sheet_store.key_row_ranges(["invoice_no", 1001, "1001"], "1001") == [(2, 3)]
+
+
+def test_delete_row_ranges_keeps_the_other_rows():
+    ws = items_sheet()
+    sheet_store.delete_row_ranges(ws, [(2, 3), (8, 8), (5, 5)])
+    assert [r[0] for r in ws.rows[1:]] == ["B", "B", "C", "D"]
+    assert products(ws, "B") == ["B2", "B4"]
+    assert ws.spreadsheet.calls["batch_update"] == 1
+    sheet_store.delete_row_ranges(ws, [])
+    assert ws.spreadsheet.calls["batch_update"] == 1
+
+
+@pytest.mark.parametrize("new", [[], [item("ใหม่1")], [item(f"ใหม่{i}") for i in range(5)]])
+@pytest.mark.parametrize("known", [True, False])
+def test_replace_items_with_fewer_or_more_rows(new, known):
+    ws = items_sheet()
+    ranges = sheet_store.key_row_ranges(ws.col_values(1), "A") if known else None
+    ws.spreadsheet.calls.clear()
+    sheet_store.replace_items(ws, "A", new, ranges)
+    assert products(ws, "A") == [it["product"] for it in new]
+    assert [r[1] for r in ws.rows[1:] if r[0] != "A"] == ["B2", "B3", "B4", "C5", "D7"]
+    assert ws.spreadsheet.calls["col_values"] == (0 if known else 1)
+
+
+def test_replace_items_of_a_new_invoice_only_appends():
+    ws = items_sheet()
+    resp = sheet_store.replace_items(ws, "E", [item("ใหม่", "1,000")])
+    assert ws.rows[-1] == ["E", "ใหม่", "ลิตร", "1,000", "2", "X"]
+    assert resp["updates"]["updatedRange"].endswith(f"!A{len(ws.rows)}:Z{len(ws.rows)}")
+    assert ws.spreadsheet.calls["batch_update"] == 0
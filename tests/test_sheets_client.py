@@ -0,0 +1,191 @@
+import threading
+import time
+
+import pytest
+from gspread.exceptions import APIError
+
+import fake_sheets
+import sheets_client
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def send_times(window, clock, n, step=0.0):
+    """Reserve n slots, one every step seconds, returning when each may be sent."""
+    times = []
+    for _ in range(n):
+        times.append(clock.now + window.reserve())
+        clock.now += step
+    return times
+
+
+def busiest_minute(times, span=60.0):
+    times = sorted(times)
+    return max(sum(1 for u in times if t <= u < t + span) for t in times)
+
+
+@pytest.mark.parametrize("step", [0.0, 0.5, 7.3])
+def test_window_never_exceeds_limit(step):
+    clock = Clock()
+    window = sheets_client.SlidingWindow(60, clock=clock)
+    times = send_times(window, clock, 300, step)
+    assert busiest_minute(times, window.window) <= 60
+    assert times == sorted(times)
+
+
+def test_window_allows_full_burst_then_waits():
+    clock = Clock()
+    window = sheets_client.SlidingWindow(10, window=60, clock=clock)
+    times = send_times(window, clock, 11)
+    assert times[:10] == [0.0] * 10
+    assert times[10] == 60.0
+
+
+def test_pause_holds_every_caller():
+    clock = Clock()
+    window = sheets_client.SlidingWindow(100, clock=clock)
+    window.pause(5)
+    assert window.reserve() == 5
+    clock.now = 6
+    assert window.reserve() == 0
+
+
+class Flaky:
+    def __init__(self, *codes):
+        self.codes = list(codes)
+        self.calls = []
+
+    def __call__(self, method, endpoint, params=None, **kwargs):
+        self.calls.append((method, endpoint))
+        if self.codes:
+            code = self.codes.pop(0)
+            raise APIError(fake_sheets._response(code, {"error": {"code": code, "message": "flaky"}}))
+        return fake_sheets._response(200, {})
+
+
+def limiter():
+    return sheets_client.QuotaLimiter(600, 600, sleep=lambda s: None)
+
+
+@pytest.mark.parametrize("method, endpoint", [("PUT", "values/Sheet1!A2"), ("POST", "values:batchUpdate")])
+@pytest.mark.parametrize("code", [408, 500, 503])
+def test_repeatable_writes_retry_on_5xx(method, endpoint, code):
+    lim, flaky = limiter(), Flaky(code, code)
+    assert lim.wrap(flaky)(method, endpoint, json={"values": [[1]]}).status_code == 200
+    assert len(flaky.calls) == 3
+    assert lim.metrics()["retries"] == 2
+
+
+@pytest.mark.parametrize("endpoint", ["values/Sheet1!A1:append", "id:batchUpdate"])
+def test_unrepeatable_writes_fail_on_5xx_but_retry_on_429(endpoint):
+    lim = limiter()
+    with pytest.raises(APIError):
+        lim.wrap(Flaky(503))("POST", endpoint, json={})
+    flaky = Flaky(429)
+    assert lim.wrap(flaky)("POST", endpoint, json={}).status_code == 200
+    assert len(flaky.calls) == 2
+
+
+def test_reads_retry_and_coalesce():
+    lim = limiter()
+    gate, calls = threading.Event(), []
+
+    def slow(method, endpoint, params=None, **kwargs):
+        calls.append(endpoint)
+        gate.wait(5)
+        return fake_sheets._response(200, {})
+
+    request = lim.wrap(slow)
+    threads = [threading.Thread(target=request, args=("GET", "values/Sheet1")) for _ in range(5)]
+    for t in threads: t.start()
+    while lim.counters["coalesced"] < 4: time.sleep(0.01)
+    gate.set()
+    for t in threads: t.join()
+    assert calls == ["values/Sheet1"]
+
+    flaky = Flaky(503)
+    assert lim.wrap(flaky)("GET", "values/Sheet2").status_code == 200
+    assert len(flaky.calls) == 2
+
+
+def test_reserve_with_max_wait_takes_no_slot_when_too_far():
+    clock = Clock()
+    window = sheets_client.SlidingWindow(2, window=60, clock=clock)
+    assert window.reserve(max_wait=1) == 0 and window.reserve(max_wait=1) == 0
+    assert window.reserve(max_wait=1) is None
+    assert len(window.granted) == 2 and window.reserve() == 60
+
+
+def test_interactive_requests_give_up_instead_of_waiting():
+    slept, ok = [], Flaky()
+    lim = sheets_client.QuotaLimiter(1, 1, sleep=slept.append)
+    request = lim.wrap(ok)
+    request("GET", "values/Sheet1")
+    with sheets_client.wait_at_most(1), pytest.raises(sheets_client.QuotaBusy):
+        request("GET", "values/Sheet1")
+    assert slept == [] and len(ok.calls) == 1 and lim.metrics()["busy"] == 1
+    request("GET", "values/Sheet1")   # นอก wait_at_most รอได้ตามปกติ
+    assert len(slept) == 1 and len(ok.calls) == 2
+
+    lim, flaky = sheets_client.QuotaLimiter(600, 600, sleep=slept.append), Flaky(503)
+    with sheets_client.wait_at_most(0), pytest.raises(sheets_client.QuotaBusy):
+        lim.wrap(flaky)("GET", "values/Sheet2")   # 503 ลองใหม่ได้ แต่ต้องรอ backoff ก่อน
+    assert len(slept) == 1 and len(flaky.calls) == 1
+
+
+def test_interactive_follower_does_not_wait_behind_a_throttled_leader():
+    lim = sheets_client.QuotaLimiter(600, 600)
+    lim.buckets["read"].pause(0.5)
+    request, results = lim.wrap(Flaky()), []
+
+    def background():
+        results.append(request("GET", "values/Sheet1").status_code)
+    leader = threading.Thread(target=background)
+    leader.start()
+    while not lim._flights: time.sleep(0.01)
+    with sheets_client.wait_at_most(0.05), pytest.raises(sheets_client.QuotaBusy):
+        request("GET", "values/Sheet1")
+    leader.join()
+    assert results == [200]
+
+
+def test_background_follower_retries_after_an_interactive_leader_gives_up():
+    lim = sheets_client.QuotaLimiter(600, 600, sleep=lambda s: None)
+    gate, flaky = threading.Event(), Flaky()
+
+    def slow_reserve(max_wait=None):
+        gate.wait(5)
+        return None if max_wait is not None else 0
+    lim.buckets["read"].reserve = slow_reserve
+    request, errors = lim.wrap(flaky), []
+
+    def interactive():
+        with sheets_client.wait_at_most(1):
+            try: request("GET", "values/Sheet1")
+            except sheets_client.QuotaBusy as e: errors.append(e)
+    leader = threading.Thread(target=interactive)
+    leader.start()
+    while not lim._flights: time.sleep(0.01)
+    follower = threading.Thread(target=request, args=("GET", "values/Sheet1"))
+    follower.start()
+    while not lim.counters["coalesced"]: time.sleep(0.01)
+    gate.set()
+    leader.join()
+    follower.join()
+    assert len(errors) == 1 and len(flaky.calls) == 1
+
+
+def test_drive_requests_have_their_own_quota():
+    lim, ok = sheets_client.QuotaLimiter(1, 1, sleep=lambda s: None), Flaky()
+    request = lim.wrap(ok)
+    request("GET", "https://sheets.googleapis.com/v4/spreadsheets/ID/values/Sheet1")
+    with sheets_client.wait_at_most(0):
+        for _ in range(3): request("GET", "https://www.googleapis.com/drive/v3/files/ID")
+    metrics = lim.metrics()
+    assert (metrics["reads"], metrics["drive"], metrics["read_last_min"], metrics["drive_last_min"]) == (1, 3, 1, 3)
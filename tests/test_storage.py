@@ -0,0 +1,99 @@
+import json
+import sqlite3
+from datetime import date
+
+import pandas as pd
+import pytest
+
+import bulk_export
+import fake_sheets
+import partitions
+import sheets_client
+import storage
+from sheet_store import INV_HEADER, INV_SHEET
+
+
+def header(inv_no, date="01/10/2026"):
+    return [inv_no, date] + [f"{f} {inv_no}" for f in INV_HEADER[2:]]
+
+
+def test_sqlite_save_and_read_back(tmp_path):
+    store = storage.SqliteStore(str(tmp_path / "s.sqlite"))
+    version = store.refresh()
+    store.save_invoice("JPP-2026-10-0001", header("JPP-2026-10-0001"), [{"product": "ดีเซล", "qty": "1,000"}])
+    store.save_invoice("JPP-2026-10-0001", header("JPP-2026-10-0001", "02/10/2026"), [{"product": "เบนซิน", "qty": "500"}])
+    record, items = store.get_invoice("JPP-2026-10-0001")
+    assert record["date"] == "02/10/2026"
+    assert [(it["product"], it["qty"]) for it in items] == [("เบนซิน", "500")]
+    assert store.changes_since(version) == {"JPP-2026-10-0001"}
+    inv_df, item_df = store.load_frames()
+    assert list(inv_df["invoice_no"]) == ["JPP-2026-10-0001"] and len(item_df) == 1
+
+
+def test_sqlite_date_ranges_and_months_use_the_indexes(tmp_path, monkeypatch):
+    store = storage.SqliteStore(str(tmp_path / "s.sqlite"))
+    store.save_invoices([("JPP-2026-10-0001", header("JPP-2026-10-0001", "30/09/2026"), [{"product": "ดีเซล"}]),
+                         ("JPP-2026-10-0002", header("JPP-2026-10-0002", "05/10/2026"), [{"product": "เบนซิน"}]),
+                         ("JPP-2026-08-0001", header("JPP-2026-08-0001", "วันที่ผิด"), []),
+                         ("JPP-2026-07-0001", header("JPP-2026-07-0001", "01/10/2026"), [{"product": "ก๊าซ"}])])
+    inv_df, item_df = store.load_range(date(2026, 9, 30), date(2026, 10, 1))
+    assert list(inv_df["invoice_no"]) == ["JPP-2026-10-0001", "JPP-2026-07-0001"]
+    assert list(item_df["product"]) == ["ดีเซล", "ก๊าซ"]
+    assert list(store.load_range(date(2026, 10, 1), month="2026-10")[0]["invoice_no"]) == ["JPP-2026-10-0002"]
+    assert len(store.load_range(month="2026-08")[0]) == 1   # ไม่มีช่วงวันที่: ทั้งเดือน รวมบิลที่วันที่อ่านไม่ได้
+    monkeypatch.setattr(partitions, "hot_months", lambda: ["2026-10", None])
+    assert store.older_months() == ["2026-08", "2026-07"]
+    with sqlite3.connect(store.path) as con:
+        plan = " ".join(r[-1] for r in con.execute("EXPLAIN QUERY PLAN SELECT data FROM invoices WHERE date_iso BETWEEN ? AND ?", ("", "~")))
+        assert "invoices_date" in plan
+        plan = " ".join(r[-1] for r in con.execute("EXPLAIN QUERY PLAN SELECT DISTINCT month FROM invoices"))
+        assert "invoices_month" in plan
+
+
+@pytest.mark.parametrize("with_date_iso", [True, False])
+def test_sqlite_fills_the_date_and_month_columns_of_old_files(tmp_path, with_date_iso):
+    path = str(tmp_path / "old.sqlite")
+    with sqlite3.connect(path) as con:
+        con.execute(f"""CREATE TABLE invoices (id INTEGER PRIMARY KEY AUTOINCREMENT, invoice_no TEXT NOT NULL UNIQUE,
+                                               date TEXT, {"date_iso TEXT," if with_date_iso else ""} data TEXT NOT NULL)""")
+        con.execute("INSERT INTO invoices (invoice_no, date, data) VALUES (?, ?, ?)",
+                    ("JPP-2026-07-0001", "02/07/2026", json.dumps({"invoice_no": "JPP-2026-07-0001", "date": "02/07/2026"})))
+    store = storage.SqliteStore(path)
+    assert list(store.load_range(date(2026, 7, 1), date(2026, 7, 31))[0]["invoice_no"]) == ["JPP-2026-07-0001"]
+    assert "2026-07" in store.older_months()
+    with sqlite3.connect(path) as con:
+        assert con.execute("SELECT date_iso, month FROM invoices").fetchall() == [("2026-07-02", "2026-07")]
+        assert len(con.execute("SELECT 1 FROM sqlite_master WHERE name IN ('invoices_date', 'invoices_month')").fetchall()) == 2
+
+
+def test_bulk_export_reads_a_date_range_from_sqlite(tmp_path):
+    db = str(tmp_path / "s.sqlite")
+    storage.SqliteStore(db).save_invoices([(f"JPP-2026-09-000{d}", header(f"JPP-2026-09-000{d}", f"0{d}/09/2026"), [])
+                                           for d in range(1, 6)])
+    parse = lambda d: pd.to_datetime(d, format="%d/%m/%Y")
+    inv_df, _ = bulk_export.load_frames("sqlite", db_path=db, month="2026-09", date_from=parse("02/09/2026"), date_to=parse("03/09/2026"))
+    assert list(inv_df["invoice_no"]) == ["JPP-2026-09-0002", "JPP-2026-09-0003"]
+
+
+def test_sheets_refresh_serves_the_mirror_when_quota_is_busy(tmp_path):
+    ss = fake_sheets.populate(3)
+    limiter = sheets_client.QuotaLimiter(2, 60)
+    ss.api = fake_sheets.SimulatedApi(latency_ms=0, jitter_ms=0, limiter=limiter)
+    store = storage.SheetsStore(ss, str(tmp_path / "m.sqlite"))
+    versions = store.refresh()
+    ss.worksheet(INV_SHEET).rows.append(["JPP-2026-10-0999", "01/10/2026"])
+    ss.calls.clear()
+    assert store.refresh(max_wait=0.1) == versions and set(ss.calls) == {"get_lastUpdateTime"}
+    assert limiter.metrics()["busy"] == 1
+    limiter.buckets["read"] = sheets_client.SlidingWindow(60)
+    assert store.refresh(max_wait=0.1) != versions
+    assert store.get_invoice("JPP-2026-10-0999") is not None
+
+
+def test_sheets_store_without_a_worker_flushes_on_request(tmp_path):
+    ss = fake_sheets.populate(0)
+    store = storage.SheetsStore(ss, str(tmp_path / "m.sqlite"), background=False)
+    store.save_invoice("JPP-2026-10-0001", header("JPP-2026-10-0001"), [{"product": "ดีเซล", "qty": "1,000"}])
+    assert store.queue._thread is None and store.pending_count() == 1
+    store.flush_pending()
+    assert store.pending_count() == 0 and ss.worksheet(INV_SHEET).rows[1][0] == "JPP-2026-10-0001"
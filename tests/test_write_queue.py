@@ -0,0 +1,195 @@
+import json
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import fake_sheets
+import sheet_mirror
+import write_queue
+from sheet_store import INV_HEADER, INV_SHEET, ITEM_SHEET
+
+LATER = 10 ** 10   # หลังเวลารอ backoff ทุกรายการ
+
+
+@pytest.fixture
+def sheets(tmp_path):
+    ss = fake_sheets.populate(0)
+    mirror = sheet_mirror.SheetMirror(str(tmp_path / "mirror.sqlite"))
+    queue = write_queue.WriteBehindQueue(mirror, ss.worksheet(INV_SHEET), ss.worksheet(ITEM_SHEET), max_attempts=2)
+    return ss, queue
+
+
+def header(inv_no, name="ลูกค้า"):
+    return [inv_no, "01/10/2026", name] + [""] * (len(INV_HEADER) - 3)
+
+
+def item(qty):
+    return {"product": "ดีเซล", "unit": "ลิตร", "qty": qty, "tank": "1", "seal": "S1"}
+
+
+def statuses(queue, *inv_nos):
+    return [queue.status(no)["status"] for no in inv_nos]
+
+
+def test_new_invoices_are_appended_in_one_request_per_sheet(sheets):
+    ss, queue = sheets
+    queue.enqueue_saves([(f"JPP-2026-10-000{i}", header(f"JPP-2026-10-000{i}"), [item("1,000"), item("500")]) for i in (1, 2, 3)])
+    ss.calls.clear()
+    assert queue.flush_ready() == 0
+    assert ss.calls["append_rows"] == 2 and ss.calls["append_row"] == 0
+    assert [r[0] for r in ss.worksheet(INV_SHEET).rows[1:]] == ["JPP-2026-10-0001", "JPP-2026-10-0002", "JPP-2026-10-0003"]
+    assert len(ss.worksheet(ITEM_SHEET).rows) == 7
+    assert queue.pending_count() == 0 and queue.flush_ready() == 30
+
+
+def test_edits_of_one_invoice_keep_their_order(sheets):
+    ss, queue = sheets
+    queue.enqueue_save("A", header("A", "v1"), [item("1")])
+    queue.enqueue_save("A", header("A", "v2"), [item("2")])
+    queue.enqueue_save("B", header("B"), [item("3")])
+    queue.flush_ready()
+    assert queue.pending_count() == 1   # A v2 รอรอบถัดไป ส่วน B ไม่ต้องรอ
+    queue.flush_ready()
+    rows = ss.worksheet(INV_SHEET).rows[1:]
+    assert [(r[0], r[2]) for r in rows] == [("A", "v2"), ("B", "ลูกค้า")]
+    assert [r[3] for r in ss.worksheet(ITEM_SHEET).rows[1:] if r[0] == "A"] == ["2"]
+
+
+def test_failing_entry_is_isolated_then_set_aside(sheets, monkeypatch):
+    ss, queue = sheets
+    ws_inv = ss.worksheet(INV_SHEET)
+    append_rows = ws_inv.append_rows
+
+    def flaky(rows, **kwargs):
+        if any(r[0] == "BAD" for r in rows): raise RuntimeError("rejected")
+        return append_rows(rows, **kwargs)
+    monkeypatch.setattr(ws_inv, "append_rows", flaky)
+    monkeypatch.setattr(ws_inv, "append_row", lambda row: flaky([row]))
+    queue.enqueue_saves([("BAD", header("BAD"), []), ("G1", header("G1"), []), ("G2", header("G2"), [])])
+
+    queue.flush_ready()                       # ทั้งชุดผิดพลาดครั้งแรก
+    assert queue.flush_ready() > 0            # รอ backoff
+    queue.flush_ready(now=LATER)              # BAD ลองเดี่ยว ๆ ผิดพลาดครบ max_attempts
+    assert statuses(queue, "BAD", "G1", "G2") == [write_queue.FAILED, write_queue.PENDING, write_queue.PENDING]
+    queue.flush_ready(now=LATER)
+    queue.flush_ready(now=LATER)
+    assert statuses(queue, "G1", "G2") == [write_queue.DONE, write_queue.DONE]
+    assert queue.status("BAD")["last_error"] == "RuntimeError: rejected"
+    assert (queue.pending_count(), queue.failed_count()) == (0, 1)
+
+    monkeypatch.undo()
+    assert queue.retry_failed() == 1
+    queue.flush_ready()
+    assert statuses(queue, "BAD") == [write_queue.DONE]
+
+
+def test_retry_drops_entries_superseded_by_a_later_save(sheets, monkeypatch):
+    ss, queue = sheets
+    ws_inv = ss.worksheet(INV_SHEET)
+    monkeypatch.setattr(ws_inv, "append_row", lambda row: (_ for _ in ()).throw(RuntimeError("down")))
+    monkeypatch.setattr(ws_inv, "append_rows", lambda rows, **kw: (_ for _ in ()).throw(RuntimeError("down")))
+    queue.enqueue_save("A", header("A", "old"), [])
+    queue.flush_ready()
+    queue.flush_ready(now=LATER)
+    assert queue.failed_count() == 1
+    monkeypatch.undo()
+    queue.enqueue_save("A", header("A", "new"), [])
+    queue.flush_ready()
+    assert queue.retry_failed() == 0
+    assert [r[2] for r in ss.worksheet(INV_SHEET).rows[1:]] == ["new"]
+
+
+def test_worker_survives_journal_errors(sheets, monkeypatch):
+    _, queue = sheets
+    monkeypatch.setattr(write_queue, "ERROR_WAIT", 0.01)
+    calls, done = [], threading.Event()
+
+    def flush_ready():
+        calls.append(time.time())
+        if len(calls) == 1: raise RuntimeError("database is locked")
+        done.set()
+        return 30
+    monkeypatch.setattr(queue, "flush_ready", flush_ready)
+    queue.start()
+    assert done.wait(5) and len(calls) == 2
+
+
+def test_a_batch_of_edits_reads_each_sheet_at_most_once(sheets):
+    ss, queue = sheets
+    queue.enqueue_saves([(no, header(no), [item("1")]) for no in ("A", "B", "C")])
+    queue.flush_ready()
+    queue.enqueue_saves([(no, header(no, "แก้"), [item("2"), item("3")]) for no in ("A", "B", "C")])
+    ss.calls.clear()
+    queue.flush_ready()
+    # ไฟล์เปลี่ยนเพราะชุดก่อนของเราเองเท่านั้น จึงไม่ต้องอ่านชีทเลย (ตรวจ modifiedTime ก่อนและหลังเขียน)
+    assert ss.calls["col_values"] == ss.calls["get"] == ss.calls["get_all_values"] == 0
+    assert ss.calls["get_lastUpdateTime"] == 2 and ss.calls["update"] == 3
+    assert [r[2] for r in ss.worksheet(INV_SHEET).rows[1:]] == ["แก้"] * 3
+    assert [(r[0], r[3]) for r in ss.worksheet(ITEM_SHEET).rows[1:]] == [(no, q) for no in "ABC" for q in "23"]
+
+    ss.worksheet(INV_SHEET).update(range_name="D2", values=[["แก้จากเครื่องอื่น"]])
+    queue.enqueue_saves([(no, header(no, "อีกครั้ง"), [item("4")]) for no in ("A", "B", "C")])
+    ss.calls.clear()
+    queue.flush_ready()
+    assert ss.calls["col_values"] == ss.calls["get_all_values"] == 2
+
+
+# ---------- หลาย queue ใช้ journal เดียวกัน ----------
+def test_entries_claimed_by_another_queue_wait_for_its_lease(sheets):
+    ss, queue = sheets
+    other = write_queue.WriteBehindQueue(queue.mirror, queue.ws_inv, queue.ws_item, lease_seconds=60)
+    queue.enqueue_saves([("A", header("A"), []), ("B", header("B"), [])])
+    _, claimed = other._claim(time.time())   # queue อื่นจองไว้แล้วค้าง (เช่นรอโควตา หรือ process ตาย)
+    assert [entry[1] for entry in claimed] == ["A", "B"] and statuses(queue, "A", "B") == [write_queue.IN_FLIGHT] * 2
+    queue.enqueue_save("C", header("C"), [])
+    assert queue.flush_ready() == 0 and 50 < queue.flush_ready() <= 60
+    assert [r[0] for r in ss.worksheet(INV_SHEET).rows[1:]] == ["C"] and queue.pending_count() == 2
+
+    queue.flush_ready(now=time.time() + 61)   # lease หมด: เขียนแทนได้
+    assert statuses(queue, "A", "B") == [write_queue.DONE] * 2
+    other._flush([(entry_id, inv_no, "{}", attempts) for entry_id, inv_no, attempts, _ in claimed])   # ผลที่มาทีหลังไม่ทับ
+    assert statuses(queue, "A", "B") == [write_queue.DONE] * 2 and queue.status("A")["attempts"] == 0
+
+
+def test_two_queues_never_write_the_same_entry(sheets, monkeypatch):
+    ss, queue = sheets
+    ws_inv = ss.worksheet(INV_SHEET)
+    append_rows = ws_inv.append_rows
+
+    def slow(rows, **kwargs):
+        time.sleep(0.05)
+        return append_rows(rows, **kwargs)
+    monkeypatch.setattr(ws_inv, "append_rows", slow)
+    queues = [queue] + [write_queue.WriteBehindQueue(queue.mirror, ws_inv, queue.ws_item, batch_size=3) for _ in range(2)]
+    nos = [f"JPP-2026-10-{i:04d}" for i in range(1, 13)]
+    queue.enqueue_saves([(no, header(no), [item("1")]) for no in nos])
+    threads = [threading.Thread(target=lambda q=q: [q.flush_ready() for _ in range(6)]) for q in queues]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert sorted(r[0] for r in ws_inv.rows[1:]) == nos
+    assert sorted(r[0] for r in ss.worksheet(ITEM_SHEET).rows[1:]) == nos
+
+
+def test_cli_flushes_without_a_worker(sheets):
+    ss, queue = sheets
+    queue.enqueue_saves([(no, header(no), [item("1")]) for no in ("A", "B")])
+    seen = []
+    queue.flush_pending(seen.append)
+    assert seen == [2, 0] and queue._thread is None
+    assert [r[0] for r in ss.worksheet(INV_SHEET).rows[1:]] == ["A", "B"]
+
+
+def test_journal_created_before_claims(tmp_path):
+    mirror = sheet_mirror.SheetMirror(str(tmp_path / "mirror.sqlite"))
+    with sqlite3.connect(mirror.path) as con:
+        con.execute("CREATE TABLE write_journal (id INTEGER PRIMARY KEY AUTOINCREMENT, invoice_no TEXT NOT NULL, "
+                    "payload TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, last_error TEXT, "
+                    "next_try REAL NOT NULL DEFAULT 0, created REAL NOT NULL, updated REAL NOT NULL)")
+        con.execute("INSERT INTO write_journal (invoice_no, payload, status, created, updated) VALUES (?, ?, ?, 0, 0)",
+                    ("A", json.dumps({"header": header("A"), "items": []}), write_queue.PENDING))
+    ss = fake_sheets.populate(0)
+    queue = write_queue.WriteBehindQueue(mirror, ss.worksheet(INV_SHEET), ss.worksheet(ITEM_SHEET))
+    queue.flush_ready()
+    assert statuses(queue, "A") == [write_queue.DONE]
@@ -0,0 +1,324 @@
+# ================= WRITE-BEHIND QUEUE =================
+# การบันทึกบิลถูกเขียนลง journal (SQLite ไฟล์เดียวกับ sheet mirror) แล้วคืนค่าทันที
+# thread เบื้องหลังจะทยอยเขียนลง Google Sheets ตามลำดับของแต่ละบิล ลองใหม่แบบ backoff เมื่อผิดพลาด
+# (รายการค้างจะทำต่อเมื่อเปิดแอปใหม่) รายการที่ผิดพลาดครบ MAX_ATTEMPTS ครั้งถูกพักไว้เป็น FAILED
+# ให้ผู้ใช้สั่งลองใหม่ได้ โดยไม่ขวางการบันทึกบิลอื่น
+# หลาย process ใช้ journal เดียวกันได้ (แอปสองตัวจาก checkout เดียว, batch_import): รายการถูก "จอง" ด้วย owner และ
+# lease ใน BEGIN IMMEDIATE ก่อนเขียน จึงไม่มีรายการใดถูกเขียนพร้อมกันสองที่ ถ้า process ที่จองตายไป รายการกลับมาเขียนได้เมื่อ lease หมด
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import perf
+import sheet_store
+from sheet_store import INV_SHEET, ITEM_SHEET
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS write_journal (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    invoice_no TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_try REAL NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    owner TEXT,                             -- worker ที่จองรายการ IN_FLIGHT ไว้
+    lease_until REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS write_journal_status ON write_journal (status, id);
+CREATE INDEX IF NOT EXISTS write_journal_invoice ON write_journal (invoice_no, id);
+"""
+
+log = logging.getLogger(__name__)
+
+PENDING, IN_FLIGHT, DONE, FAILED = "pending", "inflight", "done", "failed"
+MAX_BACKOFF = 300
+# วินาทีที่รายการที่จองแล้วเป็นของ worker นั้น (ต่ออายุระหว่างเขียน) ก่อน worker อื่นเอาไปเขียนแทนได้
+LEASE_SECONDS = float(os.environ.get("JP_WRITE_LEASE_SECONDS", 600))
+MAX_ATTEMPTS = int(os.environ.get("JP_WRITE_MAX_ATTEMPTS", 8))
+ERROR_WAIT = 5   # วินาทีที่รอหลัง journal ผิดพลาด ก่อนลองอ่านใหม่
+KEEP_DONE_SECONDS = 24 * 3600
+# รายการที่ค้างในคิวเขียนรวมกันได้ครั้งละกี่บิล (บิลใหม่ทั้งชุดใช้ append ครั้งเดียวต่อชีท)
+BATCH_SIZE = 200
+
+
+class WriteBehindQueue:
+    """Durable queue of invoice saves flushed to the sheets by one background thread.
+
+    Entries of one invoice are applied strictly in order, so later edits never
+    overtake its creation; ready entries of different invoices are written
+    together (see apply_batch). An entry that failed before is retried on its
+    own, so it cannot fail the others, and after max_attempts it is set aside
+    as FAILED (retry_failed() queues it again) instead of blocking its invoice
+    forever. Applying an entry is idempotent: the mirror is synced first and
+    an invoice that already has a header row is updated in place, so
+    replaying an entry after a crash does not duplicate rows.
+
+    Several queues may share one journal: flush_ready() claims its entries
+    (IN_FLIGHT with this queue's owner id and a lease) before writing them,
+    and entries claimed by another queue wait until its lease runs out.
+    """
+
+    def __init__(self, mirror, ws_inv, ws_item, max_backoff=MAX_BACKOFF, batch_size=BATCH_SIZE, max_attempts=MAX_ATTEMPTS,
+                 lease_seconds=LEASE_SECONDS):
+        self.mirror = mirror
+        self.ws_inv = ws_inv
+        self.ws_item = ws_item
+        self.max_backoff = max_backoff
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._renewed = 0.0
+        self._wake = threading.Event()
+        self._thread = None
+        with self._connect() as con:
+            con.executescript(_SCHEMA)
+            columns = {c[1] for c in con.execute("PRAGMA table_info(write_journal)")}
+            if "owner" not in columns: con.execute("ALTER TABLE write_journal ADD COLUMN owner TEXT")
+            if "lease_until" not in columns: con.execute("ALTER TABLE write_journal ADD COLUMN lease_until REAL NOT NULL DEFAULT 0")
+
+    def _connect(self):
+        return sqlite3.connect(self.mirror.path, timeout=30)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sheet-write-behind", daemon=True)
+            self._thread.start()
+        return self
+
+    # ---------- used by the UI ----------
+    def enqueue_save(self, inv_no, header_row, items):
+        return self.enqueue_saves([(inv_no, header_row, items)])[0]
+
+    def enqueue_saves(self, entries):
+        """Journal many saves in one transaction; returns their entry ids."""
+        now, ids = time.time(), []
+        with self._connect() as con:
+            for inv_no, header_row, items in entries:
+                items = [{k: cell_value(it.get(k)) for k in sheet_store.ITEM_FIELDS} for it in items]
+                payload = json.dumps({"header": [cell_value(v) for v in header_row], "items": items}, ensure_ascii=False, default=str)
+                ids.append(con.execute(
+                    "INSERT INTO write_journal (invoice_no, payload, status, created, updated) VALUES (?, ?, ?, ?, ?)",
+                    (str(inv_no), payload, PENDING, now, now),
+                ).lastrowid)
+        self._wake.set()
+        return ids
+
+    def status(self, inv_no):
+        """Latest journal entry of inv_no as a dict (status, attempts, last_error), or None."""
+        with self._connect() as con:
+            row = con.execute(
+                "SELECT status, attempts, last_error, updated FROM write_journal WHERE invoice_no = ? ORDER BY id DESC LIMIT 1",
+                (str(inv_no),),
+            ).fetchone()
+        return dict(zip(("status", "attempts", "last_error", "updated"), row)) if row else None
+
+    def pending_count(self):
+        return self._count(PENDING, IN_FLIGHT)
+
+    def failed_count(self):
+        return self._count(FAILED)
+
+    def _count(self, *statuses):
+        with self._connect() as con:
+            return con.execute(f"SELECT COUNT(*) FROM write_journal WHERE status IN ({','.join('?' * len(statuses))})",
+                               statuses).fetchone()[0]
+
+    def retry_failed(self):
+        """Queue the FAILED entries again with a fresh attempt count; returns how many.
+
+        Entries already superseded by a later save of the same invoice are
+        dropped instead, so an old version never overwrites a newer one.
+        """
+        with self._connect() as con:
+            con.execute("DELETE FROM write_journal AS j WHERE status = ? AND EXISTS "
+                        "(SELECT 1 FROM write_journal WHERE invoice_no = j.invoice_no AND id > j.id)", (FAILED,))
+            n = con.execute("UPDATE write_journal SET status = ?, attempts = 0, next_try = 0, updated = ? WHERE status = ?",
+                            (PENDING, time.time(), FAILED)).rowcount
+        self._wake.set()
+        return n
+
+    # ---------- background worker ----------
+    def _run(self):
+        while True:
+            # ข้อผิดพลาดของ journal เอง (เช่น database is locked) ต้องไม่ทำให้ thread นี้ตาย
+            try: wait = self.flush_ready()
+            except Exception:
+                log.exception("write-behind queue: flush failed")
+                wait = ERROR_WAIT
+            if wait > 0:
+                self._wake.wait(wait)
+                self._wake.clear()
+
+    def flush_pending(self, progress=None, poll=2.0):
+        """Write everything pending from the calling thread (CLI tools that do not start() the worker).
+
+        Returns once nothing is pending; entries set aside as FAILED do not
+        count. progress(n) is called with the number still pending.
+        """
+        while True:
+            pending = self.pending_count()
+            if progress: progress(pending)
+            if not pending: return
+            wait = self.flush_ready()
+            if wait > 0: time.sleep(min(wait, poll))
+
+    def flush_ready(self, now=None):
+        """Write the entries that are due; returns seconds until the next one is (0: more are due now)."""
+        now = now or time.time()
+        entries, batch = self._claim(now)
+        if not entries: return 30
+        if not batch:
+            first_try = {}   # รายการแรกของแต่ละบิลเท่านั้นที่รอเวลา รายการหลังจากนั้นรอรายการแรก
+            for _, inv_no, _, next_try in entries: first_try.setdefault(inv_no, next_try)
+            return max(0.0, min(first_try.values()) - now)
+        with self._connect() as con:
+            payloads = dict(con.execute(f"SELECT id, payload FROM write_journal WHERE id IN ({','.join('?' * len(batch))})",
+                                        [entry[0] for entry in batch]))
+        self._flush([(entry_id, inv_no, payloads[entry_id], attempts) for entry_id, inv_no, attempts, _ in batch])
+        return 0
+
+    def _claim(self, now):
+        # เลือกและจองรายการใน transaction เดียว queue อื่นที่ใช้ journal เดียวกันจึงเลือกรายการเดียวกันไม่ได้
+        con = sqlite3.connect(self.mirror.path, timeout=30, isolation_level=None)
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            rows = con.execute("SELECT id, invoice_no, attempts, next_try, status, lease_until FROM write_journal "
+                               "WHERE status IN (?, ?) ORDER BY id", (PENDING, IN_FLIGHT)).fetchall()
+            # รายการที่ถูกจองอยู่ขวางบิลนั้นไว้จนกว่า lease จะหมด แล้วจึงเขียนซ้ำได้ (idempotent)
+            entries = [(entry_id, inv_no, attempts, lease_until if status == IN_FLIGHT else next_try)
+                       for entry_id, inv_no, attempts, next_try, status, lease_until in rows]
+            batch = _batch(entries, now, self.batch_size)
+            self._renewed = time.time()
+            con.executemany("UPDATE write_journal SET status = ?, owner = ?, lease_until = ?, updated = ? WHERE id = ?",
+                            [(IN_FLIGHT, self.owner, self._renewed + self.lease_seconds, now, entry[0]) for entry in batch])
+            con.execute("COMMIT")
+        except:
+            if con.in_transaction: con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+        return entries, batch
+
+    def _renew(self):
+        # ต่อ lease ระหว่างเขียนชุดใหญ่ (เช่นรอโควตา) ไม่ให้ queue อื่นเข้าใจว่า worker นี้ตายแล้ว
+        now = time.time()
+        if now - self._renewed < self.lease_seconds / 4: return
+        self._renewed = now
+        with self._connect() as con:
+            con.execute("UPDATE write_journal SET lease_until = ? WHERE status = ? AND owner = ?",
+                        (now + self.lease_seconds, IN_FLIGHT, self.owner))
+
+    def _flush(self, entries):
+        try:
+            self.apply_batch([_saved(inv_no, payload) for _, inv_no, payload, _ in entries])
+        except Exception as e:
+            error, now = f"{type(e).__name__}: {e}", time.time()
+            updates = []
+            for entry_id, inv_no, _, attempts in entries:
+                attempts += 1
+                if attempts >= self.max_attempts: log.error("write-behind queue: giving up on %s after %d attempts: %s", inv_no, attempts, error)
+                delay = min(self.max_backoff, 2 ** attempts) * random.uniform(0.5, 1.5)
+                updates.append((FAILED if attempts >= self.max_attempts else PENDING, attempts, error, now + delay, now, entry_id, self.owner))
+            with self._connect() as con:
+                # เฉพาะรายการที่ยังเป็นของเรา: ถ้า lease หมดจน queue อื่นจองไปแล้ว ผลของ queue นั้นสำคัญกว่า
+                con.executemany("UPDATE write_journal SET status = ?, attempts = ?, last_error = ?, next_try = ?, updated = ?, "
+                                "owner = NULL, lease_until = 0 WHERE id = ? AND owner = ?", updates)
+            return
+        now = time.time()
+        with self._connect() as con:
+            con.executemany("UPDATE write_journal SET status = ?, last_error = NULL, updated = ?, owner = NULL, lease_until = 0 "
+                            "WHERE id = ? AND owner = ?", [(DONE, now, entry[0], self.owner) for entry in entries])
+            con.execute("DELETE FROM write_journal WHERE status = ? AND updated < ?", (DONE, now - KEEP_DONE_SECONDS))
+
+    @perf.timed("sheets.write_batch")
+    def apply_batch(self, entries):
+        """Write many (inv_no, header_row, items) at once.
+
+        Both sheets are synced once for the whole batch. Invoices the sheet
+        does not have yet are appended with one request per sheet; the others
+        are updated one by one from the synced mirror. A replay after a
+        partial write finds the appended headers and takes the update path,
+        so no rows are duplicated.
+        """
+        mirror, ws_inv, ws_item = self.mirror, self.ws_inv, self.ws_item
+        before = mirror.modified(ws_inv)
+        mirror.sync(ws_inv, modified=before)
+        mirror.sync(ws_item, modified=before)
+        new = [e for e in entries if not mirror.row_of(INV_SHEET, e[0])]
+        if new:
+            headers = [header_row for _, header_row, _ in new]
+            mirror.record_append(INV_SHEET, ws_inv.append_rows(headers), headers)
+            ranges = [r for inv_no, _, _ in new for r in mirror.row_ranges(ITEM_SHEET, inv_no)]
+            sheet_store.delete_row_ranges(ws_item, ranges)
+            mirror.record_delete(ITEM_SHEET, ranges)
+            rows = [r for inv_no, _, items in new for r in sheet_store.item_rows(inv_no, items)]
+            if rows: mirror.record_append(ITEM_SHEET, ws_item.append_rows(rows), rows)
+            self._renew()
+        appended = {inv_no for inv_no, _, _ in new}
+        for inv_no, header_row, items in entries:
+            if inv_no not in appended:
+                self._write(inv_no, header_row, items)
+                self._renew()
+        # ทุกการเขียนบันทึกลง mirror แล้ว: modifiedTime ที่เปลี่ยนเพราะเราเองจึงไม่ต้องอ่านชีทซ้ำ
+        # (การแก้จากที่อื่นที่แทรกเข้ามาระหว่างชุดนี้พอดีจะเห็นตอน full sync)
+        mirror.mark_written((INV_SHEET, ITEM_SHEET), before, mirror.modified(ws_inv))
+
+    def apply_save(self, inv_no, header_row, items):
+        """Write one invoice to the sheets: header update-or-append, then replace its item rows."""
+        self.apply_batch([(inv_no, header_row, items)])
+
+    @perf.timed("sheets.write")
+    def _write(self, inv_no, header_row, items):
+        # mirror ต้อง sync แล้ว: แต่ละการเขียนบันทึกลง mirror ทันที บิลถัดไปในชุดจึงใช้แถวที่ถูกต้องโดยไม่ต้องอ่านชีทซ้ำ
+        mirror, ws_inv, ws_item = self.mirror, self.ws_inv, self.ws_item
+        rows = sheet_store.item_rows(inv_no, items)
+        row = mirror.row_of(INV_SHEET, inv_no)
+        if row:
+            ws_inv.update(range_name=f"A{row}", values=[header_row])
+            mirror.apply_row(INV_SHEET, inv_no, header_row)
+        else:
+            mirror.record_append(INV_SHEET, ws_inv.append_row(header_row), [header_row])
+        ranges = mirror.row_ranges(ITEM_SHEET, inv_no)
+        resp = sheet_store.replace_items(ws_item, inv_no, items, ranges)
+        mirror.record_delete(ITEM_SHEET, ranges)
+        mirror.record_append(ITEM_SHEET, resp, rows)
+
+
+def _saved(inv_no, payload):
+    data = json.loads(payload)
+    return inv_no, data["header"], data["items"]
+
+
+def _batch(entries, now, size):
+    # entries: (id, invoice_no, attempts, next_try) ที่รอเขียน เรียงตาม id
+    # แต่ละบิลใช้เฉพาะรายการแรกที่ค้าง การแก้บิลเดิมครั้งถัดไปจึงไม่แซงครั้งก่อน ส่วนบิลอื่นไม่ต้องรอบิลที่กำลังรอลองใหม่
+    # รายการที่เคยผิดพลาดเขียนเดี่ยว ๆ เพื่อไม่ให้ทำให้รายการอื่นในชุดผิดพลาดไปด้วย
+    seen, batch = set(), []
+    for entry in entries:
+        _, inv_no, attempts, next_try = entry
+        if inv_no in seen: continue
+        seen.add(inv_no)
+        if next_try > now: continue
+        if attempts: return batch or [entry]
+        batch.append(entry)
+        if len(batch) >= size: break
+    return batch
+
+
+def cell_value(v):
+    # แถวใหม่จาก st.data_editor อาจมี None/NaN ซึ่ง Sheets API รับไม่ได้
+    if v is None: return ""
+    try:
+        return "" if v != v else v
+    except TypeError:   # pd.NA
+        return ""